@@ -0,0 +1,263 @@
+"""Benchmarks for rsbackup.
+
+This script generates synthetic source trees, times the phases of
+`Backup.run` and writes the results as JSON. Two result files (e.g. from two
+revisions) can be compared to detect regressions.
+
+Usage:
+
+    python benchmarks/bench.py run --files 100000 --out before.json
+    python benchmarks/bench.py run --files 100000 --out after.json
+    python benchmarks/bench.py compare before.json after.json
+
+The rsync and the native engine can be compared the same way by running the
+benchmark with `--engine rsync` and `--engine native`.
+
+Run from the repository root so that the working tree's `rsbackup` package is
+imported.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rsbackup import Backup, _parse_line  # noqa: E402
+
+
+class QuietLogger:
+    "A LoggingProtocol implementation discarding all output."
+
+    async def details(self, s: str): ...
+    async def info(self, s: str): ...
+    async def success(self, s: str): ...
+    async def warn(self, s: str): ...
+    async def start_progress(self): ...
+    async def stop_progress(self): ...
+    async def update_progress(self, completion: float, message: str): ...
+
+
+def generate_tree(root: str, files: int, depth: int, fanout: int,
+                  mean_size: int, rng: random.Random) -> typing.List[str]:
+    """Generates a tree of `files` files below `root`. Directories are nested
+    up to `depth` levels with `fanout` subdirectories each. File sizes follow
+    a log-normal distribution with the given mean. Returns the file paths.
+    """
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(d, f"d{i}") for d in level for i in range(fanout)]
+        dirs += level
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    paths = []
+    for i in range(files):
+        path = os.path.join(rng.choice(dirs), f"f{i}")
+        _write_file(path, _file_size(mean_size, rng), rng)
+        paths.append(path)
+    return paths
+
+
+def churn(paths: typing.List[str], percent: float, mean_size: int,
+          rng: random.Random):
+    """Modifies `percent` percent of `paths` in place: a third of them are
+    rewritten, a third deleted and a third replaced by new files next to
+    them."""
+    for path in rng.sample(paths, int(len(paths) * percent / 100)):
+        if not os.path.exists(path):
+            continue
+        action = rng.randrange(3)
+        if action == 0:
+            _write_file(path, _file_size(mean_size, rng), rng)
+        elif action == 1:
+            os.remove(path)
+        else:
+            _write_file(path + '.new', _file_size(mean_size, rng), rng)
+
+
+def _file_size(mean_size: int, rng: random.Random) -> int:
+    return int(rng.lognormvariate(0, 1) * mean_size / 1.65)
+
+
+def _write_file(path: str, size: int, rng: random.Random):
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(min(size, 4096)) * (size // 4096 + 1))
+        f.truncate(size)
+
+
+def _time(coro_factory) -> float:
+    start = time.perf_counter()
+    asyncio.run(coro_factory())
+    return time.perf_counter() - start
+
+
+def log_throughput(lines: int) -> float:
+    "Returns the number of rsync output lines parsed per second."
+    sample = [
+        '>f+++++++++ 12345 some/directory/with/a/file.txt',
+        'cd+++++++++ 0 some/directory/',
+        '      1,234,567  45%   12.34MB/s    0:00:05 (xfr#12, to-chk=100/200)',
+        '*deleting   0 some/old/file',
+    ]
+    start = time.perf_counter()
+    for i in range(lines):
+        _parse_line(sample[i % len(sample)])
+    return lines / (time.perf_counter() - start)
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='rsbackup_bench_', dir=args.workdir)
+    try:
+        src = os.path.join(workdir, 'src')
+        bak = os.path.join(workdir, 'bak')
+        os.makedirs(bak)
+
+        start = time.perf_counter()
+        paths = generate_tree(src, args.files, args.depth, args.fanout,
+                              args.mean_size, rng)
+        results = {'generate': time.perf_counter() - start}
+
+        kwargs = {'parallel': args.parallel, 'engine': args.engine}
+        backup = Backup([src], bak, **kwargs)
+        logger = QuietLogger()
+
+        results['full'] = _time(lambda: backup.run(logger=logger))
+
+        incremental = []
+        for _ in range(args.runs):
+            churn(paths, args.churn, args.mean_size, rng)
+            # Generation names have a resolution of one second.
+            time.sleep(1)
+            incremental.append(_time(lambda: backup.run(logger=logger)))
+        results['incremental'] = incremental
+
+        results['dry_run'] = _time(
+            lambda: backup.run(logger=logger, dry_mode=True))
+        results['log_lines_per_second'] = log_throughput(args.log_lines)
+
+        return {
+            'revision': _revision(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'parameters': {k: v for k, v in vars(args).items()
+                           if k not in ('func', 'out', 'workdir')},
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _revision() -> typing.Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(value) -> float:
+    if isinstance(value, list):
+        return sorted(value)[len(value) // 2] if value else 0.0
+    return value
+
+
+def compare(before: dict, after: dict, threshold: float) -> bool:
+    """Prints a comparison of two result sets and returns whether any timing
+    regressed by more than `threshold` percent."""
+    if before['parameters'] != after['parameters']:
+        print('warning: results were produced with different parameters')
+
+    print(f"{'phase':<22} {before['revision'] or 'before':>12} "
+          f"{after['revision'] or 'after':>12} {'change':>9}")
+
+    regressed = False
+    for phase, value in before['results'].items():
+        if phase not in after['results']:
+            continue
+        a, b = _summarize(value), _summarize(after['results'][phase])
+        change = (b - a) / a * 100 if a else 0.0
+        # Throughput values are better when higher, timings when lower.
+        worse = -change if phase.endswith('_per_second') else change
+        flag = ' !' if worse > threshold else ''
+        regressed |= worse > threshold
+        print(f"{phase:<22} {a:>12.3f} {b:>12.3f} {change:>+8.1f}%{flag}")
+
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rsbackup benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--files', type=int, default=10000,
+                            help='number of files to generate')
+    run_parser.add_argument('--depth', type=int, default=3,
+                            help='depth of the generated directory tree')
+    run_parser.add_argument('--fanout', type=int, default=8,
+                            help='number of subdirectories per directory')
+    run_parser.add_argument('--mean-size', dest='mean_size', type=int,
+                            default=16384, help='mean file size in bytes')
+    run_parser.add_argument('--churn', type=float, default=1.0,
+                            help='percentage of files changed between runs')
+    run_parser.add_argument('--runs', type=int, default=3,
+                            help='number of incremental runs')
+    run_parser.add_argument('--parallel', type=int, default=1,
+                            help='number of rsync processes per backup')
+    run_parser.add_argument('--engine', choices=('rsync', 'native'),
+                            default='rsync',
+                            help='engine used to transfer files')
+    run_parser.add_argument('--log-lines', dest='log_lines', type=int,
+                            default=1000000,
+                            help='number of lines for the log throughput test')
+    run_parser.add_argument('--seed', type=int, default=42,
+                            help='seed for the random generator')
+    run_parser.add_argument('--workdir', default=None,
+                            help='directory to create the temporary trees in')
+    run_parser.add_argument('--out', default='-',
+                            help='file to write the JSON results to')
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='regression threshold in percent')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        result = run(args)
+        if args.out == '-':
+            json.dump(result, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+        return 0
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    return 1 if compare(before, after, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
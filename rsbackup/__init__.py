@@ -7,21 +7,42 @@ file system backups on unix systems that feature
 rsbackup is primary designed for being run from the command line but it can
 also be incorporated into other applications by using the functionality 
 exported from this module.
+
+To keep the command line fast for commands that only read metadata,
+`asyncio`, `aiofiles` and the modules implementing the individual
+operations are imported by the functions using them.
 """
 
-import asyncio
+import contextlib
 import datetime
+import functools
+import json
 import os
+import re
 import shutil
+import signal
+import time
 import typing
 
-import aiofiles
-import aiofiles.os
+from rsbackup.filters import IGNORE_FILE
+from rsbackup.generations import (LAST_RUN_FILE, LATEST, LOG_FILE,
+                                  STATS_FILE, TargetLockedError,
+                                  generation_name,
+                                  incomplete_generations, latest_generation,
+                                  list_archives, list_generations,
+                                  lock_target, mark_complete, mark_incomplete,
+                                  parse_generation_name)
 
 __version__ = '0.4.0'
 __author__ = 'Alexander Metzner'
 
-_LATEST = '_latest'
+ENGINES = ('rsync', 'native')
+"The engines a `Backup` can use to transfer files."
+
+LOG_LEVELS = ('full', 'changes', 'summary')
+"""Supported log levels. `full` logs all output of rsync, `changes` only
+transferred, deleted and changed items as well as messages and `summary`
+only messages such as errors and statistics."""
 
 
 class LoggingProtocol(typing.Protocol):
@@ -37,7 +58,8 @@ class LoggingProtocol(typing.Protocol):
 
     ``start_progress``, ``stop_progress`` and ``update_progress`` will be 
     called to signal start and stop of a progress monitoring as well as updates
-    of the current progress.    
+    of the current progress. ``completion`` is a value between 0 and 1 and
+    ``message`` a human readable description of the transfer state.
     """
 
     async def details(self, s: str): ...
@@ -48,6 +70,67 @@ class LoggingProtocol(typing.Protocol):
 
     async def start_progress(self): ...
     async def stop_progress(self): ...
+    async def update_progress(self, completion: float, message: str): ...
+
+
+class BackupResult:
+    """Describes a single run of `Backup.run`.
+
+    `generation` is the path of the created generation or `None` if no
+    generation was created. `unchanged` is `True` if the run was skipped
+    because the sources did not change. `phases` maps the names of the
+    phases of the run (`summary`, `shard`, `mkdir`, `rsync`, `manifest`,
+    `symlink`) to their duration in seconds. `resumed` is the name of the
+    incomplete generation the run continued or `None`. `stats` contains the transfer
+    statistics reported by rsync (see `RSyncProcess.stats`). `error`
+    describes why the run failed or is `None` on success.
+    """
+
+    def __init__(self, start: datetime.datetime, dry_run: bool = False):
+        self.start = start
+        self.end = None
+        self.dry_run = dry_run
+        self.generation = None
+        self.resumed = None
+        self.link_dests = []
+        self.unchanged = False
+        self.phases = {}
+        self.stats = {}
+        self.error = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        return (self.end or datetime.datetime.now()) - self.start
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        "Measures the duration of the phase `name`."
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - start
+
+    def to_dict(self) -> dict:
+        "Returns a JSON serializable representation of this result."
+        return {
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat() if self.end else None,
+            'duration': self.duration.total_seconds(),
+            'dry_run': self.dry_run,
+            'generation': self.generation,
+            'resumed': self.resumed,
+            'link_dests': self.link_dests,
+            'unchanged': self.unchanged,
+            'success': self.success,
+            'error': self.error,
+            'phases': self.phases,
+            'stats': self.stats,
+        }
 
 
 class Backup:
@@ -58,7 +141,29 @@ class Backup:
 
     def __init__(self, sources: typing.Sequence[str], target: str,
                  description: typing.Optional[str] = None,
-                 excludes: typing.Optional[typing.Iterable[str]] = None):
+                 excludes: typing.Optional[typing.Iterable[str]] = None,
+                 parallel: int = 1,
+                 keep_daily: int = 0, keep_weekly: int = 0,
+                 keep_monthly: int = 0,
+                 skip_unchanged: bool = False,
+                 link_generations: int = 1,
+                 metrics_file: typing.Optional[str] = None,
+                 schedule: typing.Optional[str] = None,
+                 jitter: int = 0,
+                 log_level: str = 'full',
+                 bwlimit: typing.Union[None, int, str] = None,
+                 nice: typing.Optional[int] = None,
+                 ionice_class: typing.Optional[int] = None,
+                 ionice_level: typing.Optional[int] = None,
+                 max_load: typing.Optional[float] = None,
+                 max_disk_util: typing.Optional[float] = None,
+                 includes: typing.Optional[typing.Iterable[str]] = None,
+                 filters: typing.Optional[typing.Iterable[str]] = None,
+                 ignore_file: typing.Optional[str] = IGNORE_FILE,
+                 engine: str = 'rsync',
+                 archive_after: typing.Optional[int] = None,
+                 journal: bool = False,
+                 full_scan_interval: typing.Optional[str] = '1d'):
         """Initializes the Backup instance to use.
 
         `sources` is the sequence of source paths to create a backup from.
@@ -68,22 +173,140 @@ class Backup:
         `description` is an optional human readable description.
 
         `excludes` is an optional list of exclude patterns as defined by
+        rsync. `includes` is an optional list of include patterns taking
+        precedence over the excludes. `filters` is an optional list of raw
+        rsync filter rules such as `- *.tmp` or `+ /src/***`.
+
+        `ignore_file` is the name of the per-directory files listing further
+        patterns to exclude from the directory they reside in and all its
+        subdirectories. `None` disables ignore files.
+
+        `engine` is one of `ENGINES` and selects how files are transferred:
+        `rsync` runs rsync (see `RSync`), `native` copies files in Python
+        (see `rsbackup.native.NativeSync`) and needs no rsync binary but
+        ignores `bwlimit`, `nice` and `ionice_*`.
+
+        `parallel` is the number of rsync processes used to transfer the
+        sources. If greater than one, the sources are split into shards that
+        are transferred concurrently.
+
+        `keep_daily`, `keep_weekly` and `keep_monthly` define the retention
+        policy applied by `prune`: the newest generation of each of the last
+        that many days, weeks and months is kept.
+
+        `archive_after` is the age in days after which `archive` packs a
+        generation into a compressed archive (see `rsbackup.archive`).
+
+        If `journal` is set to `True`, runs transfer only the paths recorded
+        by `rsbackup watch` in the journal of the target instead of scanning
+        all sources (see `rsbackup.journal`). `full_scan_interval` is an
+        interval such as `1d` after which a full scan is run anyway; `None`
+        disables periodic full scans.
+
+        If `skip_unchanged` is set to `True`, a summary of the sources is
+        computed before running rsync and compared to the summary stored with
+        the previous generation. If nothing changed, no new generation is
+        created.
+
+        `link_generations` is the number of previous generations passed to
+        rsync as `--link-dest`, starting with the generation `_latest` points
+        to followed by the newest other generations. Files found unchanged in
+        any of them are hard linked instead of being copied. rsync supports
+        at most 20 generations.
+
+        `metrics_file` is an optional path of a file the results of each run
+        are written to in the Prometheus text format, e.g. for the node
+        exporter's textfile collector.
+
+        `schedule` defines when `rsbackup daemon` runs this backup. It is
+        either an interval such as `6h` or a cron expression such as
+        `30 2 * * *`. `jitter` is the maximum number of seconds a scheduled
+        run is delayed at random.
+
+        `log_level` selects the rsync output written to the compressed log
+        of each generation: `full` (everything), `changes` (transferred,
+        deleted and changed items but no hard links or directory time
+        updates) or `summary` (only messages such as errors and statistics).
+
+        `bwlimit` limits the bandwidth used by rsync (see `RSync`). `nice`,
+        `ionice_class` and `ionice_level` lower the CPU and I/O priority of
         rsync.
+
+        If `max_load` or `max_disk_util` is set, the system load and the
+        utilization (in percent) of the disks involved in the backup are
+        sampled while rsync runs. rsync is paused while either exceeds its
+        limit and resumed once the machine is idle again.
         """
         self.sources = sources
         self.target = target
         self.description = description
         self.excludes = list(excludes or [])
+        self.parallel = parallel
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.keep_monthly = keep_monthly
+        self.skip_unchanged = skip_unchanged
+        self.link_generations = link_generations
+        self.metrics_file = metrics_file
+        self.schedule = schedule
+        self.jitter = jitter
+        if log_level not in LOG_LEVELS:
+            raise ValueError(f"Invalid log_level: {log_level!r}")
+        self.log_level = log_level
+        self.bwlimit = bwlimit
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.max_load = max_load
+        self.max_disk_util = max_disk_util
+        self.includes = list(includes or [])
+        self.filters = list(filters or [])
+        self.ignore_file = ignore_file
+        if engine not in ENGINES:
+            raise ValueError(f"Invalid engine: {engine!r}")
+        self.engine = engine
+        self.archive_after = archive_after
+        self.journal = journal
+        if journal and full_scan_interval is not None:
+            from rsbackup.journal import parse_interval
+            parse_interval(full_scan_interval)
+        self.full_scan_interval = full_scan_interval
 
     def __eq__(self, other):
         return self.sources == other.sources and\
             self.target == other.target and\
             self.description == other.description and\
-            self.excludes == other.excludes
+            self.excludes == other.excludes and\
+            self.parallel == other.parallel and\
+            self.keep_daily == other.keep_daily and\
+            self.keep_weekly == other.keep_weekly and\
+            self.keep_monthly == other.keep_monthly and\
+            self.skip_unchanged == other.skip_unchanged and\
+            self.link_generations == other.link_generations and\
+            self.metrics_file == other.metrics_file and\
+            self.schedule == other.schedule and\
+            self.jitter == other.jitter and\
+            self.log_level == other.log_level and\
+            self.bwlimit == other.bwlimit and\
+            self.nice == other.nice and\
+            self.ionice_class == other.ionice_class and\
+            self.ionice_level == other.ionice_level and\
+            self.max_load == other.max_load and\
+            self.max_disk_util == other.max_disk_util and\
+            self.includes == other.includes and\
+            self.filters == other.filters and\
+            self.ignore_file == other.ignore_file and\
+            self.engine == other.engine and\
+            self.archive_after == other.archive_after and\
+            self.journal == other.journal and\
+            self.full_scan_interval == other.full_scan_interval
 
     async def run(self, logger: typing.Optional[LoggingProtocol] = None,
-                  dry_mode: bool = False, skip_latest: bool = False):
-        """Creates a new generation for this backup.
+                  dry_mode: bool = False, skip_latest: bool = False,
+                  parallel: typing.Optional[int] = None,
+                  skip_unchanged: typing.Optional[bool] = None) -> 'BackupResult':
+        """Creates a new generation for this backup and returns a
+        `BackupResult` describing the run.
 
         Output is written to `out`.
 
@@ -96,69 +319,938 @@ class Backup:
         If `skip_latest` is set to `True`, no `_latest` symlink will be used
         to create hard links for unchanged files and the link will not be
         updated after the operation.
+
+        `parallel` overrides the number of rsync processes configured for this
+        backup. All shards write into the same generation using the same
+        `--link-dest`; the run fails if any shard fails and `_latest` is only
+        updated after all shards succeeded.
+
+        `skip_unchanged` overrides the corresponding setting of this backup.
+
+        A generation is marked as incomplete until rsync finished and the
+        manifest is written. If the newest generation of a previous run is
+        still incomplete, it is renamed and reused as target so that only
+        the remaining files are transferred; rsync runs with `--partial` to
+        keep partially transferred files as well.
+
+        If the backup uses a journal and it recorded all changes since the
+        previous run, the new generation is created by hard linking the
+        previous one and only the recorded paths are transferred; the
+        sources are not split into shards then.
+
+        Unless `dry_mode` is set, the target is locked during the run. Raises
+        a `TargetLockedError` without recording a result if another run,
+        prune or archive holds the lock.
         """
-        start = datetime.datetime.now()
-        target = os.path.join(self.target, start.isoformat(
-            sep='_', timespec='seconds').replace(':', '-'))
-        latest = os.path.join(self.target, _LATEST)
-        log_file = os.path.join(target, '.log')
+        parallel = parallel or self.parallel
+        if skip_unchanged is None:
+            skip_unchanged = self.skip_unchanged
+
+        from rsbackup.filters import temporary_filter_file
+
+        with self._lock(dry_mode):
+            result = BackupResult(datetime.datetime.now(), dry_run=dry_mode)
+            try:
+                with contextlib.ExitStack() as stack:
+                    filter_file = stack.enter_context(
+                        temporary_filter_file(self.filter_rules()))
+                    await self._run(result, logger, filter_file, stack,
+                                    dry_mode=dry_mode, skip_latest=skip_latest,
+                                    parallel=parallel,
+                                    skip_unchanged=skip_unchanged)
+            except Exception as e:
+                result.error = str(e)
+                raise
+            except BaseException:
+                # Cancellation, e.g. by a stopping daemon, and keyboard
+                # interrupts do not derive from `Exception`.
+                result.error = 'cancelled'
+                raise
+            finally:
+                result.end = datetime.datetime.now()
+                if not dry_mode:
+                    self._write_results(result)
+
+        if not result.unchanged:
+            await logger.success(f"Backup of {self.sources!r} finished at '{result.start}'")
+        await logger.details(f"Took {result.duration} ({', '.join(f'{name}: {seconds:.1f}s' for name, seconds in result.phases.items())})")
+
+        return result
+
+    async def _run(self, result: 'BackupResult', logger: LoggingProtocol,
+                   filter_file: str, stack: contextlib.ExitStack,
+                   dry_mode: bool, skip_latest: bool, parallel: int,
+                   skip_unchanged: bool):
+        """Implements `run` recording the outcome in `result`. Temporary files
+        are registered with `stack`."""
+        import asyncio
+
+        import aiofiles.os
+
+        from rsbackup.changes import (changed_directories, read_summary,
+                                      summarize_sources, write_summary)
+        from rsbackup.filters import filter_report
+        from rsbackup.logfile import LogWriter
+        from rsbackup.manifest import write_manifest
+        from rsbackup.shard import shard_sources
+
+        loop = asyncio.get_running_loop()
+        target = os.path.join(self.target, generation_name(result.start))
+        latest = os.path.join(self.target, LATEST)
+        log_file = os.path.join(target, LOG_FILE)
 
         await logger.info(f"Creating new backup generation for '{', '.join(self.sources)}'")
 
         await logger.details(f"Creating backup at {target}")
 
         prev = None
+        link_dests = None
 
         if not skip_latest and os.path.exists(latest):
             prev = os.readlink(latest)
             await logger.info(
                 f"Found previous backup generation at {prev}")
+            link_dests = self._link_dests(prev)
+            if len(link_dests) > 1:
+                await logger.details(
+                    f"Linking against {len(link_dests)} previous generations")
+        result.link_dests = link_dests or []
+
+        snapshot = None
+        changes = None
+        if self.journal:
+            snapshot, changes = await self._take_journal(result, logger, link_dests)
+            if changes is not None and not changes and skip_unchanged:
+                await logger.success(
+                    f"Journal recorded no changes since {prev}; skipping backup")
+                result.unchanged = True
+                return
+
+        summary = None
+        if skip_unchanged and changes is None:
+            await logger.info('Checking sources for changes')
+            with result.phase('summary'):
+                summary = await loop.run_in_executor(
+                    None, summarize_sources, self.sources, self._summary_rules(),
+                    self.filter_rules())
+            prev_summary = read_summary(prev) if prev else None
+            if prev_summary is not None:
+                changed = changed_directories(prev_summary, summary)
+                if not changed:
+                    await logger.success(
+                        f"Sources unchanged since {prev}; skipping backup")
+                    result.unchanged = True
+                    return
+                await logger.details(f"{len(changed)} directories changed")
+
+        if changes is not None:
+            from rsbackup.journal import files_from, temporary_files_from
+
+            lists = files_from(self.sources, changes)
+            rsyncs = [RSync([base], target, delete=False,
+                            filter_file=filter_file, link_dest=link_dests,
+                            files_from=stack.enter_context(temporary_files_from(paths)),
+                            delete_missing_args=True, partial=True,
+                            bwlimit=self.bwlimit, nice=self.nice,
+                            ionice_class=self.ionice_class,
+                            ionice_level=self.ionice_level)
+                      for base, paths in lists.items()]
+        elif parallel > 1:
+            with result.phase('shard'):
+                shards = await loop.run_in_executor(
+                    None, shard_sources, self.sources, parallel)
+            await logger.info(
+                f"Splitting backup into {len(shards)} shards")
+            rsyncs = [self._transfer(shard, target, link_dests, filter_file,
+                                     relative=True)
+                      for shard in shards]
+        else:
+            rsyncs = [self._transfer(self.sources, target, link_dests,
+                                     filter_file)]
 
-        rs = RSync(self.sources, target, excludes=self.excludes, link_dest=prev)
+        incomplete = incomplete_generations(self.target)
+        resume = os.path.join(self.target, incomplete[-1]) if incomplete else None
 
         if dry_mode:
             await logger.warn(
                 'dry_mode is set to True; not going to touch any files.')
-            await logger.details(f"mkdir -p {target}")
-            await logger.details(' '.join(rs.command))
+            if resume:
+                await logger.details(f"mv {resume} {target}")
+            else:
+                await logger.details(f"mkdir -p {target}")
+            if changes is not None:
+                await logger.details(f"cp -al {link_dests[0]}/. {target}")
+            for rs in rsyncs:
+                await logger.details(' '.join(rs.command))
+
+            for rule in await loop.run_in_executor(
+                    None, filter_report, self.sources, self.filter_rules()):
+                await logger.details(
+                    f"Filter '{rule.rule}' excludes {rule.files} files ({_format_bytes(rule.bytes)})")
 
             await logger.start_progress()
-            rsync_exit_code = await rs.run(log=None, dry_run=True)
+            with result.phase('rsync'):
+                result.stats = await _run_rsyncs(rsyncs, logger, log=None,
+                                                 dry_run=True)
             await logger.stop_progress()
 
-            if rsync_exit_code != 0:
-                raise ValueError(
-                    f"rsync returned unexpected exit code {rsync_exit_code}.")
-
             if not skip_latest:
                 await logger.details(f"rm -f {latest}")
                 await logger.details(f"ln -s {target} {latest}")
         else:            
-            await aiofiles.os.makedirs(target)
-
-            async with aiofiles.open(log_file, mode='w') as f:
+            with result.phase('mkdir'):
+                if resume:
+                    await logger.info(
+                        f"Resuming incomplete generation {resume}")
+                    await aiofiles.os.rename(resume, target)
+                    result.resumed = os.path.basename(resume)
+                else:
+                    await aiofiles.os.makedirs(target)
+                mark_incomplete(target)
+            result.generation = target
+
+            if changes is not None:
+                from rsbackup.journal import link_generation
+
+                await logger.info(f"Linking previous generation {prev}")
+                skip = {p for paths in lists.values() for p in paths}
+                with result.phase('link'):
+                    await loop.run_in_executor(None, functools.partial(
+                        link_generation, link_dests[0], target, skip))
+
+            async with LogWriter(log_file, append=bool(resume)) as f:
                 await logger.info('Starting rsync')
                 await logger.details(f"writing output to {log_file}")
 
+                throttle = self._throttle()
                 await logger.start_progress()
-                rsync_exit_code = await rs.run(log=f)
+                with result.phase('rsync'):
+                    if len(rsyncs) > 1:
+                        _create_top_level_dirs(self.sources, target)
+                        result.stats = await _run_rsyncs(
+                            rsyncs, logger, log=f, log_level=self.log_level,
+                            throttle=throttle)
+                        _copy_dir_times(self.sources, target)
+                    else:
+                        result.stats = await _run_rsyncs(
+                            rsyncs, logger, log=f, log_level=self.log_level,
+                            throttle=throttle)
                 await logger.stop_progress()
-                if rsync_exit_code != 0:
-                    raise ValueError(
-                        f"rsync returned unexpected exit code {rsync_exit_code}.")
+                if throttle is not None and throttle.paused_seconds:
+                    await logger.info(
+                        f"rsync was paused for {throttle.paused_seconds:.0f}s")
 
                 await logger.details('rsync finished')
 
-            if await aiofiles.os.path.exists(latest):
-                await aiofiles.os.remove(latest)
+            await logger.info('Writing manifest')
+            with result.phase('manifest'):
+                await loop.run_in_executor(None, write_manifest, target)
+
+            if summary is not None:
+                write_summary(target, summary)
+
+            mark_complete(target)
+
+            if snapshot is not None:
+                from rsbackup import journal
+
+                journal.commit(self.target, snapshot if changes is not None
+                               else snapshot._replace(paths=None), result.start)
+
+            with result.phase('symlink'):
+                if await aiofiles.os.path.exists(latest):
+                    await aiofiles.os.remove(latest)
+
+                # TODO: Make this asynchronous
+                os.symlink(target, latest)
+
+    async def _take_journal(self, result: 'BackupResult', logger: LoggingProtocol,
+                            link_dests: typing.Optional[typing.Sequence[str]]):
+        """Takes a snapshot of the journal of this backup. Returns the
+        snapshot, if any, and the changed paths to transfer or `None` if a
+        full scan is needed."""
+        import asyncio
+
+        from rsbackup import journal
+
+        base = parse_generation_name(os.path.basename(link_dests[0]))\
+            if link_dests else None
+        interval = journal.parse_interval(self.full_scan_interval)\
+            if self.full_scan_interval is not None else None
+        with result.phase('journal'):
+            snapshot = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(journal.take, self.target, base,
+                                        result.start, interval,
+                                        journal.config_key(self)))
+        if snapshot is None:
+            await logger.warn(
+                "No journal found; is 'rsbackup watch' running? Running a full scan")
+            return None, None
+
+        reason = snapshot.reason
+        if reason is None and self.engine != 'rsync':
+            reason = f"the {self.engine} engine does not support the journal"
+        if reason is None and incomplete_generations(self.target):
+            reason = 'resuming an incomplete generation'
+        if reason is not None:
+            await logger.info(f"Running a full scan: {reason}")
+            return snapshot, None
+
+        await logger.info(
+            f"Journal recorded {len(snapshot.paths)} changed paths")
+        return snapshot, snapshot.paths
+
+    def _lock(self, dry_mode: bool) -> typing.ContextManager[None]:
+        """Returns a context manager locking the target (see `lock_target`)
+        unless `dry_mode` is set."""
+        if dry_mode:
+            return contextlib.nullcontext()
+        return lock_target(self.target)
+
+    def _write_results(self, result: 'BackupResult'):
+        """Writes `result` as JSON into the generation, records it in the
+        catalog and as the last run of the target and exports it as
+        Prometheus metrics if configured."""
+        if result.generation is not None:
+            from rsbackup import catalog
+
+            if result.success:
+                with open(os.path.join(result.generation, STATS_FILE), 'w') as f:
+                    json.dump(result.to_dict(), f, indent=2)
+
+            catalog.record(self.target,
+                           catalog.entry_from_result(result.to_dict()),
+                           replaces=result.resumed)
+
+        if os.path.isdir(self.target):
+            path = os.path.join(self.target, LAST_RUN_FILE)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(result.to_dict(), f, indent=2)
+            os.replace(path + '.tmp', path)
+
+        if self.metrics_file:
+            from rsbackup.metrics import write_metrics
+            write_metrics(self.metrics_file, self.target, result)
+
+    def _link_dests(self, prev: str) -> typing.List[str]:
+        """Returns the absolute paths of the generations to pass to rsync as
+        `--link-dest` given the generation `prev` `_latest` points to."""
+        prev = os.path.abspath(os.path.join(self.target, prev))
+        others = [os.path.abspath(os.path.join(self.target, name))
+                  for name in reversed(list_generations(self.target))]
+        others = [path for path in others if path != prev]
+        count = min(self.link_generations, _MAX_LINK_DEST)
+        return [prev] + others[:max(count - 1, 0)]
+
+    def filter_rules(self) -> typing.List[str]:
+        """Returns the rsync filter rules compiled from the excludes,
+        includes, filters and ignore files of this backup."""
+        from rsbackup.filters import compile_rules
+
+        return compile_rules(self.excludes, self.includes, self.filters,
+                             self.ignore_file)
+
+    def _summary_rules(self) -> typing.List[str]:
+        """Returns the rules that are part of the summary of the sources. The
+        excludes come first, so summaries written before includes and
+        filters were supported remain valid. Changes to ignore files change
+        the summary of their directory anyway."""
+        from rsbackup.filters import compile_rules
+
+        return self.excludes + compile_rules(includes=self.includes,
+                                             filters=self.filters)
+
+    def _transfer(self, sources: typing.Sequence[str], target: str,
+                  link_dests: typing.Optional[typing.Sequence[str]],
+                  filter_file: str, relative: bool = False):
+        """Returns the `RSync` or `NativeSync` transferring `sources` into
+        `target` depending on the configured engine."""
+        if self.engine == 'native':
+            from rsbackup.native import NativeSync
+
+            return NativeSync(sources, target, link_dest=link_dests,
+                              filter_rules=self.filter_rules(),
+                              relative=relative)
+
+        return RSync(sources, target, filter_file=filter_file,
+                     link_dest=link_dests, relative=relative, partial=True,
+                     bwlimit=self.bwlimit, nice=self.nice,
+                     ionice_class=self.ionice_class,
+                     ionice_level=self.ionice_level)
+
+    def _throttle(self) -> typing.Optional['Throttle']:
+        """Returns the `Throttle` to watch rsync with or `None` if adaptive
+        throttling is disabled."""
+        if self.max_load is None and self.max_disk_util is None:
+            return None
+
+        from rsbackup.scheduler import devices_of
+        from rsbackup.throttle import Throttle
+
+        devices = [d for d in devices_of(self) if isinstance(d, str)]
+        return Throttle(max_load=self.max_load,
+                        max_disk_util=self.max_disk_util, devices=devices)
+
+    async def plan(self, logger: LoggingProtocol,
+                   parallel: typing.Optional[int] = None) -> 'Estimate':
+        """Runs a dry run of the transfer and returns an `Estimate` of the
+        next run based on its statistics and the catalog of earlier runs.
+        Nothing is written to the target; a missing catalog is not rebuilt.
+
+        `parallel` overrides the number of rsync processes configured for this
+        backup.
+        """
+        import asyncio
+
+        from rsbackup import catalog
+        from rsbackup.filters import temporary_filter_file
+        from rsbackup.plan import Estimate, fit_throughput
+        from rsbackup.shard import shard_sources
+
+        parallel = parallel or self.parallel
+        loop = asyncio.get_running_loop()
+        target = os.path.join(self.target, generation_name(datetime.datetime.now()))
+        latest = os.path.join(self.target, LATEST)
+        link_dests = self._link_dests(os.readlink(latest))\
+            if os.path.exists(latest) else None
+
+        await logger.info(f"Planning backup of '{', '.join(self.sources)}'")
+        with temporary_filter_file(self.filter_rules()) as filter_file:
+            if parallel > 1:
+                shards = await loop.run_in_executor(
+                    None, shard_sources, self.sources, parallel)
+                rsyncs = [self._transfer(shard, target, link_dests, filter_file,
+                                         relative=True)
+                          for shard in shards]
+            else:
+                rsyncs = [self._transfer(self.sources, target, link_dests,
+                                         filter_file)]
+            for rs in rsyncs:
+                await logger.details(' '.join(rs.command))
+            stats = await _run_rsyncs(rsyncs, logger, log=None, dry_run=True)
+
+        entries = await loop.run_in_executor(None, functools.partial(
+            catalog.list_catalog, self.target, rebuild_missing=False))
+        return Estimate(self.target, stats, fit_throughput(entries))
+
+    async def prune(self, logger: LoggingProtocol, dry_mode: bool = False,
+                    workers: typing.Optional[int] = None) -> typing.List[str]:
+        """Removes all generations not kept by the retention policy and
+        returns their names.
+
+        If `dry_mode` is set to `True`, generations are only reported but not
+        removed.
+
+        `workers` is the number of threads used to remove files.
+
+        The generation `_latest` points to is never removed. Raises a
+        `ValueError` if no retention policy is configured and a
+        `TargetLockedError` if the target is locked by another process.
+        """
+        if not (self.keep_daily or self.keep_weekly or self.keep_monthly):
+            raise ValueError('No retention policy configured')
+
+        with self._lock(dry_mode):
+            return await self._prune(logger, dry_mode, workers)
+
+    async def _prune(self, logger: LoggingProtocol, dry_mode: bool,
+                     workers: typing.Optional[int]) -> typing.List[str]:
+        "Implements `prune`."
+        import asyncio
+
+        from rsbackup import archive, catalog
+        from rsbackup.prune import generations_to_prune, remove_generations
 
-            # TODO: Make this asynchronous
-            os.symlink(target, latest)
+        loop = asyncio.get_running_loop()
+        names = await loop.run_in_executor(None, functools.partial(
+            generations_to_prune, self.target, keep_daily=self.keep_daily,
+            keep_weekly=self.keep_weekly, keep_monthly=self.keep_monthly))
 
-        end = datetime.datetime.now()
+        if not names:
+            await logger.info(f"No generations to prune in {self.target}")
+            return names
 
-        await logger.success(f"Backup of {self.sources!r} finished at '{start}'")
-        await logger.details(f"Took {end - start}")
+        for name in names:
+            await logger.details(f"rm -rf {os.path.join(self.target, name)}")
+
+        if dry_mode:
+            await logger.warn(
+                'dry_mode is set to True; not going to touch any files.')
+            return names
+
+        await logger.info(f"Removing {len(names)} generations")
+        await logger.start_progress()
+        try:
+            copied = await loop.run_in_executor(None, archive.detach, self.target,
+                                                names)
+            if copied:
+                await logger.details(
+                    f"Copied {copied} files referenced by archives into the archives")
+            await loop.run_in_executor(None, remove_generations, self.target,
+                                       names, workers)
+            catalog.remove(self.target, names)
+        finally:
+            await logger.stop_progress()
+
+        await logger.success(f"Removed {len(names)} generations from {self.target}")
+        return names
+
+    async def archive(self, logger: LoggingProtocol, dry_mode: bool = False,
+                      older_than: typing.Optional[int] = None,
+                      workers: typing.Optional[int] = None) -> typing.List[str]:
+        """Packs all generations older than `older_than` days into archives
+        and returns their names. `older_than` defaults to `archive_after`.
+
+        If `dry_mode` is set to `True`, generations are only reported but not
+        archived.
+
+        `workers` is the number of threads used to compress data.
+
+        The generation `_latest` points to is never archived. Raises a
+        `ValueError` if no age is given or configured and a
+        `TargetLockedError` if the target is locked by another process.
+        """
+        if older_than is None:
+            older_than = self.archive_after
+        if older_than is None:
+            raise ValueError('No archive age configured')
+
+        with self._lock(dry_mode):
+            return await self._archive(logger, dry_mode, older_than, workers)
+
+    async def _archive(self, logger: LoggingProtocol, dry_mode: bool,
+                       older_than: int,
+                       workers: typing.Optional[int]) -> typing.List[str]:
+        "Implements `archive`."
+        import asyncio
+
+        from rsbackup.archive import archive_generation, generations_to_archive
+
+        names = generations_to_archive(self.target,
+                                       datetime.timedelta(days=older_than))
+        if not names:
+            await logger.info(f"No generations to archive in {self.target}")
+            return names
+
+        for name in names:
+            await logger.details(f"archive {os.path.join(self.target, name)}")
+
+        if dry_mode:
+            await logger.warn(
+                'dry_mode is set to True; not going to touch any files.')
+            return names
+
+        await logger.info(f"Archiving {len(names)} generations")
+        loop = asyncio.get_running_loop()
+        await logger.start_progress()
+        try:
+            for i, name in enumerate(names):
+                await logger.update_progress(i / len(names), name)
+                result = await loop.run_in_executor(None, functools.partial(
+                    archive_generation, self.target, name, workers=workers))
+                await logger.details(
+                    f"{name}: {result.entries} entries, "
+                    f"{_format_bytes(result.bytes - result.referenced_bytes)} stored in "
+                    f"{_format_bytes(result.stored_bytes)}, {result.referenced} files "
+                    f"({_format_bytes(result.referenced_bytes)}) referenced")
+        finally:
+            await logger.stop_progress()
+
+        await logger.success(f"Archived {len(names)} generations in {self.target}")
+        return names
+
+    async def restore(self, logger: LoggingProtocol, path: str, dest: str,
+                      generation: typing.Optional[str] = None,
+                      workers: typing.Optional[int] = None) -> 'RestoreResult':
+        """Restores `path` from a generation of this backup to `dest` and
+        returns the `RestoreResult`.
+
+        `path` is relative to the generation. `generation` is the name of the
+        generation to restore from and defaults to the one `_latest` points
+        to. `workers` is the number of threads used to copy files. Archived
+        generations are restored from their archive using a single thread.
+
+        Raises a `ValueError` if the generation or `path` does not exist.
+        """
+        import asyncio
+
+        from rsbackup.archive import Archive, archive_path, restore_archive
+        from rsbackup.restore import RestoreResult, restore_tree
+
+        generation = generation or latest_generation(self.target)
+        if generation is not None and generation in list_archives(self.target):
+            source = archive_path(self.target, generation)
+            with Archive(source) as a:
+                if a.entry(path.strip('/')) is None:
+                    raise ValueError(f"{path} not found in {generation}")
+            restore = functools.partial(restore_archive, source, path, dest)
+        else:
+            if generation is None or generation not in list_generations(self.target):
+                raise ValueError(f"No such generation: {generation}")
+
+            source = os.path.join(self.target, generation, path.strip('/'))
+            if not os.path.lexists(source):
+                raise ValueError(f"{path} not found in {generation}")
+            restore = functools.partial(restore_tree, source, dest, workers=workers)
+
+        loop = asyncio.get_running_loop()
+
+        def on_progress(result: RestoreResult):
+            completion = result.bytes / result.total_bytes if result.total_bytes else 1
+            asyncio.run_coroutine_threadsafe(logger.update_progress(
+                completion, f"{result.files} files, {_format_bytes(result.bytes)} "
+                            f"of {_format_bytes(result.total_bytes)}"), loop)
+
+        await logger.info(f"Restoring {source} to {dest}")
+        await logger.start_progress()
+        try:
+            result = await loop.run_in_executor(None, functools.partial(
+                restore, on_progress=on_progress))
+        finally:
+            await logger.stop_progress()
+
+        await logger.details(
+            f"{result.files} files ({_format_bytes(result.bytes)}), "
+            f"{result.dirs} directories, {result.links} symlinks and "
+            f"{result.hardlinks} hardlinks restored")
+        return result
+
+
+async def _run_rsyncs(rsyncs: typing.Sequence['RSync'],
+                      logger: LoggingProtocol, log=None,
+                      dry_run: bool = False,
+                      log_level: str = 'full',
+                      throttle: typing.Optional['Throttle'] = None) -> typing.Dict[str, float]:
+    """Runs all `rsyncs` concurrently and raises a `ValueError` if any of
+    them returns a non-zero exit code. The progress of all processes is
+    combined and reported to `logger`. The output of all processes is
+    written to `log` according to `log_level`. If `throttle` is given, it
+    pauses the processes while the system is busy. Returns the combined
+    statistics of all processes.
+    """
+    import asyncio
+
+    progress = {}
+    processes = []
+
+    async def run(index: int, rs: 'RSync'):
+        process = await rs.start(log=log, dry_run=dry_run, log_level=log_level)
+        processes.append(process)
+        try:
+            async for event in process:
+                if isinstance(event, Progress):
+                    progress[index] = event
+                    await logger.update_progress(*_combine_progress(progress.values()))
+            return await process.wait(), process.stats
+        except asyncio.CancelledError:
+            process.terminate()
+            raise
+
+    watcher = asyncio.create_task(throttle.watch(processes, logger))\
+        if throttle is not None else None
+    try:
+        results = await asyncio.gather(*(run(i, rs) for i, rs in enumerate(rsyncs)))
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await watcher
+
+    failed = [c for c, _ in results if c != 0]
+    if failed:
+        raise ValueError(
+            f"rsync returned unexpected exit code {failed[0]}.")
+
+    return _combine_stats([stats for _, stats in results])
+
+
+def _combine_stats(stats: typing.Sequence[typing.Dict[str, float]]) -> typing.Dict[str, float]:
+    """Combines the statistics of rsync processes run concurrently. Times are
+    combined using the maximum, the speedup is recomputed, all other values
+    are summed up."""
+    if len(stats) == 1:
+        return stats[0]
+
+    combined = {}
+    for s in stats:
+        for key, value in s.items():
+            if key.endswith('_time'):
+                combined[key] = max(combined.get(key, 0), value)
+            else:
+                combined[key] = combined.get(key, 0) + value
+
+    sent = combined.get('total_bytes_sent', 0) + combined.get('total_bytes_received', 0)
+    if 'speedup' in combined and sent:
+        combined['speedup'] = combined.get('total_file_size', 0) / sent
+    return combined
+
+
+def _combine_progress(progress: typing.Iterable['Progress']) -> typing.Tuple[float, str]:
+    """Combines the latest progress events of multiple rsync processes and
+    returns the overall completion and a message to display.
+    """
+    progress = list(progress)
+    transferred = sum(p.transferred for p in progress)
+    total = sum(p.transferred * 100 / p.percent if p.percent else p.transferred
+                for p in progress)
+    rate = sum(p.rate for p in progress)
+    eta = max(p.eta for p in progress)
+
+    completion = min(transferred / total, 1.0) if total else 0.0
+    return completion, f"{_format_bytes(transferred)} at {_format_bytes(rate)}/s, ETA {eta}"
+
+
+def _format_bytes(n: float) -> str:
+    "Formats the number of bytes `n` using binary prefixes."
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(n) < 1024 or unit == 'TiB':
+            break
+        n /= 1024
+    return f"{n:.1f} {unit}" if unit != 'B' else f"{int(n)} B"
+
+
+def _create_top_level_dirs(sources: typing.Sequence[str], target: str):
+    """Creates the top-level source directories inside `target` so that
+    concurrently running shards do not race for creating them.
+    """
+    for source in sources:
+        if os.path.isdir(source) and not os.path.islink(source):
+            os.makedirs(os.path.join(target, os.path.basename(source)),
+                        exist_ok=True)
+
+
+def _copy_dir_times(sources: typing.Sequence[str], target: str):
+    """Restores the timestamps of the top-level source directories inside
+    `target`. Shards running concurrently modify these directories after the
+    shard that transferred a directory's attributes has finished.
+    """
+    for source in sources:
+        if os.path.isdir(source) and not os.path.islink(source):
+            st = os.stat(source)
+            os.utime(os.path.join(target, os.path.basename(source)),
+                     ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+class FileTransferred(typing.NamedTuple):
+    """Emitted when rsync transferred the file at `path` (relative to the
+    target) with `size` bytes. `itemized` contains rsync's itemized change
+    summary."""
+    path: str
+    size: int
+    itemized: str
+
+
+class FileLinked(typing.NamedTuple):
+    """Emitted when rsync created `path` as a hard link to `link_target`."""
+    path: str
+    size: int
+    itemized: str
+    link_target: typing.Optional[str] = None
+
+
+class FileDeleted(typing.NamedTuple):
+    "Emitted when rsync deleted `path` from the target."
+    path: str
+
+
+class ItemChanged(typing.NamedTuple):
+    """Emitted for all other itemized changes, such as created directories
+    or symbolic links."""
+    path: str
+    itemized: str
+
+
+class Progress(typing.NamedTuple):
+    """Emitted when rsync reports the overall progress of the transfer.
+
+    `transferred` is the number of bytes transferred so far, `percent` the
+    completion in percent of the files rsync knows about, `rate` the current
+    transfer rate in bytes per second and `eta` the estimated remaining time.
+    """
+    transferred: int
+    percent: int
+    rate: float
+    eta: datetime.timedelta
+
+
+class Message(typing.NamedTuple):
+    "Emitted for any other line rsync outputs."
+    text: str
+
+
+RSyncEvent = typing.Union[FileTransferred, FileLinked, FileDeleted,
+                          ItemChanged, Progress, Message]
+
+_ITEMIZED_FORMAT = '%i %l %n%L'
+_MAX_LINK_DEST = 20
+_ITEMIZED_LINE = re.compile(r'^([<>ch.][fdLDS].{7,9}) (\d+) (.*)$')
+_DELETED_LINE = re.compile(r'^\*deleting\s+(?:\d+ )?(.*)$')
+_PROGRESS_LINE = re.compile(
+    r'^\s*([\d,.]+)\s+(\d+)%\s+([\d.,]+)([kMGT]?B)/s\s+(\d+):(\d\d):(\d\d)')
+_STATS_LINE = re.compile(r'^([A-Z][a-z]+(?: [a-z]+)*): ([\d,]+(?:\.\d+)?)')
+_SPEEDUP_LINE = re.compile(r'^total size is [\d,]+\s+speedup is ([\d,.]+)')
+_ESCAPED_CHAR = re.compile(rb'\\#([0-7]{3})')
+_RATE_UNITS = {'B': 1, 'kB': 2**10, 'MB': 2**20, 'GB': 2**30, 'TB': 2**40}
+
+
+def _decode(data: bytes) -> str:
+    """Decodes a line of rsync output. rsync escapes unprintable characters
+    as `\\#ooo`; these are turned back into the original bytes, which are
+    then decoded like file system paths.
+    """
+    return os.fsdecode(_ESCAPED_CHAR.sub(lambda m: bytes((int(m[1], 8),)), data))
+
+
+def _should_log(event: RSyncEvent, level: str) -> bool:
+    "Returns whether `event` is written to the log with `level`."
+    if isinstance(event, Progress):
+        return False
+    if level == 'summary':
+        return isinstance(event, Message)
+    if level == 'changes':
+        if isinstance(event, FileLinked):
+            return False
+        if isinstance(event, ItemChanged) and event.itemized.startswith('.d'):
+            return False
+    return True
+
+
+def _parse_number(s: str) -> typing.Union[int, float]:
+    s = s.replace(',', '')
+    return float(s) if '.' in s else int(s)
+
+
+def _parse_line(line: str) -> RSyncEvent:
+    "Parses a single line of rsync output into an event."
+
+    if m := _PROGRESS_LINE.match(line):
+        return Progress(
+            transferred=int(re.sub(r'[,.]', '', m[1])),
+            percent=int(m[2]),
+            rate=float(m[3].replace(',', '.')) * _RATE_UNITS[m[4]],
+            eta=datetime.timedelta(hours=int(m[5]), minutes=int(m[6]),
+                                   seconds=int(m[7])))
+
+    if m := _DELETED_LINE.match(line):
+        return FileDeleted(m[1])
+
+    if m := _ITEMIZED_LINE.match(line):
+        itemized, size, path = m[1], int(m[2]), m[3]
+        if itemized[0] == 'h':
+            path, _, link_target = path.partition(' => ')
+            return FileLinked(path, size, itemized, link_target or None)
+        if itemized[1] == 'f' and itemized[0] in '<>':
+            return FileTransferred(path, size, itemized)
+        if itemized[1] == 'L':
+            path, _, _ = path.partition(' -> ')
+        return ItemChanged(path, itemized)
+
+    return Message(line)
+
+
+class RSyncProcess:
+    """A running rsync process.
+
+    Iterating asynchronously over an `RSyncProcess` yields the events parsed
+    from rsync's output until the process closes its output. Output is read
+    in large chunks, so neither long lines nor undecodable file names affect
+    processing. Every chunk's lines are written to the log with a single
+    call.
+    """
+
+    _CHUNK_SIZE = 2**16
+
+    def __init__(self, process: 'asyncio.subprocess.Process', log=None,
+                 log_level: str = 'full'):
+        self._process = process
+        self._log = log
+        self._log_level = log_level
+        self.paused = False
+        self.stats = {}
+        """The statistics reported by rsync when run with `--stats`. Keys
+        are derived from rsync's labels, e.g. `number_of_files`,
+        `total_transferred_file_size`, `file_list_generation_time`,
+        `total_bytes_sent` and `speedup`. Sizes are in bytes, times in
+        seconds."""
+
+    @property
+    def pid(self) -> int:
+        "The process id of rsync."
+        return self._process.pid
+
+    def __aiter__(self) -> typing.AsyncIterator[RSyncEvent]:
+        return self._events()
+
+    async def _events(self):
+        buffer = b''
+        while True:
+            data = await self._process.stdout.read(self._CHUNK_SIZE)
+            if not data:
+                break
+
+            *lines, buffer = re.split(rb'[\r\n]', buffer + data)
+            lines = [_decode(line) for line in lines if line]
+            events = [_parse_line(line) for line in lines]
+
+            if self._log is not None:
+                out = ''.join(line + '\n' for line, event in zip(lines, events)
+                              if _should_log(event, self._log_level))
+                if out:
+                    await self._log.write(out)
+
+            for event in events:
+                if isinstance(event, Message):
+                    self._collect_stats(event.text)
+                yield event
+
+        if buffer:
+            line = _decode(buffer)
+            event = _parse_line(line)
+            if self._log is not None and _should_log(event, self._log_level):
+                await self._log.write(line + '\n')
+            if isinstance(event, Message):
+                self._collect_stats(event.text)
+            yield event
+
+    def _collect_stats(self, line: str):
+        if m := _STATS_LINE.match(line):
+            self.stats[m[1].lower().replace(' ', '_')] = _parse_number(m[2])
+        elif m := _SPEEDUP_LINE.match(line):
+            self.stats['speedup'] = _parse_number(m[1])
+
+    def terminate(self):
+        "Terminates the process if it is still running."
+        if self._process.returncode is None:
+            self._process.terminate()
+            self.resume()
+
+    def pause(self):
+        """Stops the process using `SIGSTOP` until `resume` is called. rsync's
+        helper processes block as soon as they run out of data."""
+        if not self.paused:
+            self.paused = self._signal(signal.SIGSTOP)
+
+    def resume(self):
+        "Continues the process if it has been paused."
+        if self.paused:
+            self._signal(signal.SIGCONT)
+            self.paused = False
+
+    def _signal(self, sig: int) -> bool:
+        if self._process.returncode is not None:
+            return False
+        try:
+            self._process.send_signal(sig)
+        except ProcessLookupError:
+            return False
+        return True
+
+    async def wait(self) -> int:
+        """Waits for the process to terminate and returns its exit code.
+        Remaining output is discarded."""
+        async for _ in self:
+            pass
+        return await self._process.wait()
 
 
 class RSync:
@@ -178,14 +1270,50 @@ class RSync:
     `--delete`.
 
     If `link_dest` is not `None` it must be string value which points to a
-    directory which is passed to rsync as `--link-dest`. See the documentation
-    for rsync for an explanation of `--link-dest`.
+    directory or a sequence of up to 20 such values which are passed to rsync
+    as `--link-dest` in the given order. See the documentation for rsync for
+    an explanation of `--link-dest`.
 
     If `excludes` is not `None` it must be an iterable of strings each being
     given to rsync as `--exclude`. See the rsync documentation for an
     explanation of `--exclude` including a formal definition of the pattern
     syntax supported by exclude.
 
+    If `filter_file` is not `None` it must be the path of a file containing
+    rsync filter rules which is passed to rsync as `--filter=merge FILE`.
+
+    If `itemize` is set to `True` (the default) rsync outputs an itemized
+    list of changes including file sizes, which is parsed into events.
+
+    If `progress` is set to `True` (the default) rsync reports the overall
+    progress using `--info=progress2`. This requires rsync 3.1 or later.
+
+    If `stats` is set to `True` (the default) rsync is invoked with `--stats`
+    and the statistics are parsed into `RSyncProcess.stats`.
+
+    If `partial` is set to `True` rsync will be invoked with `--partial` to
+    keep partially transferred files if interrupted.
+
+    If `relative` is set to `True` rsync will be invoked with `--relative`.
+    Source paths may then contain a `/./` component to mark the part of the
+    path that is recreated inside the target.
+
+    If `files_from` is not `None` it must be the path of a file listing the
+    paths to transfer relative to the single source separated by NUL
+    characters, passed to rsync as `--files-from` and `--from0`.
+
+    If `delete_missing_args` is set to `True` rsync will be invoked with
+    `--delete-missing-args` to delete listed paths missing in the source
+    from the target.
+
+    If `bwlimit` is not `None` it is passed to rsync as `--bwlimit`, i.e. an
+    integer in KiB per second or a string with a unit suffix such as `10M`.
+
+    If `nice` is not `None` rsync is run using `nice` with that adjustment.
+    If `ionice_class` is not `None` rsync is run using `ionice` with that
+    scheduling class (1: realtime, 2: best-effort, 3: idle) and
+    `ionice_level` as the priority within the class.
+
     If `binary` is not `None` it will be used as the binary to execute rsync,
     i.e. `/usr/bin/rsync`. If `None`, binary will be determined from the `PATH`
     environment variable.
@@ -194,8 +1322,20 @@ class RSync:
     def __init__(self, sources: typing.Sequence[str], target: str, 
                  archive: bool = True,
                  verbose: bool = True, delete: bool = True,
-                 link_dest: str = None,
+                 link_dest: typing.Union[None, str, typing.Sequence[str]] = None,
                  excludes: typing.Optional[typing.Iterable[str]] = None,
+                 filter_file: typing.Optional[str] = None,
+                 relative: bool = False,
+                 partial: bool = False,
+                 files_from: typing.Optional[str] = None,
+                 delete_missing_args: bool = False,
+                 itemize: bool = True,
+                 progress: bool = True,
+                 stats: bool = True,
+                 bwlimit: typing.Union[None, int, str] = None,
+                 nice: typing.Optional[int] = None,
+                 ionice_class: typing.Optional[int] = None,
+                 ionice_level: typing.Optional[int] = None,
                  binary: typing.Optional[str] = None):
         self.sources = sources
         self.target = target
@@ -203,42 +1343,73 @@ class RSync:
         self.verbose = verbose
         self.delete = delete
         self.link_dest = link_dest
+        if self.link_dest is not None and not isinstance(self.link_dest, str)\
+                and len(self.link_dest) > _MAX_LINK_DEST:
+            raise ValueError(
+                f"rsync supports at most {_MAX_LINK_DEST} link-dest directories")
         self.excludes = excludes
+        self.filter_file = filter_file
+        self.relative = relative
+        self.partial = partial
+        self.files_from = files_from
+        self.delete_missing_args = delete_missing_args
+        self.itemize = itemize
+        self.progress = progress
+        self.stats = stats
+        self.bwlimit = bwlimit
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
         self.binary = binary or shutil.which('rsync')
 
-    async def run(self,
-                  log=None,
-                  dry_run=False):
+    async def start(self, log=None, dry_run=False,
+                    log_level: str = 'full') -> 'RSyncProcess':
         """
-        runs the configured rsync process asyncroniously.
+        starts the configured rsync process asyncroniously.
 
-        Returns a coroutine that when awaited produces rsync's exit code.
+        Returns an `RSyncProcess` which can be iterated asynchronously to
+        receive the events parsed from rsync's output.
 
-        `log` can be an `write`able to write log output to. If `None` log is
-        silently discarded.
+        `log` can be an async `write`able to write log output to. If `None`
+        log is silently discarded. Progress lines are never written to `log`.
+        `log_level` is one of `LOG_LEVELS` and selects the lines
+        written to `log`.
         """
+        import asyncio
 
         p = await asyncio.create_subprocess_exec(
-            self.binary,
-            *self._args(dry_run=dry_run),
+            *self._command(dry_run=dry_run),
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.STDOUT,
             stdin=asyncio.subprocess.DEVNULL,
             env={
                 'LC_NUMERIC': 'en.US',
             }
-            # limit=2**32,
         )
 
-        while True:
-            data = await p.stdout.readuntil()
-            line = data.decode('ascii').rstrip()
-            if not line:
-                break
+        return RSyncProcess(p, log, log_level)
+
+    async def run(self,
+                  log=None,
+                  dry_run=False,
+                  on_event: typing.Optional[typing.Callable[[RSyncEvent], typing.Awaitable]] = None):
+        """
+        runs the configured rsync process asyncroniously.
+
+        Returns a coroutine that when awaited produces rsync's exit code.
 
-            await log.write(line + '\n')
+        `log` can be an `write`able to write log output to. If `None` log is
+        silently discarded.
+
+        `on_event` is an optional coroutine function called with every event
+        parsed from rsync's output.
+        """
+        process = await self.start(log=log, dry_run=dry_run)
+        async for event in process:
+            if on_event is not None:
+                await on_event(event)
 
-        return await p.wait()
+        return await process.wait()
 
     def _args(self, dry_run=False):
         args = []
@@ -252,23 +1423,67 @@ class RSync:
         if self.delete:
             args.append('--delete')
 
+        if self.relative:
+            args.append('--relative')
+
+        if self.partial:
+            args.append('--partial')
+
+        if self.files_from is not None:
+            args.append(f"--files-from={self.files_from}")
+            args.append('--from0')
+
+        if self.delete_missing_args:
+            args.append('--delete-missing-args')
+
+        if self.itemize:
+            args.append(f"--out-format={_ITEMIZED_FORMAT}")
+
+        if self.progress:
+            args.append('--info=progress2')
+
+        if self.stats:
+            args.append('--stats')
+
+        if self.bwlimit is not None:
+            args.append(f"--bwlimit={self.bwlimit}")
+
         if dry_run:
             args.append('--dry-run')
 
         args += self.sources
 
         if self.link_dest:
-            args.append('--link-dest')
-            args.append(self.link_dest)
+            link_dests = [self.link_dest] if isinstance(self.link_dest, str)\
+                else self.link_dest
+            for link_dest in link_dests:
+                args.append('--link-dest')
+                args.append(link_dest)
 
         if self.excludes:
             for exclude in self.excludes:
                 args.append(f"--exclude={exclude}")
 
+        if self.filter_file:
+            args.append(f"--filter=merge {self.filter_file}")
+
         args.append(self.target)
 
         return args
 
+    def _command(self, dry_run=False):
+        prefix = []
+
+        if self.nice is not None:
+            prefix += ['nice', '-n', str(self.nice)]
+
+        if self.ionice_class is not None:
+            prefix += ['ionice', '-c', str(self.ionice_class)]
+            if self.ionice_level is not None:
+                prefix += ['-n', str(self.ionice_level)]
+
+        return prefix + [self.binary] + self._args(dry_run=dry_run)
+
     @property
     def command(self):
-        return [self.binary] + self._args()
+        return self._command()
@@ -1,37 +1,99 @@
 import argparse
-import asyncio
+import datetime
+import functools
 import os
+import json
 import platform
 import sys
+import typing
 
 import tomli
 
-from termapp.styles import BOLD, FG_CYAN
-from termapp.asyncio import AppProtocol, create_app
+from termapp.styles import BOLD, FG_CYAN, FG_GREEN, FG_RED, apply_styles
 from rsbackup import Backup, LoggingProtocol, __version__
+from rsbackup import _format_bytes
+from rsbackup.filters import IGNORE_FILE
+from rsbackup.generations import (LATEST, incomplete_generations,
+                                  latest_generation, list_archives,
+                                  list_generations, parse_generation_name,
+                                  read_last_run)
+
+# Commands that only read metadata (list and status) run synchronously
+# without importing asyncio and termapp's app. All other commands import
+# the modules they need when they run.
+if typing.TYPE_CHECKING:
+    from termapp.asyncio import AppProtocol
+
+
+class Output:
+    """A minimal synchronous counterpart of termapp's app used by the
+    commands that only read metadata. Styles are only applied if `out` is a
+    tty."""
+
+    def __init__(self, out=None):
+        self._out = out or sys.stdout
+        self._styled = self._out.isatty()
+
+    def write(self, s: str, *styles: str):
+        if styles and self._styled:
+            s = apply_styles(s, *styles)
+        self._out.write(s)
+
+    def write_line(self, line: str = '', *styles: str):
+        self.write(line, *styles)
+        self._out.write('\n')
 
 
 class AppLoggingProtocolAdapter(LoggingProtocol):
-    def __init__(self, app: AppProtocol):
+    """Adapts an `AppProtocol` to the `LoggingProtocol`.
+
+    If `prefix` is given, every message is prefixed with it; this is used to
+    tell apart the output of backups running concurrently. If `progress` is
+    `False` progress indicators are suppressed.
+    """
+
+    def __init__(self, app: 'AppProtocol', prefix: typing.Optional[str] = None,
+                 progress: bool = True):
         self._app = app
+        self._prefix = f"[{prefix}] " if prefix else ''
+        self._progress = progress
 
     async def details(self, s: str):
-        await self._app.details(s)
+        await self._app.details(self._prefix + s)
 
     async def info(self, s: str):
-        await self._app.info(s)
+        await self._app.info(self._prefix + s)
 
     async def success(self, s: str):
-        await self._app.success(s)
+        await self._app.success(self._prefix + s)
 
     async def warn(self, s: str):
-        await self._app.info(s)
+        await self._app.info(self._prefix + s)
 
     async def start_progress(self):
-        await self._app.start_progress(show_completion=False)
+        if self._progress:
+            await self._app.start_progress(show_completion=True)
 
     async def stop_progress(self):
-        await self._app.stop_progress()
+        if self._progress:
+            await self._app.stop_progress()
+
+    async def update_progress(self, completion: float, message: str):
+        if self._progress:
+            await self._app.update_progress(completion=completion,
+                                            message=message)
+
+
+class _NullLogger(LoggingProtocol):
+    "Discards all output, e.g. when printing machine readable output."
+
+    async def details(self, s: str): ...
+    async def info(self, s: str): ...
+    async def success(self, s: str): ...
+    async def warn(self, s: str): ...
+    async def start_progress(self): ...
+    async def stop_progress(self): ...
+    async def update_progress(self, completion: float, message: str): ...
 
 
 def config_file_path(file_name: str) -> str:
@@ -42,6 +104,24 @@ def config_file_path(file_name: str) -> str:
             return os.path.join(os.getenv('HOME'), '.config', file_name)
 
 
+def socket_file_path(file_name: str) -> str:
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, file_name)
+    return os.path.join(os.getenv('HOME'), '.cache', file_name)
+
+
+def _positive_int(s: str) -> int:
+    "Parses a command line argument that must be a positive integer."
+    try:
+        value = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {s!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {s!r}")
+    return value
+
+
 def main(args=None):
     """The main entry point for running rsbackup from the command line.
 
@@ -59,9 +139,50 @@ def main(args=None):
     subparsers.add_parser('list', aliases=(
         'ls',), help='list available configs')
 
+    status_parser = subparsers.add_parser(
+        'status', help='show the state of the generations of all configs')
+    status_parser.add_argument(
+        '--json', dest='json',
+        action='store_true', default=False,
+        help='output the status as JSON'
+    )
+
+    generations_parser = subparsers.add_parser(
+        'generations', help='list the generations of a config from its catalog')
+    generations_parser.add_argument(
+        '--rebuild', dest='rebuild',
+        action='store_true', default=False,
+        help='rebuild the catalog from the generations on disk'
+    )
+    generations_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config')
+
+    diff_parser = subparsers.add_parser(
+        'diff', help='list the differences between two generations')
+    diff_parser.add_argument(
+        '--json', dest='json',
+        action='store_true', default=False,
+        help='output one JSON object per difference'
+    )
+    diff_parser.add_argument(
+        '--walk', dest='walk',
+        action='store_true', default=False,
+        help='walk the generations even if they have manifests'
+    )
+    diff_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config')
+    diff_parser.add_argument(
+        'old', metavar='GEN_A', type=str,
+        help='name of the older generation')
+    diff_parser.add_argument(
+        'new', metavar='GEN_B', type=str, nargs='?', default=None,
+        help='name of the newer generation; defaults to the latest')
+
     create_parser = subparsers.add_parser(
         'create', aliases=('c',),
-        help='create a new generation for the named backup configuration')
+        help='create a new generation for the named backup configurations')
     create_parser.add_argument(
         '-m', '--dry-run', dest='dry_run',
         action='store_true', default=False,
@@ -73,24 +194,331 @@ def main(args=None):
         help='skip linking unchanged files to latest copy (if exists)'
     )
     create_parser.add_argument(
-        'config', metavar='CONFIG', type=str, nargs=1,
-        help='name of the config to run')
+        '--skip-unchanged', dest='skip_unchanged',
+        action='store_true', default=None,
+        help='do not create a new generation if no source changed'
+    )
+    create_parser.add_argument(
+        '-p', '--parallel', dest='parallel', type=int, default=None,
+        help='number of rsync processes to run for each backup'
+    )
+    create_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='create a new generation for all configs'
+    )
+    create_parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=_positive_int, default=None,
+        help='maximum number of backups to run concurrently'
+    )
+    create_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to run')
+
+    plan_parser = subparsers.add_parser(
+        'plan',
+        help='estimate the duration and space of the next run using dry runs')
+    plan_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='plan all configs'
+    )
+    plan_parser.add_argument(
+        '-p', '--parallel', dest='parallel', type=int, default=None,
+        help='number of rsync processes to run for each backup'
+    )
+    plan_parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=_positive_int, default=None,
+        help='maximum number of dry runs to run concurrently'
+    )
+    plan_parser.add_argument(
+        '--json', dest='json',
+        action='store_true', default=False,
+        help='output the plan as JSON'
+    )
+    plan_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to plan')
+
+    prune_parser = subparsers.add_parser(
+        'prune',
+        help='remove generations not kept by the retention policy')
+    prune_parser.add_argument(
+        '-m', '--dry-run', dest='dry_run',
+        action='store_true', default=False,
+        help='enable dry run; only list the generations to remove'
+    )
+    prune_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='prune all configs with a retention policy'
+    )
+    prune_parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='number of threads used to remove files'
+    )
+    prune_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to prune')
+
+    archive_parser = subparsers.add_parser(
+        'archive',
+        help='pack old generations into compressed archives')
+    archive_parser.add_argument(
+        '-m', '--dry-run', dest='dry_run',
+        action='store_true', default=False,
+        help='enable dry run; only list the generations to archive'
+    )
+    archive_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='archive all configs with archive_after set'
+    )
+    archive_parser.add_argument(
+        '--older-than', dest='older_than', type=int, default=None,
+        help='archive generations older than this number of days'
+    )
+    archive_parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='number of threads used to compress data'
+    )
+    archive_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to archive')
+
+    dedupe_parser = subparsers.add_parser(
+        'dedupe',
+        help='replace identical files of several configs with hard links')
+    dedupe_parser.add_argument(
+        '-m', '--dry-run', dest='dry_run',
+        action='store_true', default=False,
+        help='enable dry run; only report the files that would be linked'
+    )
+    dedupe_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='deduplicate the targets of all configs'
+    )
+    dedupe_parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='number of threads used to hash files'
+    )
+    dedupe_parser.add_argument(
+        '--min-size', dest='min_size', type=int, default=1,
+        help='ignore files smaller than this number of bytes'
+    )
+    dedupe_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to deduplicate')
+
+    usage_parser = subparsers.add_parser(
+        'usage',
+        help='report the disk space used by each generation')
+    usage_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config to report')
+
+    verify_parser = subparsers.add_parser(
+        'verify',
+        help='verify the integrity of a generation')
+    verify_parser.add_argument(
+        '--full', dest='full',
+        action='store_true', default=False,
+        help='re-read all files and compare them with their stored checksums'
+    )
+    verify_parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='number of threads used to hash files'
+    )
+    verify_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config to verify')
+    verify_parser.add_argument(
+        'generation', metavar='GENERATION', type=str, nargs='?', default=None,
+        help='name of the generation to verify; defaults to the latest')
+
+    restore_parser = subparsers.add_parser(
+        'restore',
+        help='restore a file or directory from a generation')
+    restore_parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='number of threads used to copy files'
+    )
+    restore_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config to restore from')
+    restore_parser.add_argument(
+        'generation', metavar='GENERATION', type=str, nargs='?', default=None,
+        help='name of the generation to restore from; defaults to the latest')
+    restore_parser.add_argument(
+        'path', metavar='PATH', type=str,
+        help='absolute source path or path relative to a generation')
+    restore_parser.add_argument(
+        'dest', metavar='DEST', type=str,
+        help='path to restore to')
+
+    daemon_parser = subparsers.add_parser(
+        'daemon',
+        help='run all configs with a schedule until terminated')
+    daemon_parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=_positive_int, default=None,
+        help='maximum number of backups to run concurrently'
+    )
+    daemon_parser.add_argument(
+        '--nice', dest='nice', type=int, default=None,
+        help='increment of the CPU scheduling priority'
+    )
+    daemon_parser.add_argument(
+        '--ionice-class', dest='ionice_class', type=int, default=None,
+        help='I/O scheduling class (1: realtime, 2: best-effort, 3: idle)'
+    )
+    daemon_parser.add_argument(
+        '--ionice-level', dest='ionice_level', type=int, default=None,
+        help='I/O scheduling priority within the class (0-7)'
+    )
+    daemon_parser.add_argument(
+        '--socket', dest='socket', type=str,
+        default=socket_file_path('rsbackup.sock'),
+        help='path of the UNIX socket serving the status'
+    )
+    daemon_parser.add_argument(
+        '--status', dest='status',
+        action='store_true', default=False,
+        help='print the status of a running daemon and exit'
+    )
+
+    watch_parser = subparsers.add_parser(
+        'watch',
+        help='record changes to the sources in the journal until terminated')
+    watch_parser.add_argument(
+        '-a', '--all', dest='all',
+        action='store_true', default=False,
+        help='watch all configs with journal enabled'
+    )
+    watch_parser.add_argument(
+        'config', metavar='CONFIG', type=str, nargs='*',
+        help='names of the configs to watch')
+
+    log_parser = subparsers.add_parser(
+        'log',
+        help='print the rsync log of a generation')
+    log_parser.add_argument(
+        'config', metavar='CONFIG', type=str,
+        help='name of the config')
+    log_parser.add_argument(
+        'generation', metavar='GENERATION', type=str, nargs='?', default=None,
+        help='name of the generation; defaults to the latest')
+
+    history_parser = subparsers.add_parser(
+        'history',
+        help='list all generations containing a file')
+    history_parser.add_argument(
+        '--config', dest='config', type=str, default=None,
+        help='only search the named config')
+    history_parser.add_argument(
+        'path', metavar='PATH', type=str,
+        help='absolute source path or path relative to a generation')
+
+    find_parser = subparsers.add_parser(
+        'find',
+        help='find files in all generations matching a glob pattern')
+    find_parser.add_argument(
+        '--config', dest='config', type=str, default=None,
+        help='only search the named config')
+    find_parser.add_argument(
+        'pattern', metavar='GLOB', type=str,
+        help='glob pattern matched against paths relative to a generation')
 
     args = argparser.parse_args(args)
 
     cfgs = _load_config_file(args.config_file)
 
+    out = Output()
+
+    if args.command == 'status':
+        if not args.json:
+            _banner(out)
+        return _status(cfgs, args.json, out)
+
+    if args.command == 'diff':
+        if not args.json:
+            _banner(out)
+        return _diff(cfgs, args.config, args.old, args.new, args.json,
+                     args.walk, out)
+
+    if not (args.command == 'plan' and args.json):
+        _banner(out)
+
+    if args.command in ('list', 'ls'):
+        return _list_configs(cfgs, out)
+
+    if args.command == 'generations':
+        return _generations(cfgs, args.config, args.rebuild, out)
+
+    import asyncio
+
+    from termapp.asyncio import create_app
+
     app = create_app()
 
     async def _main():
-        await _banner(app)
+        if args.command in ('create', 'c'):
+            config_names = list(cfgs.keys()) if args.all else args.config
+            return await _create_backups(cfgs, config_names, dry_mode=args.dry_run,
+                                         skip_latest=args.skip_latest, jobs=args.jobs,
+                                         parallel=args.parallel,
+                                         skip_unchanged=args.skip_unchanged, app=app)
 
-        if args.command in ('list', 'ls'):
-            return await _list_configs(cfgs, app)
+        if args.command == 'plan':
+            config_names = list(cfgs.keys()) if args.all else args.config
+            return await _plan(cfgs, config_names, parallel=args.parallel,
+                               jobs=args.jobs, as_json=args.json, app=app)
 
-        if args.command in ('create', 'c'):
-            return await _create_backup(cfgs, args.config[0], dry_mode=args.dry_run,
-                                        skip_latest=args.skip_latest, app=app)
+        if args.command == 'prune':
+            return await _prune(cfgs, args.config, args.all, dry_mode=args.dry_run,
+                                workers=args.workers, app=app)
+
+        if args.command == 'archive':
+            return await _archive(cfgs, args.config, args.all, dry_mode=args.dry_run,
+                                  older_than=args.older_than,
+                                  workers=args.workers, app=app)
+
+        if args.command == 'dedupe':
+            config_names = list(cfgs.keys()) if args.all else args.config
+            return await _dedupe(cfgs, config_names, dry_mode=args.dry_run,
+                                 workers=args.workers, min_size=args.min_size,
+                                 app=app)
+
+        if args.command == 'usage':
+            return await _usage(cfgs, args.config, app)
+
+        if args.command == 'verify':
+            return await _verify(cfgs, args.config, args.generation,
+                                 full=args.full, workers=args.workers, app=app)
+
+        if args.command == 'restore':
+            return await _restore(cfgs, args.config, args.generation, args.path,
+                                  args.dest, workers=args.workers, app=app)
+
+        if args.command == 'daemon':
+            if args.status:
+                return await _daemon_status(args.socket, app)
+            return await _daemon(args.config_file, jobs=args.jobs,
+                                 nice=args.nice, ionice_class=args.ionice_class,
+                                 ionice_level=args.ionice_level,
+                                 socket_path=args.socket, app=app)
+
+        if args.command == 'watch':
+            return await _watch(cfgs, args.config, args.all, app)
+
+        if args.command == 'log':
+            return await _log(cfgs, args.config, args.generation, app)
+
+        if args.command == 'history':
+            return await _history(cfgs, args.config, args.path, app)
+
+        if args.command == 'find':
+            return await _find(cfgs, args.config, args.pattern, app)
 
     return asyncio.run(_main())
     
@@ -112,6 +540,30 @@ def _load_config(s, basedir='.'):
                                                        data[key]['target']))),
         description=data[key].get('description'),
         excludes=data[key].get('excludes') or [],
+        parallel=data[key].get('parallel', 1),
+        keep_daily=data[key].get('keep_daily', 0),
+        keep_weekly=data[key].get('keep_weekly', 0),
+        keep_monthly=data[key].get('keep_monthly', 0),
+        skip_unchanged=data[key].get('skip_unchanged', False),
+        link_generations=data[key].get('link_generations', 1),
+        metrics_file=os.path.join(basedir, data[key]['metrics_file'])
+        if 'metrics_file' in data[key] else None,
+        schedule=data[key].get('schedule'),
+        jitter=data[key].get('jitter', 0),
+        log_level=data[key].get('log_level', 'full'),
+        bwlimit=data[key].get('bwlimit'),
+        nice=data[key].get('nice'),
+        ionice_class=data[key].get('ionice_class'),
+        ionice_level=data[key].get('ionice_level'),
+        max_load=data[key].get('max_load'),
+        max_disk_util=data[key].get('max_disk_util'),
+        includes=data[key].get('includes') or [],
+        filters=data[key].get('filters') or [],
+        ignore_file=data[key].get('ignore_file', IGNORE_FILE) or None,
+        engine=data[key].get('engine', 'rsync'),
+        archive_after=data[key].get('archive_after'),
+        journal=data[key].get('journal', False),
+        full_scan_interval=data[key].get('full_scan_interval', '1d') or None,
     ) for key in data}
 
 
@@ -124,56 +576,734 @@ def _load_config_file(name):
         return _load_config(file.read(), basedir)
 
 
-async def _banner(app: AppProtocol):
+def _banner(out: Output):
     "Shows an application banner to the user."
 
-    await app.write_line(f"rsbackup v{__version__}", BOLD)
-    await app.write_line('https://github.com/halimath/rsbackup')
+    out.write_line(f"rsbackup v{__version__}", BOLD)
+    out.write_line('https://github.com/halimath/rsbackup')
+    out.write_line()
+
+
+async def _create_backups(cfgs, config_names, dry_mode, skip_latest, jobs,
+                          parallel, skip_unchanged, app: 'AppProtocol'):
+    "Creates backups for all configurations named in config_names."
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
+        if config_name not in cfgs:
+            await app.danger(
+                f"No backup configuration found: {config_name}\n")
+            return 1
+
+    if len(config_names) == 1:
+        return await _create_backup(cfgs, config_names[0], dry_mode=dry_mode,
+                                    skip_latest=skip_latest, parallel=parallel,
+                                    skip_unchanged=skip_unchanged, app=app)
+
+    from rsbackup.scheduler import run_backups
+
+    concurrent = jobs is None or jobs > 1
+    outcomes = await run_backups(
+        {name: cfgs[name] for name in config_names},
+        logger_factory=lambda name: AppLoggingProtocolAdapter(
+            app, prefix=name, progress=not concurrent),
+        jobs=jobs, dry_mode=dry_mode, skip_latest=skip_latest,
+        parallel=parallel, skip_unchanged=skip_unchanged)
+
     await app.write_line()
+    await app.write_line('Summary:', BOLD)
+    for outcome in outcomes:
+        if outcome.success:
+            await app.success(f"{outcome.name}: took {outcome.duration}")
+        else:
+            await app.failure(f"{outcome.name}: {outcome.error}")
 
+    return 0 if all(o.success for o in outcomes) else 1
 
-async def _create_backup(cfgs, config_name, dry_mode, skip_latest, app: AppProtocol):
+
+async def _create_backup(cfgs, config_name, dry_mode, skip_latest, parallel,
+                         skip_unchanged, app: 'AppProtocol'):
     "Creates a backup for the configuration named config_name."
 
     try:
+        await cfgs[config_name].run(dry_mode=dry_mode,
+                    logger=AppLoggingProtocolAdapter(app), skip_latest=skip_latest,
+                    parallel=parallel, skip_unchanged=skip_unchanged)
+        return 0
+    except Exception as e:
+        await app.danger(f"Error: {e}")
+        return 1
+
+
+async def _plan(cfgs, config_names, parallel, jobs, as_json, app: 'AppProtocol'):
+    """Runs dry runs for all configurations named in config_names
+    concurrently and prints the estimated transfer, duration and space of
+    their next runs. Returns 1 if a dry run failed or a file system lacks the
+    space needed."""
+    import asyncio
+
+    from rsbackup.plan import check_space
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
         if config_name not in cfgs:
             await app.danger(
                 f"No backup configuration found: {config_name}\n")
             return 1
 
-        await cfgs[config_name].run(dry_mode=dry_mode,
-                    logger=AppLoggingProtocolAdapter(app), skip_latest=skip_latest)
-        return 0
+    semaphore = asyncio.Semaphore(jobs) if jobs else None
+
+    async def plan(name):
+        logger = AppLoggingProtocolAdapter(app, prefix=name, progress=False)\
+            if not as_json else _NullLogger()
+        if semaphore is None:
+            return await cfgs[name].plan(logger, parallel=parallel)
+        async with semaphore:
+            return await cfgs[name].plan(logger, parallel=parallel)
+
+    results = await asyncio.gather(*(plan(name) for name in config_names),
+                                   return_exceptions=True)
+    estimates = {name: r for name, r in zip(config_names, results)
+                 if not isinstance(r, Exception)}
+    errors = {name: r for name, r in zip(config_names, results)
+              if isinstance(r, Exception)}
+    space = check_space(estimates.values())
+
+    if as_json:
+        await app.write_line(json.dumps({
+            'configs': {name: e.to_dict() for name, e in estimates.items()},
+            'errors': {name: str(e) for name, e in errors.items()},
+            'space': [{'targets': s.targets, 'needed': s.needed, 'free': s.free,
+                       'sufficient': s.sufficient} for s in space],
+        }, indent=2))
+    else:
+        await app.write_line()
+        await app.write_line(
+            f"{'Config':<20} {'Files':>10} {'Transfer':>10} {'Bytes':>12} "
+            f"{'New space':>12} {'Duration':>10}", BOLD)
+        for name, e in estimates.items():
+            duration = str(e.duration) if e.duration is not None else '-'
+            await app.write_line(
+                f"{name:<20} {e.files:>10} {e.transfer_files:>10} "
+                f"{_format_bytes(e.transfer_bytes):>12} "
+                f"{_format_bytes(e.new_bytes):>12} {duration:>10}")
+        for name, e in errors.items():
+            await app.failure(f"{name}: {e}")
+
+        await app.write_line()
+        for s in space:
+            message = f"{', '.join(s.targets)}: {_format_bytes(s.needed)} needed, " \
+                      f"{_format_bytes(s.free)} free"
+            if s.sufficient:
+                await app.success(message)
+            else:
+                await app.failure(message)
+
+    return 0 if not errors and all(s.sufficient for s in space) else 1
+
+
+async def _prune(cfgs, config_names, all, dry_mode, workers, app: 'AppProtocol'):
+    "Prunes generations of all configurations named in config_names."
+
+    if all:
+        config_names = [name for name, c in cfgs.items()
+                        if c.keep_daily or c.keep_weekly or c.keep_monthly]
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
+        if config_name not in cfgs:
+            await app.danger(
+                f"No backup configuration found: {config_name}\n")
+            return 1
+
+    exit_code = 0
+    for config_name in config_names:
+        try:
+            await cfgs[config_name].prune(
+                logger=AppLoggingProtocolAdapter(app, prefix=config_name),
+                dry_mode=dry_mode, workers=workers)
+        except Exception as e:
+            await app.danger(f"Error: {config_name}: {e}")
+            exit_code = 1
+
+    return exit_code
+
+
+async def _archive(cfgs, config_names, all, dry_mode, older_than, workers,
+                   app: 'AppProtocol'):
+    "Archives old generations of all configurations named in config_names."
+
+    if all:
+        config_names = [name for name, c in cfgs.items()
+                        if c.archive_after is not None or older_than is not None]
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
+        if config_name not in cfgs:
+            await app.danger(
+                f"No backup configuration found: {config_name}\n")
+            return 1
+
+    exit_code = 0
+    for config_name in config_names:
+        try:
+            await cfgs[config_name].archive(
+                logger=AppLoggingProtocolAdapter(app, prefix=config_name),
+                dry_mode=dry_mode, older_than=older_than, workers=workers)
+        except Exception as e:
+            await app.danger(f"Error: {config_name}: {e}")
+            exit_code = 1
+
+    return exit_code
+
+
+async def _dedupe(cfgs, config_names, dry_mode, workers, min_size,
+                  app: 'AppProtocol'):
+    """Replaces identical files in the targets of all configurations named
+    in config_names with hard links. Targets are grouped by file system."""
+    import asyncio
+
+    from rsbackup import dedupe
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
+        if config_name not in cfgs:
+            await app.danger(
+                f"No backup configuration found: {config_name}\n")
+            return 1
+
+    targets = {}
+    for config_name in config_names:
+        target = cfgs[config_name].target
+        if not os.path.isdir(target):
+            await app.warn(f"Skipping {config_name}: {target} does not exist")
+            continue
+        targets.setdefault(os.stat(target).st_dev, set()).add(target)
+
+    loop = asyncio.get_running_loop()
+
+    def on_progress(result):
+        asyncio.run_coroutine_threadsafe(app.update_progress(
+            message=f"{result.hashed} files hashed, "
+                    f"{_format_bytes(result.hashed_bytes)} read"), loop)
+
+    exit_code = 0
+    for group in targets.values():
+        group = sorted(group)
+        await app.info(f"Deduplicating {', '.join(group)}")
+        await app.start_progress()
+        try:
+            result = await loop.run_in_executor(None, functools.partial(
+                dedupe.dedupe, group, workers=workers, dry_run=dry_mode,
+                min_size=min_size, on_progress=on_progress))
+        finally:
+            await app.stop_progress()
+
+        await app.details(
+            f"{result.files} files indexed, {result.candidates} candidates, "
+            f"{result.hashed} hashed ({_format_bytes(result.hashed_bytes)})")
+        for path, error in result.errors:
+            await app.failure(f"{path}: {error}")
+            exit_code = 1
+
+        verb = 'Would link' if dry_mode else 'Linked'
+        await app.success(f"{verb} {result.linked} files, "
+                          f"freeing {_format_bytes(result.saved_bytes)}")
+
+    return exit_code
+
+
+async def _usage(cfgs, config_name, app: 'AppProtocol'):
+    "Reports the disk space used by each generation of config_name."
+    import asyncio
+
+    from rsbackup import usage
+
+    if config_name not in cfgs:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    target = cfgs[config_name].target
+    loop = asyncio.get_running_loop()
+
+    await app.start_progress(message='Updating usage index')
+    try:
+        await loop.run_in_executor(None, functools.partial(
+            usage.update_index, target,
+            on_generation=lambda name: asyncio.run_coroutine_threadsafe(
+                app.update_progress(message=f"Reading {name}"), loop)))
+    finally:
+        await app.stop_progress()
+
+    generations = usage.generation_usage(target)
+
+    await app.write_line(
+        f"{'Generation':<20} {'Files':>10} {'Total':>12} {'Added':>12} "
+        f"{'Exclusive':>12} {'Shared':>12}", BOLD)
+    for g in generations:
+        await app.write_line(
+            f"{g.name:<20} {g.files:>10} {_format_bytes(g.total):>12} "
+            f"{_format_bytes(g.added):>12} {_format_bytes(g.exclusive):>12} "
+            f"{_format_bytes(g.shared):>12}")
+    await app.write_line()
+    await app.write_line(
+        f"Total unique bytes: {_format_bytes(sum(g.added for g in generations))}")
+
+    return 0
+
+
+async def _verify(cfgs, config_name, generation, full, workers, app: 'AppProtocol'):
+    "Verifies a generation of config_name."
+    import asyncio
+
+    from rsbackup import verify
+
+    if config_name not in cfgs:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    target = cfgs[config_name].target
+    if generation is None:
+        generation = latest_generation(target)
+    if generation is None or generation not in list_generations(target):
+        await app.danger(f"No such generation: {generation}\n")
+        return 1
+
+    loop = asyncio.get_running_loop()
+
+    def on_progress(result):
+        asyncio.run_coroutine_threadsafe(app.update_progress(
+            message=f"{result.files} files checked, "
+                    f"{_format_bytes(result.hashed_bytes)} read"), loop)
+
+    await app.info(f"Verifying {os.path.join(target, generation)}")
+    await app.start_progress()
+    try:
+        result = await loop.run_in_executor(None, functools.partial(
+            verify.verify_generation, target, generation, workers=workers,
+            full=full, on_progress=on_progress))
+    finally:
+        await app.stop_progress()
+
+    await app.details(
+        f"{result.files} files checked, {result.hashed} hashed "
+        f"({_format_bytes(result.hashed_bytes)}), {result.reused} verified before")
+
+    for path, error in result.errors:
+        await app.failure(f"{path}: {error}")
+
+    if not result.success:
+        await app.danger(f"{len(result.errors)} errors found in {generation}")
+        return 1
+
+    await app.success(f"{generation} verified")
+    return 0
+
+
+async def _restore(cfgs, config_name, generation, path, dest, workers,
+                   app: 'AppProtocol'):
+    "Restores path from a generation of config_name to dest."
+
+    if config_name not in cfgs:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    backup = cfgs[config_name]
+    paths = _generation_paths(backup, path)
+    if not paths:
+        await app.danger(f"{path} is not part of {config_name}\n")
+        return 1
+
+    try:
+        result = await backup.restore(AppLoggingProtocolAdapter(app), paths[0],
+                                      dest, generation=generation,
+                                      workers=workers)
     except Exception as e:
         await app.danger(f"Error: {e}")
         return 1
 
+    for error_path, error in result.errors:
+        await app.failure(f"{error_path}: {error}")
+
+    if not result.success:
+        await app.danger(f"{len(result.errors)} errors restoring {path}")
+        return 1
+
+    await app.success(f"Restored {path} to {dest}")
+    return 0
+
+
+async def _daemon(config_file, jobs, nice, ionice_class, ionice_level,
+                  socket_path, app: 'AppProtocol'):
+    "Runs the scheduled backups until SIGTERM or SIGINT is received."
+    import asyncio
+    import signal
+    import subprocess
+
+    from rsbackup import daemon
+
+    try:
+        daemon.set_priority(nice, ionice_class, ionice_level)
+    except (OSError, subprocess.CalledProcessError) as e:
+        await app.danger(f"Error: cannot set priority: {e}")
+        return 1
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.info(f"Running scheduled backups from {config_file}")
+    await daemon.Daemon(
+        config_file, _load_config_file,
+        logger=AppLoggingProtocolAdapter(app, progress=False),
+        logger_factory=lambda name: AppLoggingProtocolAdapter(
+            app, prefix=name, progress=False),
+        jobs=jobs, socket_path=socket_path).run(stop)
+    await app.info('Stopped')
+    return 0
+
+
+async def _watch(cfgs, config_names, all, app: 'AppProtocol'):
+    """Records the changes to the sources of all configurations named in
+    config_names in their journals until SIGTERM or SIGINT is received."""
+    import asyncio
+    import signal
+
+    from rsbackup.journal import Watcher
+
+    if all:
+        config_names = [name for name, c in cfgs.items() if c.journal]
+
+    if not config_names:
+        await app.danger('No backup configuration given\n')
+        return 1
+
+    for config_name in config_names:
+        if config_name not in cfgs:
+            await app.danger(
+                f"No backup configuration found: {config_name}\n")
+            return 1
+        if not os.path.isdir(cfgs[config_name].target):
+            await app.danger(
+                f"Error: {config_name}: target {cfgs[config_name].target} does not exist\n")
+            return 1
 
-async def _list_configs(cfgs, app: AppProtocol):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def watch(config_name: str):
+        await app.info(f"Watching sources of {config_name}")
+        await Watcher(cfgs[config_name]).run(stop)
+
+    try:
+        await asyncio.gather(*(watch(name) for name in config_names))
+    except OSError as e:
+        stop.set()
+        await app.danger(f"Error: {e}")
+        return 1
+
+    await app.info('Stopped')
+    return 0
+
+
+async def _daemon_status(socket_path, app: 'AppProtocol'):
+    "Prints the status served by a running daemon."
+    from rsbackup import daemon
+
+    try:
+        status = await daemon.query_status(socket_path)
+    except OSError as e:
+        await app.danger(f"Cannot connect to daemon at {socket_path}: {e}")
+        return 1
+
+    await app.write_line(json.dumps(status, indent=2))
+    return 0
+
+
+async def _log(cfgs, config_name, generation, app: 'AppProtocol'):
+    "Streams the decompressed rsync log of a generation to stdout."
+    from rsbackup import logfile
+
+    if config_name not in cfgs:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    target = cfgs[config_name].target
+    if generation is None:
+        generation = latest_generation(target)
+    if generation is None or generation not in list_generations(target) +\
+            incomplete_generations(target):
+        await app.danger(f"No such generation: {generation}\n")
+        return 1
+
+    try:
+        chunks = logfile.read_log(os.path.join(target, generation))
+        out = sys.stdout.buffer
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
+    except FileNotFoundError as e:
+        await app.danger(f"Error: {e}")
+        return 1
+
+    return 0
+
+
+def _select_configs(cfgs, config_name):
+    """Returns the configs to use for a query limited to config_name or all
+    configs if config_name is None."""
+    if config_name is None:
+        return cfgs
+    if config_name not in cfgs:
+        return None
+    return {config_name: cfgs[config_name]}
+
+
+def _generation_paths(backup: Backup, path: str) -> typing.List[str]:
+    """Maps path to the paths relative to a generation of backup. Relative
+    paths are returned as is. Absolute paths are mapped using the backup's
+    sources."""
+    if not os.path.isabs(path):
+        return [path.strip('/')]
+
+    path = os.path.normpath(path)
+    result = []
+    for source in map(os.path.abspath, backup.sources):
+        if path == source or path.startswith(source.rstrip('/') + '/'):
+            result.append(os.path.basename(source) + path[len(source):])
+    return result
+
+
+async def _history(cfgs, config_name, path, app: 'AppProtocol'):
+    "Lists all generations containing path."
+    from rsbackup import manifest
+
+    selected = _select_configs(cfgs, config_name)
+    if selected is None:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    found = False
+    for name, backup in selected.items():
+        for generation_path in _generation_paths(backup, path):
+            entries = list(manifest.history(backup.target, generation_path))
+            if not entries:
+                continue
+
+            found = True
+            async with app.apply_styles(BOLD, FG_CYAN):
+                await app.write(name)
+            await app.write_line(f" - {_display_path(generation_path)}")
+
+            prev_inode = None
+            for generation, entry in entries:
+                mtime = datetime.datetime.fromtimestamp(entry.mtime / 1e9)
+                changed = '*' if entry.inode != prev_inode else ' '
+                await app.write_line(
+                    f"  {changed} {generation}  {entry.size:>14}  {mtime:%Y-%m-%d %H:%M:%S}")
+                prev_inode = entry.inode
+            await app.write_line()
+
+    if not found:
+        await app.warn(f"{path} not found in any generation")
+
+    return 0
+
+
+async def _find(cfgs, config_name, pattern, app: 'AppProtocol'):
+    "Lists all files in any generation matching pattern."
+    from rsbackup import manifest
+
+    selected = _select_configs(cfgs, config_name)
+    if selected is None:
+        await app.danger(f"No backup configuration found: {config_name}\n")
+        return 1
+
+    for name, backup in selected.items():
+        for generation, entry in manifest.find(backup.target, pattern):
+            await app.write_line(
+                f"{name}  {generation}  {_display_path(entry.path)}  {entry.size}")
+
+    return 0
+
+
+def _status(cfgs, as_json, out: Output):
+    """Shows the state of the generations and the last run of all configs.
+    Returns 1 if the last run of any config failed."""
+
+    now = datetime.datetime.now()
+    status = {name: _config_status(backup, now) for name, backup in cfgs.items()}
+    failed = any(s['last_run'] is not None and not s['last_run']['success']
+                 for s in status.values())
+
+    if as_json:
+        out.write_line(json.dumps(status, indent=2))
+        return 1 if failed else 0
+
+    for name, s in status.items():
+        out.write(name, BOLD, FG_CYAN)
+        out.write_line()
+        if s['latest'] is None:
+            out.write_line('  Latest:   -')
+        else:
+            age = datetime.timedelta(seconds=int(s['age_seconds']))
+            out.write_line(f"  Latest:   {s['latest']} ({age} ago)")
+        out.write_line(f"  Generations: {s['generations']}"
+                       + (f" ({len(s['incomplete'])} incomplete)" if s['incomplete'] else '')
+                       + (f", {s['archived']} archived" if s['archived'] else ''))
+
+        run = s['last_run']
+        if run is None:
+            out.write_line('  Last run: -')
+        elif run['success']:
+            out.write('  Last run: ')
+            out.write_line(f"succeeded at {run['start']}"
+                           + (' (unchanged)' if run['unchanged'] else ''), FG_GREEN)
+        else:
+            out.write('  Last run: ')
+            out.write_line(f"failed at {run['start']}: {run['error']}", FG_RED)
+        out.write_line()
+
+    return 1 if failed else 0
+
+
+def _config_status(backup: Backup, now: datetime.datetime) -> dict:
+    """Returns the status of backup read from the metadata in its target
+    without walking any generation."""
+
+    latest = latest_generation(backup.target)
+    timestamp = parse_generation_name(latest) if latest else None
+    try:
+        link = os.readlink(os.path.join(backup.target, LATEST))
+    except OSError:
+        link = None
+
+    return {
+        'target': backup.target,
+        'latest': latest,
+        'latest_link': link,
+        'latest_timestamp': timestamp.isoformat() if timestamp else None,
+        'age_seconds': (now - timestamp).total_seconds() if timestamp else None,
+        'generations': len(list_generations(backup.target)),
+        'incomplete': incomplete_generations(backup.target),
+        'archived': len(list_archives(backup.target)),
+        'last_run': read_last_run(backup.target),
+    }
+
+
+def _generations(cfgs, config_name, rebuild, out: Output):
+    "Lists the generations of config_name recorded in its catalog."
+    from rsbackup import catalog
+
+    if config_name not in cfgs:
+        out.write_line(f"No backup configuration found: {config_name}", FG_RED)
+        return 1
+
+    target = cfgs[config_name].target
+    if rebuild:
+        catalog.rebuild(target)
+
+    out.write_line(
+        f"{'Generation':<20} {'Status':<8} {'Duration':>10} {'Files':>10} "
+        f"{'Transferred':>12}  Link dest", BOLD)
+    for e in catalog.list_catalog(target):
+        duration = str(e.duration).split('.')[0] if e.duration else '-'
+        files = e.files if e.files is not None else '-'
+        transferred = _format_bytes(e.bytes_transferred)\
+            if e.bytes_transferred is not None else '-'
+        out.write(f"{e.name:<20} ")
+        out.write(f"{'ok' if e.success else 'failed':<8}",
+                  FG_GREEN if e.success else FG_RED)
+        out.write_line(f" {duration:>10} {files:>10} {transferred:>12}  "
+                       f"{', '.join(e.link_dests) or '-'}")
+    return 0
+
+
+def _display_path(path: str) -> str:
+    """Returns path for display. Bytes of file names that are not valid
+    UTF-8 are shown as escape sequences."""
+    return os.fsencode(path).decode('utf-8', 'backslashreplace')
+
+
+def _diff(cfgs, config_name, old, new, as_json, walk, out: Output):
+    "Lists the differences between two generations of config_name."
+    from rsbackup import diff
+
+    if config_name not in cfgs:
+        out.write_line(f"No backup configuration found: {config_name}", FG_RED)
+        return 1
+
+    target = cfgs[config_name].target
+    if new is None:
+        new = latest_generation(target)
+    generations = list_generations(target) + list_archives(target)
+    for generation in (old, new):
+        if generation is None or generation not in generations:
+            out.write_line(f"No such generation: {generation}", FG_RED)
+            return 1
+
+    counts = {diff.ADDED: 0, diff.REMOVED: 0, diff.MODIFIED: 0}
+    for e in diff.diff_generations(os.path.join(target, old),
+                                   os.path.join(target, new),
+                                   use_manifests=not walk):
+        counts[e.change] += 1
+        if as_json:
+            out.write_line(json.dumps(e.to_dict()))
+        elif e.change == diff.ADDED:
+            out.write_line(f"+ {_format_bytes(e.new_size):>24}  {_display_path(e.path)}", FG_GREEN)
+        elif e.change == diff.REMOVED:
+            out.write_line(f"- {_format_bytes(e.old_size):>24}  {_display_path(e.path)}", FG_RED)
+        else:
+            sizes = f"{_format_bytes(e.old_size)} -> {_format_bytes(e.new_size)}"
+            out.write_line(f"M {sizes:>24}  {_display_path(e.path)}", FG_CYAN)
+
+    if not as_json:
+        out.write_line()
+        out.write_line(f"{counts[diff.ADDED]} added, {counts[diff.REMOVED]} removed, "
+                       f"{counts[diff.MODIFIED]} modified", BOLD)
+    return 0
+
+
+def _list_configs(cfgs, out: Output):
     "Lists the available configs to the user."
 
     for name in cfgs.keys():
         c = cfgs[name]
-        async with app.apply_styles(BOLD, FG_CYAN):
-            await app.write(name)
+        out.write(name, BOLD, FG_CYAN)
         if c.description:
-            await app.write(f" - {c.description}")
+            out.write(f" - {c.description}")
 
-        await app.write_line()
+        out.write_line()
         
-        await app.write_line('  Sources:')
-        async with app.apply_styles(FG_CYAN):
-            for src in c.sources:
-                await app.write_line(f"    - {src}")
+        out.write_line('  Sources:')
+        for src in c.sources:
+            out.write_line(f"    - {src}", FG_CYAN)
 
-        await app.write_line('  Target:')
-        async with app.apply_styles(FG_CYAN):
-            await app.write_line(f"    {c.target}")
+        out.write_line('  Target:')
+        out.write_line(f"    {c.target}", FG_CYAN)
 
-        await app.write_line('  Excludes:')
+        out.write_line('  Excludes:')
         for e in c.excludes:
-            await app.write_line(f'    - {e}')
-        await app.write_line()
+            out.write_line(f'    - {e}')
+        out.write_line()
     return 0
 
 
@@ -0,0 +1,574 @@
+"""Archives pack old generations into a single compressed file.
+
+Every generation is a tree of hard links with one directory entry per file,
+which slows down every scan, prune and file system check of the target long
+after the data stopped changing. Archiving replaces the generation directory
+`NAME` with the file `NAME.archive`, an SQLite database containing an index
+of all entries and their data.
+
+The data of all files is concatenated into a single stream which is split
+into chunks of `CHUNK_SIZE` bytes, each compressed separately, so a file is
+read by decompressing only the chunks it spans. Chunks are compressed on a
+pool of threads. Files whose inode is still present at the same path in the
+next newer generation are stored as a reference to that generation instead
+of their data; references are resolved through archives as well.
+
+The index provides a `files` view with the columns of a manifest, so
+archived generations can be queried like any manifest. Before a generation
+referenced by an archive is removed, `detach` copies the referenced data
+into the archive.
+"""
+
+import concurrent.futures
+import datetime
+import os
+import sqlite3
+import stat
+import typing
+import zlib
+
+from rsbackup.generations import (ARCHIVE_SUFFIX, LOG_FILE, METADATA_FILES,
+                                  PLAIN_LOG_FILE, SOURCES_FILE, STATS_FILE,
+                                  latest_generation, list_archives,
+                                  list_generations, parse_generation_name)
+from rsbackup.manifest import connect
+from rsbackup.restore import RestoreResult
+
+CHUNK_SIZE = 4 * 2**20
+"Uncompressed size of the chunks the data of an archive is split into."
+
+_TMP_SUFFIX = '.tmp'
+_STORED_METADATA = (LOG_FILE, PLAIN_LOG_FILE, SOURCES_FILE, STATS_FILE)
+_BATCH_SIZE = 10000
+
+
+class ArchiveEntry(typing.NamedTuple):
+    """A single entry of an archived generation.
+
+    `path`, `size`, `mtime`, `inode` and `mode` match the columns of a
+    manifest. `link` is the target of a symlink. The data of a regular file
+    starts at `offset` in the archive's data stream or is found at
+    `ref_path` in the generation `ref`. Both are `None` for empty files.
+    """
+    path: str
+    size: int
+    mtime: int
+    inode: int
+    mode: int
+    uid: int
+    gid: int
+    atime: int
+    rdev: int
+    link: typing.Optional[str]
+    offset: typing.Optional[int]
+    ref: typing.Optional[str]
+    ref_path: typing.Optional[str]
+
+
+class ArchiveResult:
+    """The result of archiving a generation.
+
+    `bytes` is the size of all regular files, `stored_bytes` the compressed
+    size of the data stored in the archive. `referenced` files and
+    `referenced_bytes` are stored as references to a newer generation.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.entries = 0
+        self.files = 0
+        self.bytes = 0
+        self.stored_bytes = 0
+        self.referenced = 0
+        self.referenced_bytes = 0
+
+
+def archive_path(target: str, name: str) -> str:
+    "Returns the path of the archive of generation `name` in `target`."
+    return os.path.join(target, name + ARCHIVE_SUFFIX)
+
+
+def generations_to_archive(target: str, older_than: datetime.timedelta,
+                           now: typing.Optional[datetime.datetime] = None) -> typing.List[str]:
+    """Returns the names of the complete generations in `target` created more
+    than `older_than` before `now`. The generation `_latest` points to is
+    never returned."""
+    cutoff = (now or datetime.datetime.now()) - older_than
+    latest = latest_generation(target)
+    return [name for name in list_generations(target)
+            if name != latest and parse_generation_name(name) < cutoff]
+
+
+# Paths are stored byte by byte (see `rsbackup.manifest.connect`).
+_INSERT_ENTRY = 'INSERT INTO entries VALUES (CAST(? AS TEXT), ?, ?, ?, ?, ?, ?, ?, ?, '\
+    'CAST(? AS TEXT), ?, ?, CAST(? AS TEXT))'
+
+
+def _create(path: str) -> sqlite3.Connection:
+    db = connect(path)
+    db.executescript('''
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+        CREATE TABLE entries (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            mode INTEGER NOT NULL,
+            uid INTEGER NOT NULL,
+            gid INTEGER NOT NULL,
+            atime INTEGER NOT NULL,
+            rdev INTEGER NOT NULL,
+            link TEXT,
+            data_offset INTEGER,
+            ref TEXT,
+            ref_path TEXT
+        ) WITHOUT ROWID;
+        CREATE INDEX entries_ref ON entries (ref);
+        CREATE VIEW files AS SELECT path, size, mtime, inode, mode FROM entries;
+        CREATE TABLE chunks (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE metadata (
+            name TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+    ''')
+    return db
+
+
+class _Writer:
+    """Appends data to the data stream of an archive. `start` must be a
+    multiple of `CHUNK_SIZE`. Chunks are compressed by `executor`."""
+
+    def __init__(self, db: sqlite3.Connection, start: int, level: int,
+                 executor: concurrent.futures.Executor, workers: int):
+        self._db = db
+        self._level = level
+        self._executor = executor
+        self._max_pending = workers * 2
+        self._buffer = bytearray()
+        self._pending = []
+        self.offset = start
+        self.stored_bytes = 0
+
+    def write(self, blocks: typing.Iterable[bytes]) -> int:
+        "Appends `blocks` and returns the offset they start at."
+        start = self.offset
+        for block in blocks:
+            view = memoryview(block)
+            while view:
+                n = CHUNK_SIZE - len(self._buffer)
+                self._buffer += view[:n]
+                self.offset += len(view[:n])
+                view = view[n:]
+                if len(self._buffer) == CHUNK_SIZE:
+                    self._flush()
+        return start
+
+    def _flush(self):
+        chunk_id = (self.offset - len(self._buffer)) // CHUNK_SIZE
+        self._pending.append((chunk_id, self._executor.submit(
+            zlib.compress, bytes(self._buffer), self._level)))
+        self._buffer = bytearray()
+        while len(self._pending) > self._max_pending:
+            self._store(*self._pending.pop(0))
+
+    def _store(self, chunk_id: int, future: concurrent.futures.Future):
+        data = future.result()
+        self.stored_bytes += len(data)
+        self._db.execute('INSERT INTO chunks VALUES (?, ?)', (chunk_id, data))
+
+    def close(self):
+        "Writes all buffered data."
+        if self._buffer:
+            self._flush()
+        while self._pending:
+            self._store(*self._pending.pop(0))
+
+
+def _read_file(path: str) -> typing.Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while block := f.read(CHUNK_SIZE):
+            yield block
+
+
+def _walk(generation_dir: str) -> typing.Iterator[typing.Tuple[str, str, os.stat_result]]:
+    stack = [('', generation_dir)]
+    while stack:
+        prefix, dir_path = stack.pop()
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            if not prefix and entry.name in METADATA_FILES:
+                continue
+            st = entry.stat(follow_symlinks=False)
+            yield prefix + entry.name, entry.path, st
+            if stat.S_ISDIR(st.st_mode):
+                stack.append((prefix + entry.name + '/', entry.path))
+
+
+def _same_inode(path: str, st: os.stat_result) -> bool:
+    try:
+        other = os.lstat(path)
+    except OSError:
+        return False
+    return (other.st_dev, other.st_ino) == (st.st_dev, st.st_ino)
+
+
+def archive_generation(target: str, name: str, level: int = 6,
+                       workers: typing.Optional[int] = None) -> ArchiveResult:
+    """Packs the generation `name` of `target` into an archive and removes
+    the generation directory. Returns an `ArchiveResult`.
+
+    Files hard linked to the same path in the next newer generation are
+    stored as references. `level` is the zlib compression level and
+    `workers` the number of threads compressing chunks. The archive is
+    written to a temporary file and moved into place when complete.
+    """
+    from rsbackup.prune import remove_generations
+
+    generation_dir = os.path.join(target, name)
+    newer = next((n for n in list_generations(target) if n > name), None)
+    result = ArchiveResult(name)
+
+    path = archive_path(target, name)
+    tmp_path = path + _TMP_SUFFIX
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    workers = workers or os.cpu_count() or 1
+    db = _create(tmp_path)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            writer = _Writer(db, 0, level, executor, workers)
+            stored = {}
+            rows = []
+            for rel, full, st in _walk(generation_dir):
+                link = offset = ref = ref_path = None
+                if stat.S_ISLNK(st.st_mode):
+                    link = os.readlink(full)
+                elif stat.S_ISREG(st.st_mode):
+                    result.files += 1
+                    result.bytes += st.st_size
+                    if st.st_ino in stored:
+                        offset, ref, ref_path = stored[st.st_ino]
+                    elif st.st_size:
+                        if newer is not None and st.st_nlink > 1 and\
+                                _same_inode(os.path.join(target, newer, rel), st):
+                            ref, ref_path = newer, rel
+                            result.referenced += 1
+                            result.referenced_bytes += st.st_size
+                        else:
+                            offset = writer.write(_read_file(full))
+                        stored[st.st_ino] = (offset, ref, ref_path)
+
+                rows.append((os.fsencode(rel), st.st_size, st.st_mtime_ns,
+                             st.st_ino, st.st_mode, st.st_uid, st.st_gid,
+                             st.st_atime_ns, st.st_rdev,
+                             os.fsencode(link) if link is not None else None,
+                             offset, ref,
+                             os.fsencode(ref_path) if ref_path is not None else None))
+                result.entries += 1
+                if len(rows) >= _BATCH_SIZE:
+                    db.executemany(_INSERT_ENTRY, rows)
+                    rows = []
+
+            writer.close()
+            db.executemany(_INSERT_ENTRY, rows)
+
+        for metadata_file in _STORED_METADATA:
+            try:
+                with open(os.path.join(generation_dir, metadata_file), 'rb') as f:
+                    db.execute('INSERT INTO metadata VALUES (?, ?)',
+                               (metadata_file, f.read()))
+            except FileNotFoundError:
+                pass
+
+        db.executemany('INSERT INTO meta VALUES (?, ?)', (
+            ('name', name),
+            ('created', datetime.datetime.now().isoformat(timespec='seconds')),
+            ('chunk_size', CHUNK_SIZE),
+            ('data_size', writer.offset),
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    result.stored_bytes = writer.stored_bytes
+    os.replace(tmp_path, path)
+    remove_generations(target, [name])
+    return result
+
+
+class _References:
+    "Reads data referenced in other generations of a target."
+
+    def __init__(self, target: str):
+        self.target = target
+        self._archives = {}
+
+    def read(self, generation: str, path: str) -> typing.Iterator[bytes]:
+        generation_dir = os.path.join(self.target, generation)
+        if os.path.isdir(generation_dir):
+            yield from _read_file(os.path.join(generation_dir, path))
+            return
+
+        if generation not in self._archives:
+            if not os.path.exists(archive_path(self.target, generation)):
+                raise FileNotFoundError(f"Referenced generation {generation} not found")
+            self._archives[generation] = Archive(archive_path(self.target, generation),
+                                                 references=self)
+        archive = self._archives[generation]
+        entry = archive.entry(path)
+        if entry is None:
+            raise FileNotFoundError(f"{path} not found in {generation}")
+        yield from archive.read(entry)
+
+    def close(self):
+        for archive in self._archives.values():
+            archive.close()
+        self._archives = {}
+
+
+class Archive:
+    """An archived generation opened for reading.
+
+    Archives are context managers closing the archive on exit. They must be
+    used by a single thread.
+    """
+
+    def __init__(self, path: str, references: typing.Optional[_References] = None):
+        self.path = path
+        self._db = connect(path, readonly=True)
+        self._chunk_size = self._meta('chunk_size')
+        self._chunk = (None, b'')
+        self._own_references = references is None
+        self._references = references or _References(os.path.dirname(path))
+
+    def _meta(self, key: str):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._db.close()
+        if self._own_references:
+            self._references.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def metadata(self, name: str) -> typing.Optional[bytes]:
+        """Returns the content of the metadata file `name` (such as
+        `.sources`) stored with the generation or `None`."""
+        row = self._db.execute('SELECT data FROM metadata WHERE name = ?',
+                               (name,)).fetchone()
+        return row[0] if row else None
+
+    def entry(self, path: str) -> typing.Optional[ArchiveEntry]:
+        "Returns the entry at `path` or `None` if there is none."
+        row = self._db.execute('SELECT * FROM entries WHERE path = CAST(? AS TEXT)',
+                               (os.fsencode(path),)).fetchone()
+        return ArchiveEntry(*row) if row else None
+
+    def entries(self, path: str = '') -> typing.Iterator[ArchiveEntry]:
+        """Yields the entry at `path` and all entries below ordered by path.
+        An empty `path` yields all entries."""
+        if not path:
+            cursor = self._db.execute('SELECT * FROM entries ORDER BY path')
+        else:
+            # All paths below `path` sort between `path/` and `path0`.
+            path = os.fsencode(path)
+            cursor = self._db.execute(
+                'SELECT * FROM entries WHERE path = CAST(? AS TEXT) OR '
+                '(path > CAST(? AS TEXT) AND path < CAST(? AS TEXT)) ORDER BY path',
+                (path, path + b'/', path + b'0'))
+        for row in cursor:
+            yield ArchiveEntry(*row)
+
+    def read(self, entry: ArchiveEntry) -> typing.Iterator[bytes]:
+        "Yields the content of the regular file `entry` in blocks."
+        if entry.ref is not None:
+            yield from self._references.read(entry.ref, entry.ref_path)
+            return
+        if entry.offset is None:
+            return
+
+        pos = entry.offset
+        end = entry.offset + entry.size
+        while pos < end:
+            chunk = self._read_chunk(pos // self._chunk_size)
+            start = pos % self._chunk_size
+            data = memoryview(chunk)[start:start + end - pos]
+            if not data:
+                raise ValueError(f"{self.path}: data of {entry.path} truncated")
+            yield data
+            pos += len(data)
+
+    def _read_chunk(self, chunk_id: int) -> bytes:
+        if self._chunk[0] != chunk_id:
+            row = self._db.execute('SELECT data FROM chunks WHERE id = ?',
+                                   (chunk_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"{self.path}: chunk {chunk_id} missing")
+            self._chunk = (chunk_id, zlib.decompress(row[0]))
+        return self._chunk[1]
+
+
+def detach(target: str, names: typing.Iterable[str], level: int = 6,
+           workers: typing.Optional[int] = None) -> int:
+    """Copies the data referenced by archives in `target` from the
+    generations `names` into the archives, so `names` can be removed.
+    Archives of `names` themselves are skipped. Returns the number of files
+    copied."""
+    names = set(names)
+    if not names:
+        return 0
+    workers = workers or os.cpu_count() or 1
+    copied = 0
+
+    for name in list_archives(target):
+        if name in names:
+            continue
+
+        path = archive_path(target, name)
+        db = connect(path)
+        references = _References(target)
+        try:
+            refs = db.execute(
+                'SELECT DISTINCT ref, ref_path FROM entries WHERE ref IN (%s)'
+                % ', '.join('?' * len(names)), sorted(names)).fetchall()
+            if not refs:
+                continue
+
+            data_size = db.execute(
+                "SELECT value FROM meta WHERE key = 'data_size'").fetchone()[0]
+            start = -(-data_size // CHUNK_SIZE) * CHUNK_SIZE
+            with db, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                writer = _Writer(db, start, level, executor, workers)
+                for ref, ref_path in refs:
+                    offset = writer.write(references.read(ref, ref_path))
+                    db.execute('UPDATE entries SET data_offset = ?, ref = NULL, '
+                               'ref_path = NULL WHERE ref = ? AND ref_path = CAST(? AS TEXT)',
+                               (offset, ref, os.fsencode(ref_path)))
+                    copied += 1
+                writer.close()
+                db.execute("UPDATE meta SET value = ? WHERE key = 'data_size'",
+                           (writer.offset,))
+        finally:
+            references.close()
+            db.close()
+
+    return copied
+
+
+def restore_archive(path: str, source: str, dest: str,
+                    on_progress: typing.Optional[typing.Callable[[RestoreResult], None]] = None) -> RestoreResult:
+    """Restores the file or directory `source` (relative to the generation)
+    from the archive at `path` to `dest` like `rsbackup.restore.restore_tree`.
+
+    Files are restored in the order their data is stored, so every chunk is
+    decompressed only once. Raises a `ValueError` if `source` is not part
+    of the archive.
+    """
+    source = source.strip('/')
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+
+    result = RestoreResult()
+    with Archive(path) as archive:
+        entries = list(archive.entries(source))
+        if not entries:
+            raise ValueError(f"{source} not found in {os.path.basename(path)}")
+
+        files = []
+        links = []
+        dirs = []
+        seen = {}
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        for e in entries:
+            rel = e.path[len(source):].lstrip('/')
+            dst = os.path.join(dest, rel) if rel else dest
+            try:
+                if stat.S_ISDIR(e.mode):
+                    os.makedirs(dst, exist_ok=True)
+                    dirs.append((dst, e))
+                    result.dirs += 1
+                elif stat.S_ISREG(e.mode):
+                    if e.inode in seen:
+                        links.append((seen[e.inode], dst))
+                        continue
+                    seen[e.inode] = dst
+                    files.append((dst, e))
+                    result.total_bytes += e.size
+                elif stat.S_ISLNK(e.mode):
+                    _remove(dst)
+                    os.symlink(e.link, dst)
+                    _apply_metadata(dst, e)
+                    result.links += 1
+                elif stat.S_ISFIFO(e.mode):
+                    _remove(dst)
+                    os.mkfifo(dst, stat.S_IMODE(e.mode))
+                    _apply_metadata(dst, e)
+                else:
+                    _remove(dst)
+                    os.mknod(dst, e.mode, e.rdev)
+                    _apply_metadata(dst, e)
+            except OSError as err:
+                result.errors.append((e.path, str(err)))
+
+        files.sort(key=lambda f: (f[1].ref is not None, f[1].offset or 0))
+        for dst, e in files:
+            try:
+                _remove(dst)
+                with open(dst, 'wb') as f:
+                    for block in archive.read(e):
+                        f.write(block)
+                _apply_metadata(dst, e)
+                result.files += 1
+                result.bytes += e.size
+            except (OSError, ValueError) as err:
+                result.errors.append((e.path, str(err)))
+            if on_progress is not None:
+                on_progress(result)
+
+    for target, dst in links:
+        try:
+            _remove(dst)
+            os.link(target, dst)
+            result.hardlinks += 1
+        except OSError as e:
+            result.errors.append((dst, str(e)))
+
+    for dst, e in reversed(dirs):
+        try:
+            _apply_metadata(dst, e)
+        except OSError as err:
+            result.errors.append((dst, str(err)))
+
+    return result
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _apply_metadata(path: str, e: ArchiveEntry):
+    try:
+        os.chown(path, e.uid, e.gid, follow_symlinks=False)
+    except PermissionError:
+        pass
+    if not stat.S_ISLNK(e.mode):
+        os.chmod(path, stat.S_IMODE(e.mode))
+    os.utime(path, ns=(e.atime, e.mtime), follow_symlinks=False)
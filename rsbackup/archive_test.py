@@ -0,0 +1,119 @@
+import datetime
+import os
+
+from rsbackup.archive import (Archive, archive_generation, archive_path,
+                              detach, generations_to_archive, restore_archive)
+from rsbackup.generations import (LATEST, SOURCES_FILE, list_archives,
+                                  list_generations)
+from rsbackup.manifest import history, read_manifest, write_manifest
+from rsbackup.prune import remove_generations
+
+_OLD = '2023-01-01_10-00-00'
+_NEW = '2023-01-02_10-00-00'
+
+
+def _target(fixture):
+    d = fixture.dir_name
+    old = os.path.join(d, _OLD)
+    new = os.path.join(d, _NEW)
+    fixture.write(os.path.join(old, 'src', 'kept'), b'kept' * 1000)
+    fixture.write(os.path.join(old, 'src', 'dir', 'old'), os.urandom(3 * 2**20))
+    fixture.write(os.path.join(old, 'src', 'dir', 'empty'), b'')
+    os.link(os.path.join(old, 'src', 'dir', 'old'), os.path.join(old, 'src', 'link'))
+    os.symlink('kept', os.path.join(old, 'src', 'sym'))
+    os.chmod(os.path.join(old, 'src', 'kept'), 0o640)
+    os.utime(os.path.join(old, 'src', 'kept'), (1000, 2000))
+    fixture.write(os.path.join(old, SOURCES_FILE), b'summary')
+    write_manifest(old)
+
+    os.makedirs(os.path.join(new, 'src'))
+    os.link(os.path.join(old, 'src', 'kept'), os.path.join(new, 'src', 'kept'))
+    write_manifest(new)
+    os.symlink(new, os.path.join(d, LATEST))
+    return old, new
+
+
+def test_generations_to_archive(fixture):
+    d = fixture.dir_name
+    _target(fixture)
+    now = datetime.datetime(2023, 1, 3, 10, 0, 0)
+    assert generations_to_archive(d, datetime.timedelta(days=1), now) == [_OLD]
+    # The latest generation is never archived.
+    assert generations_to_archive(d, datetime.timedelta(days=0), now) == [_OLD]
+    assert generations_to_archive(d, datetime.timedelta(days=3), now) == []
+
+
+def test_archive_and_restore(fixture):
+    d = fixture.dir_name
+    old, _ = _target(fixture)
+    data = fixture.read(os.path.join(old, 'src', 'dir', 'old'))
+    entries = list(read_manifest(old))
+
+    result = archive_generation(d, _OLD, workers=2)
+
+    assert not os.path.exists(old)
+    assert list_generations(d) == [_NEW]
+    assert list_archives(d) == [_OLD]
+    assert result.files == 4
+    assert result.referenced == 1
+    assert result.referenced_bytes == 4000
+    assert [e[:2] for e in read_manifest(old)] == [e[:2] for e in entries]
+    assert [g for g, _ in history(d, 'src/kept')] == [_OLD, _NEW]
+
+    with Archive(archive_path(d, _OLD)) as a:
+        assert a.metadata(SOURCES_FILE) == b'summary'
+        assert a.entry('src/kept').ref == _NEW
+
+    dest = os.path.join(d, 'restored')
+    os.makedirs(dest)
+    result = restore_archive(archive_path(d, _OLD), 'src', dest)
+
+    assert result.success, result.errors
+    assert result.files == 3
+    assert result.hardlinks == 1
+    assert fixture.read(os.path.join(dest, 'src', 'dir', 'old')) == data
+    assert fixture.read(os.path.join(dest, 'src', 'dir', 'empty')) == b''
+    assert fixture.read(os.path.join(dest, 'src', 'kept')) == b'kept' * 1000
+    assert os.readlink(os.path.join(dest, 'src', 'sym')) == 'kept'
+    st = os.stat(os.path.join(dest, 'src', 'kept'))
+    assert (st.st_mode & 0o777, st.st_mtime) == (0o640, 2000)
+    assert os.path.samefile(os.path.join(dest, 'src', 'link'),
+                            os.path.join(dest, 'src', 'dir', 'old'))
+
+
+def test_detach_copies_referenced_data(fixture):
+    d = fixture.dir_name
+    _target(fixture)
+    archive_generation(d, _OLD)
+
+    assert detach(d, [_NEW]) == 1
+    remove_generations(d, [_NEW])
+
+    with Archive(archive_path(d, _OLD)) as a:
+        entry = a.entry('src/kept')
+        assert entry.ref is None
+        assert b''.join(a.read(entry)) == b'kept' * 1000
+        assert b''.join(a.read(a.entry('src/dir/old'))) ==\
+            b''.join(a.read(a.entry('src/link')))
+
+
+def test_archive_paths_not_valid_utf8(fixture):
+    d = fixture.dir_name
+    old, _ = _target(fixture)
+    name = os.fsdecode(b'caf\xe9')
+    fixture.write(os.path.join(old, 'src', name), b'coffee')
+    os.symlink(name, os.path.join(old, 'src', 'coffee'))
+    write_manifest(old)
+
+    archive_generation(d, _OLD)
+
+    with Archive(archive_path(d, _OLD)) as a:
+        assert b''.join(a.read(a.entry('src/' + name))) == b'coffee'
+        assert a.entry('src/coffee').link == name
+    assert [g for g, _ in history(d, 'src/' + name)] == [_OLD]
+
+    dest = os.path.join(d, 'restored')
+    os.makedirs(dest)
+    result = restore_archive(archive_path(d, _OLD), 'src', dest)
+    assert result.success, result.errors
+    assert fixture.read(os.path.join(dest, 'src', name)) == b'coffee'
@@ -0,0 +1,183 @@
+"""A catalog of the generations stored in a target.
+
+The catalog is an SQLite database in the root of the target with one record
+per generation describing the run that created it: start and end time,
+whether it succeeded, the number of files and bytes transferred and the
+generations used as `--link-dest`. `Backup.run` updates the catalog in a
+single transaction after every run. If the catalog is missing, it can be
+rebuilt from the metadata files stored in the generations and archives.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import typing
+
+from rsbackup.generations import (STATS_FILE, incomplete_generations,
+                                  list_archives, list_generations,
+                                  parse_generation_name)
+from rsbackup.manifest import read_manifest
+
+CATALOG_FILE = '.catalog.db'
+"Name of the catalog file stored in the target directory."
+
+
+class CatalogEntry(typing.NamedTuple):
+    """A single generation recorded in the catalog.
+
+    `end`, `files` and `bytes_transferred` are `None` if unknown, e.g. for
+    generations created before the catalog existed. `link_dests` lists the
+    names of the generations passed to rsync as `--link-dest`.
+    """
+    name: str
+    start: datetime.datetime
+    end: typing.Optional[datetime.datetime]
+    success: bool
+    error: typing.Optional[str]
+    files: typing.Optional[int]
+    bytes_transferred: typing.Optional[int]
+    link_dests: typing.List[str]
+
+    @property
+    def duration(self) -> typing.Optional[datetime.timedelta]:
+        return self.end - self.start if self.end else None
+
+
+def _open(target: str) -> sqlite3.Connection:
+    db = sqlite3.connect(os.path.join(target, CATALOG_FILE))
+    db.execute('''CREATE TABLE IF NOT EXISTS generations (
+        name TEXT PRIMARY KEY,
+        start TEXT NOT NULL,
+        end TEXT,
+        success INTEGER NOT NULL,
+        error TEXT,
+        files INTEGER,
+        bytes_transferred INTEGER,
+        link_dests TEXT NOT NULL
+    )''')
+    return db
+
+
+def _row(entry: CatalogEntry) -> tuple:
+    return (entry.name, entry.start.isoformat(),
+            entry.end.isoformat() if entry.end else None, int(entry.success),
+            entry.error, entry.files, entry.bytes_transferred,
+            json.dumps(entry.link_dests))
+
+
+def _entry(row: tuple) -> CatalogEntry:
+    name, start, end, success, error, files, transferred, link_dests = row
+    return CatalogEntry(name, datetime.datetime.fromisoformat(start),
+                        datetime.datetime.fromisoformat(end) if end else None,
+                        bool(success), error, files, transferred,
+                        json.loads(link_dests))
+
+
+def entry_from_result(result: dict) -> CatalogEntry:
+    "Returns the entry for a run described by `BackupResult.to_dict`."
+    stats = result.get('stats') or {}
+    return CatalogEntry(
+        name=os.path.basename(result['generation']),
+        start=datetime.datetime.fromisoformat(result['start']),
+        end=datetime.datetime.fromisoformat(result['end']) if result.get('end') else None,
+        success=result['success'],
+        error=result.get('error'),
+        files=stats.get('number_of_files'),
+        bytes_transferred=stats.get('total_transferred_file_size'),
+        link_dests=[os.path.basename(p) for p in result.get('link_dests') or []],
+    )
+
+
+def record(target: str, entry: CatalogEntry,
+           replaces: typing.Optional[str] = None):
+    """Records `entry` in the catalog of `target`. If `replaces` is given,
+    the record of that generation is removed in the same transaction; this
+    is used when an incomplete generation is resumed under a new name."""
+    db = _open(target)
+    try:
+        with db:
+            if replaces is not None:
+                db.execute('DELETE FROM generations WHERE name = ?', (replaces,))
+            db.execute('INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       _row(entry))
+    finally:
+        db.close()
+
+
+def remove(target: str, names: typing.Iterable[str]):
+    "Removes the records of the generations `names` from the catalog."
+    if not os.path.exists(os.path.join(target, CATALOG_FILE)):
+        return
+    db = _open(target)
+    try:
+        with db:
+            db.executemany('DELETE FROM generations WHERE name = ?',
+                           ((name,) for name in names))
+    finally:
+        db.close()
+
+
+def _read_entry(target: str, name: str, success: bool) -> CatalogEntry:
+    generation_dir = os.path.join(target, name)
+    try:
+        with open(os.path.join(generation_dir, STATS_FILE)) as f:
+            return entry_from_result(json.load(f))._replace(name=name)
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    entries = read_manifest(generation_dir)
+    files = sum(1 for _ in entries) if entries is not None else None
+    return CatalogEntry(name, parse_generation_name(name), None, success,
+                        None if success else 'incomplete', files, None, [])
+
+
+def _read_archived_entry(target: str, name: str) -> CatalogEntry:
+    from rsbackup.archive import Archive, archive_path
+
+    with Archive(archive_path(target, name)) as archive:
+        stats = archive.metadata(STATS_FILE)
+        if stats is not None:
+            try:
+                return entry_from_result(json.loads(stats))._replace(name=name)
+            except (ValueError, KeyError):
+                pass
+        files = sum(1 for _ in archive.entries())
+    return CatalogEntry(name, parse_generation_name(name), None, True, None,
+                        files, None, [])
+
+
+def rebuild(target: str):
+    """Rebuilds the catalog of `target` from the generations and archived
+    generations found on disk. Generations are described by their stored
+    statistics or, for older generations, by their name and manifest."""
+    entries = [_read_entry(target, name, True) for name in list_generations(target)]
+    entries += [_read_entry(target, name, False)
+                for name in incomplete_generations(target)]
+    entries += [_read_archived_entry(target, name) for name in list_archives(target)]
+
+    db = _open(target)
+    try:
+        with db:
+            db.execute('DELETE FROM generations')
+            db.executemany('INSERT INTO generations VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (_row(e) for e in entries))
+    finally:
+        db.close()
+
+
+def list_catalog(target: str, rebuild_missing: bool = True) -> typing.List[CatalogEntry]:
+    """Returns all entries of the catalog of `target` ordered from oldest to
+    newest. If the catalog does not exist and `rebuild_missing` is `True`,
+    it is rebuilt first."""
+    if not os.path.exists(os.path.join(target, CATALOG_FILE)):
+        if not rebuild_missing or not os.path.isdir(target):
+            return []
+        rebuild(target)
+
+    db = _open(target)
+    try:
+        return [_entry(row) for row in db.execute(
+            'SELECT * FROM generations ORDER BY name')]
+    finally:
+        db.close()
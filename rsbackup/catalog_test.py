@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+import tempfile
+
+from rsbackup.archive import archive_generation
+from rsbackup.catalog import (CATALOG_FILE, CatalogEntry, entry_from_result,
+                              list_catalog, rebuild, record, remove)
+from rsbackup.generations import STATS_FILE, mark_incomplete
+from rsbackup.manifest import write_manifest
+
+
+def _entry(name, success=True, link_dests=()):
+    start = datetime.datetime.strptime(name, '%Y-%m-%d_%H-%M-%S')
+    return CatalogEntry(name, start, start + datetime.timedelta(seconds=10),
+                        success, None if success else 'failed', 3, 1024,
+                        list(link_dests))
+
+
+def test_entry_from_result():
+    entry = entry_from_result({
+        'start': '2023-02-14T10:00:00',
+        'end': '2023-02-14T10:00:30',
+        'generation': '/backup/2023-02-14_10-00-00',
+        'link_dests': ['/backup/2023-02-13_10-00-00'],
+        'success': True,
+        'error': None,
+        'stats': {'number_of_files': 12, 'total_transferred_file_size': 2048},
+    })
+
+    assert entry == CatalogEntry(
+        '2023-02-14_10-00-00', datetime.datetime(2023, 2, 14, 10),
+        datetime.datetime(2023, 2, 14, 10, 0, 30), True, None, 12, 2048,
+        ['2023-02-13_10-00-00'])
+    assert entry.duration == datetime.timedelta(seconds=30)
+
+
+def test_record_and_remove():
+    with tempfile.TemporaryDirectory() as d:
+        record(d, _entry('2023-02-14_10-00-00'))
+        record(d, _entry('2023-02-15_10-00-00', success=False))
+        record(d, _entry('2023-02-16_10-00-00', link_dests=['2023-02-14_10-00-00']),
+               replaces='2023-02-15_10-00-00')
+
+        assert list_catalog(d) == [
+            _entry('2023-02-14_10-00-00'),
+            _entry('2023-02-16_10-00-00', link_dests=['2023-02-14_10-00-00']),
+        ]
+
+        remove(d, ['2023-02-14_10-00-00'])
+        assert [e.name for e in list_catalog(d)] == ['2023-02-16_10-00-00']
+
+
+def test_list_catalog_rebuilds_missing_catalog():
+    with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, '2023-02-14_10-00-00'))
+        with open(os.path.join(d, '2023-02-14_10-00-00', STATS_FILE), 'w') as f:
+            json.dump({
+                'start': '2023-02-14T10:00:00',
+                'end': '2023-02-14T10:01:00',
+                'generation': '/elsewhere/2023-02-14_10-00-00',
+                'link_dests': [],
+                'success': True,
+                'error': None,
+                'stats': {'number_of_files': 5, 'total_transferred_file_size': 100},
+            }, f)
+        os.makedirs(os.path.join(d, '2023-02-15_10-00-00'))
+        os.makedirs(os.path.join(d, '2023-02-16_10-00-00'))
+        mark_incomplete(os.path.join(d, '2023-02-16_10-00-00'))
+
+        assert list_catalog(d, rebuild_missing=False) == []
+
+        entries = list_catalog(d)
+        assert os.path.exists(os.path.join(d, CATALOG_FILE))
+        assert [(e.name, e.success, e.files, e.bytes_transferred) for e in entries] == [
+            ('2023-02-14_10-00-00', True, 5, 100),
+            ('2023-02-15_10-00-00', True, None, None),
+            ('2023-02-16_10-00-00', False, None, None),
+        ]
+        assert entries[0].duration == datetime.timedelta(minutes=1)
+        assert entries[1].start == datetime.datetime(2023, 2, 15, 10)
+
+
+def test_rebuild_drops_removed_generations():
+    with tempfile.TemporaryDirectory() as d:
+        record(d, _entry('2023-02-14_10-00-00'))
+        os.makedirs(os.path.join(d, '2023-02-15_10-00-00'))
+
+        rebuild(d)
+
+        assert [e.name for e in list_catalog(d)] == ['2023-02-15_10-00-00']
+
+
+def test_rebuild_includes_archived_generations(fixture):
+    d = fixture.dir_name
+    old = os.path.join(d, '2023-02-14_10-00-00')
+    fixture.write(os.path.join(old, 'src', 'spam'), b'spam')
+    fixture.write(os.path.join(old, STATS_FILE), json.dumps({
+        'start': '2023-02-14T10:00:00',
+        'end': '2023-02-14T10:01:00',
+        'generation': old,
+        'link_dests': [],
+        'success': True,
+        'error': None,
+        'stats': {'number_of_files': 5, 'total_transferred_file_size': 100},
+    }))
+    write_manifest(old)
+    older = os.path.join(d, '2023-02-13_10-00-00')
+    fixture.write(os.path.join(older, 'src', 'eggs'), b'eggs')
+    write_manifest(older)
+    os.makedirs(os.path.join(d, '2023-02-15_10-00-00'))
+    archive_generation(d, '2023-02-13_10-00-00')
+    archive_generation(d, '2023-02-14_10-00-00')
+
+    rebuild(d)
+
+    assert [(e.name, e.success, e.files, e.bytes_transferred) for e in list_catalog(d)] == [
+        ('2023-02-13_10-00-00', True, 2, None),
+        ('2023-02-14_10-00-00', True, 5, 100),
+        ('2023-02-15_10-00-00', True, None, None),
+    ]
@@ -0,0 +1,96 @@
+"""Cheap detection of unchanged sources.
+
+A source summary maps every directory of the sources to a digest over the
+names, types, sizes, modes and modification times of its entries. This is
+the same information rsync uses for its quick check, so if the summary of
+the sources equals the summary stored with the previous generation, running
+rsync would not transfer anything.
+
+Computing a summary only requires a walk of the sources without any
+subprocess or target side work. Like rsync, the walk does not enter
+excluded directories.
+"""
+
+import hashlib
+import json
+import os
+import stat
+import typing
+
+from rsbackup.generations import SOURCES_FILE
+
+_VERSION = 2
+
+
+def summarize_sources(sources: typing.Sequence[str],
+                      excludes: typing.Sequence[str] = (),
+                      rules: typing.Iterable[str] = ()) -> typing.Dict[str, str]:
+    """Returns the summary of `sources` as a mapping of directory paths to
+    hex digests. The empty key holds a digest of the source and exclude
+    configuration, so changing these invalidates the summary as well.
+
+    The sources are walked applying the rsync filter `rules` (see
+    `rsbackup.filters.walk_sources`), so changes to excluded entries do not
+    change the summary.
+    """
+    from rsbackup.filters import transfer_path, walk_sources
+
+    config = hashlib.blake2b(digest_size=16)
+    for value in list(sources) + ['\0'] + list(excludes):
+        config.update(os.fsencode(value) + b'\0')
+    summary = {'': config.hexdigest()}
+
+    roots = {os.path.normpath(transfer_path(source)[0]): source
+             for source in sources}
+    root_digest = hashlib.blake2b(digest_size=16)
+    digests = {}
+    for path, _, st in walk_sources(sources, rules):
+        path = os.path.normpath(path)
+        if path in roots:
+            root_digest.update(_describe(roots[path], st))
+        else:
+            digests[os.path.dirname(path)].update(
+                _describe(os.path.basename(path), st))
+        if stat.S_ISDIR(st.st_mode):
+            digests[path] = hashlib.blake2b(digest_size=16)
+    summary['/'] = root_digest.hexdigest()
+
+    for path, digest in digests.items():
+        summary[path] = digest.hexdigest()
+    return summary
+
+
+def _describe(name: str, st: os.stat_result) -> bytes:
+    return b'%s\0%d\0%d\0%d\0' % (os.fsencode(name), st.st_mode, st.st_size,
+                                 st.st_mtime_ns)
+
+
+def write_summary(generation_dir: str, summary: typing.Dict[str, str]):
+    "Stores `summary` in the generation at `generation_dir`."
+    with open(os.path.join(generation_dir, SOURCES_FILE), 'w',
+              errors='surrogateescape') as f:
+        json.dump({'version': _VERSION, 'directories': summary}, f,
+                  separators=(',', ':'))
+
+
+def read_summary(generation_dir: str) -> typing.Optional[typing.Dict[str, str]]:
+    """Returns the summary stored in the generation at `generation_dir` or
+    `None` if the generation has no (compatible) summary."""
+    try:
+        with open(os.path.join(generation_dir, SOURCES_FILE),
+                  errors='surrogateescape') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if data.get('version') != _VERSION:
+        return None
+    return data['directories']
+
+
+def changed_directories(previous: typing.Dict[str, str],
+                        current: typing.Dict[str, str]) -> typing.List[str]:
+    """Returns the directories whose digest differs between the `previous`
+    and `current` summaries, including added and removed directories."""
+    return sorted(k for k in previous.keys() | current.keys()
+                  if previous.get(k) != current.get(k))
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from rsbackup import Backup
+from rsbackup.changes import (changed_directories, summarize_sources,
+                              write_summary)
+from rsbackup.generations import LATEST, list_generations
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.messages = []
+
+    async def _record(self, s=None, *args):
+        self.messages.append(s)
+
+    details = info = success = warn = _record
+    start_progress = stop_progress = update_progress = _record
+
+
+def test_summarize_sources_detects_changes(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'a', 'spam'), 'spam')
+    fixture.write(os.path.join(src, 'b', 'eggs'), 'eggs')
+
+    before = summarize_sources([src])
+    assert summarize_sources([src]) == before
+    assert summarize_sources([src], excludes=['eggs']) != before
+
+    fixture.write(os.path.join(src, 'a', 'spam'), 'more spam')
+    assert changed_directories(before, summarize_sources([src])) == [
+        os.path.join(src, 'a')]
+
+
+def test_summarize_sources_ignores_excluded_entries(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'spam'), 'spam')
+    fixture.write(os.path.join(src, '.cache', 'tmp'), 'tmp')
+    rules = ['- .cache']
+
+    before = summarize_sources([src], ['.cache'], rules)
+    assert os.path.join(src, '.cache') not in before
+
+    fixture.write(os.path.join(src, '.cache', 'tmp'), 'more tmp')
+    fixture.write(os.path.join(src, '.cache', 'new'), 'new')
+    assert summarize_sources([src], ['.cache'], rules) == before
+
+    fixture.write(os.path.join(src, 'spam'), 'more spam')
+    assert changed_directories(before, summarize_sources([src], ['.cache'], rules)) == [src]
+
+
+def test_run_skips_unchanged_sources(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    bak = os.path.join(d, 'bak')
+    fixture.write(os.path.join(src, 'spam'), 'spam')
+    prev = os.path.join(bak, '2023-01-01_10-00-00')
+    os.makedirs(prev)
+    os.symlink(prev, os.path.join(bak, LATEST))
+    write_summary(prev, summarize_sources([src]))
+
+    logger = RecordingLogger()
+    asyncio.run(Backup([src], bak, skip_unchanged=True).run(logger=logger))
+
+    assert list_generations(bak) == ['2023-01-01_10-00-00']
+    assert f"Sources unchanged since {prev}; skipping backup" in logger.messages
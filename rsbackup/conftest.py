@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import pytest
+
+from rsbackup import LoggingProtocol
+
+
+class FileFixture:
+    def __init__(self):
+        self._dir = tempfile.TemporaryDirectory(prefix='rsbackup_test_')
+        self.dir_name = self._dir.name
+
+    def write(self, path, content=b'', mtime_ns=None):
+        """Writes `content` to `path`, which is relative to `dir_name` unless
+        absolute, creating its parent directories.
+
+        `content` may be `str` or `bytes`. If `mtime_ns` is given, it is set
+        as the modification time of the file."""
+        path = os.path.join(self.dir_name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w' if isinstance(content, str) else 'wb') as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def read(self, path):
+        with open(os.path.join(self.dir_name, path), 'rb') as f:
+            return f.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._dir.cleanup()
+
+
+@pytest.fixture
+def fixture():
+    with FileFixture() as fixture:
+        yield fixture
+
+
+class NullLogger(LoggingProtocol):
+    async def details(self, s: str): ...
+    async def info(self, s: str): ...
+    async def success(self, s: str): ...
+    async def warn(self, s: str): ...
+    async def start_progress(self): ...
+    async def stop_progress(self): ...
+    async def update_progress(self, completion: float, message: str): ...
+
+
+@pytest.fixture
+def logger():
+    return NullLogger()
@@ -0,0 +1,390 @@
+"""Runs backups on a schedule from a single long-running process.
+
+The daemon loads the configuration once and reloads it whenever the
+configuration file changes. Every backup with a `schedule` is run at the
+times it defines, delayed by a random `jitter`. All backups share a
+`DeviceScheduler`, so backups using the same disk never run at the same
+time. The status of every scheduled backup can be queried through a UNIX
+socket: a client connects and receives a JSON document; no request needs to
+be sent.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import typing
+
+from rsbackup import Backup, LoggingProtocol
+from rsbackup.generations import (TargetLockedError, latest_generation,
+                                  parse_generation_name)
+from rsbackup.scheduler import DeviceScheduler, devices_of
+
+_INTERVAL = re.compile(r'^(\d+)([smhdw])$')
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+_CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+)
+
+
+class IntervalSchedule:
+    "A schedule running a backup every `interval`."
+
+    def __init__(self, interval: datetime.timedelta):
+        self.interval = interval
+
+    def next_after(self, t: datetime.datetime) -> datetime.datetime:
+        return t + self.interval
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSchedule) and self.interval == other.interval
+
+
+class CronSchedule:
+    """A schedule defined by a cron expression with five fields (minute,
+    hour, day of month, month and day of week). Fields support `*`, single
+    values, ranges `a-b`, steps `*/n` and `a-b/n` and comma separated lists.
+    As with cron, if both day of month and day of week are restricted, a day
+    matching either of them matches.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError(f"Invalid cron expression: {expression!r}")
+
+        self.expression = expression
+        (self.minutes, self.hours, self.days, self.months, weekdays) = (
+            _parse_cron_field(field, *spec)
+            for field, spec in zip(fields, _CRON_FIELDS))
+        # Both 0 and 7 denote Sunday; datetime uses 0 for Monday.
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, t: datetime.datetime) -> bool:
+        day = t.day in self.days
+        weekday = t.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, t: datetime.datetime) -> datetime.datetime:
+        """Returns the first time strictly after `t` matching this schedule.
+        Raises a `ValueError` if no such time exists within five years."""
+        t = t.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=5 * 366)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) +
+                     datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+    def __eq__(self, other):
+        return isinstance(other, CronSchedule) and self.expression == other.expression
+
+
+def _parse_cron_field(field: str, name: str, low: int, high: int) -> typing.Set[int]:
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, _, end = part.partition('-')
+            start, end = int(start), int(end)
+        else:
+            start = end = int(part)
+        if step:
+            if part != '*' and '-' not in part:
+                end = high
+            step = int(step)
+        else:
+            step = 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Invalid {name} in cron expression: {field!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_schedule(s: str) -> typing.Union[IntervalSchedule, CronSchedule]:
+    """Parses the `schedule` of a backup. `s` is either an interval made of
+    a number and one of the units `s`, `m`, `h`, `d` and `w` or a cron
+    expression. Raises a `ValueError` if `s` is invalid."""
+    if m := _INTERVAL.match(s.strip()):
+        seconds = int(m[1]) * _INTERVAL_UNITS[m[2]]
+        if seconds <= 0:
+            raise ValueError(f"Invalid interval: {s!r}")
+        return IntervalSchedule(datetime.timedelta(seconds=seconds))
+    return CronSchedule(s)
+
+
+def set_priority(nice: typing.Optional[int] = None,
+                 ionice_class: typing.Optional[int] = None,
+                 ionice_level: typing.Optional[int] = None):
+    """Lowers the CPU and I/O priority of the current process. Child
+    processes such as rsync inherit the priority. The I/O priority is set
+    using the `ionice` utility which is only available on Linux."""
+    if nice:
+        os.nice(nice)
+
+    if ionice_class is not None:
+        args = ['ionice', '-c', str(ionice_class)]
+        if ionice_level is not None:
+            args += ['-n', str(ionice_level)]
+        subprocess.run(args + ['-p', str(os.getpid())], check=True)
+
+
+class ConfigStatus:
+    "The status of a scheduled backup configuration."
+
+    def __init__(self, name: str):
+        self.name = name
+        self.schedule = None
+        self.next_run = None
+        self.running = False
+        self.last_start = None
+        self.last_end = None
+        self.last_error = None
+        self.last_unchanged = False
+        self.runs = 0
+        self.failures = 0
+
+    def to_dict(self) -> dict:
+        "Returns a JSON serializable representation of this status."
+        def iso(t):
+            return t.isoformat(timespec='seconds') if t else None
+
+        return {
+            'schedule': self.schedule,
+            'next_run': iso(self.next_run),
+            'running': self.running,
+            'last_start': iso(self.last_start),
+            'last_end': iso(self.last_end),
+            'last_success': None if self.last_start is None else self.last_error is None,
+            'last_error': self.last_error,
+            'last_unchanged': self.last_unchanged,
+            'runs': self.runs,
+            'failures': self.failures,
+        }
+
+
+class Daemon:
+    """Runs the scheduled backups of a configuration file.
+
+    `load_config` is called with `config_file` and must return a mapping of
+    configuration names to `Backup` instances. The file is checked for
+    modifications every `reload_interval` seconds.
+
+    `logger_factory` is called with a configuration name and must return the
+    `LoggingProtocol` to pass to that backup's `run` method. `logger` is
+    used for messages of the daemon itself.
+
+    `jobs` limits the number of backups running at the same time.
+
+    If `socket_path` is given, the status of all scheduled backups is served
+    on a UNIX socket at this path.
+    """
+
+    def __init__(self, config_file: str,
+                 load_config: typing.Callable[[str], typing.Mapping[str, Backup]],
+                 logger: LoggingProtocol,
+                 logger_factory: typing.Callable[[str], LoggingProtocol],
+                 jobs: typing.Optional[int] = None,
+                 socket_path: typing.Optional[str] = None,
+                 reload_interval: float = 5):
+        self.config_file = config_file
+        self.load_config = load_config
+        self.logger = logger
+        self.logger_factory = logger_factory
+        self.socket_path = socket_path
+        self.reload_interval = reload_interval
+        self.status = {}
+        self._scheduler = DeviceScheduler(jobs)
+        self._backups = {}
+        self._schedules = {}
+        self._tasks = {}
+        self._wakeups = {}
+        self._mtime = None
+
+    async def run(self, stop: typing.Optional[asyncio.Event] = None):
+        """Runs until `stop` is set. Running backups are cancelled when
+        stopping."""
+        stop = stop or asyncio.Event()
+        server = None
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            server = await asyncio.start_unix_server(self._serve_status,
+                                                     path=self.socket_path)
+            await self.logger.details(f"Serving status on {self.socket_path}")
+
+        try:
+            while not stop.is_set():
+                await self._reload()
+                try:
+                    await asyncio.wait_for(stop.wait(), self.reload_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+                os.remove(self.socket_path)
+
+    async def _reload(self):
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError as e:
+            await self.logger.warn(f"Cannot read {self.config_file}: {e}")
+            return
+
+        if mtime == self._mtime:
+            return
+
+        try:
+            backups = self.load_config(self.config_file)
+        except Exception as e:
+            await self.logger.warn(f"Keeping previous configuration; cannot load {self.config_file}: {e}")
+            self._mtime = mtime
+            return
+
+        if self._mtime is not None:
+            await self.logger.info(f"Reloaded {self.config_file}")
+        self._mtime = mtime
+
+        schedules = {}
+        for name, backup in backups.items():
+            if not backup.schedule:
+                continue
+            try:
+                schedules[name] = parse_schedule(backup.schedule)
+            except ValueError as e:
+                await self.logger.warn(f"{name}: {e}")
+
+        for name in list(self._tasks):
+            if name not in schedules:
+                self._tasks.pop(name).cancel()
+                self._wakeups.pop(name)
+                self.status.pop(name)
+
+        for name, schedule in schedules.items():
+            changed = name not in self._backups or\
+                self._backups[name] != backups[name] or\
+                self._schedules[name] != schedule
+            self._backups[name] = backups[name]
+            self._schedules[name] = schedule
+            if name not in self._tasks:
+                self.status[name] = ConfigStatus(name)
+                self._wakeups[name] = asyncio.Event()
+                self._tasks[name] = asyncio.create_task(self._schedule_loop(name))
+            elif changed:
+                self._wakeups[name].set()
+
+        for name in list(self._backups):
+            if name not in schedules:
+                del self._backups[name]
+                del self._schedules[name]
+
+    def _next_run(self, name: str) -> datetime.datetime:
+        backup = self._backups[name]
+        schedule = self._schedules[name]
+        status = self.status[name]
+        now = datetime.datetime.now()
+
+        last = status.last_start
+        if last is None and isinstance(schedule, IntervalSchedule):
+            latest = latest_generation(backup.target)
+            last = parse_generation_name(latest) if latest else None
+
+        if isinstance(schedule, IntervalSchedule):
+            due = schedule.next_after(last) if last else now
+            due = max(due, now)
+        else:
+            due = schedule.next_after(now)
+
+        return due + datetime.timedelta(seconds=random.uniform(0, backup.jitter or 0))
+
+    async def _schedule_loop(self, name: str):
+        status = self.status[name]
+        wakeup = self._wakeups[name]
+        while True:
+            wakeup.clear()
+            status.schedule = self._backups[name].schedule
+            status.next_run = self._next_run(name)
+            delay = (status.next_run - datetime.datetime.now()).total_seconds()
+            try:
+                await asyncio.wait_for(wakeup.wait(), max(delay, 0))
+                # The configuration changed; compute the next run again.
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            await self._run_backup(name)
+
+    async def _run_backup(self, name: str):
+        backup = self._backups[name]
+        status = self.status[name]
+        logger = self.logger_factory(name)
+
+        try:
+            devices = devices_of(backup)
+        except OSError as e:
+            devices = frozenset()
+            await logger.warn(f"Cannot determine devices: {e}")
+
+        async with self._scheduler.slot(devices):
+            status.running = True
+            status.last_start = datetime.datetime.now()
+            status.runs += 1
+            try:
+                result = await backup.run(logger=logger)
+                status.last_error = None
+                status.last_unchanged = result.unchanged
+            except TargetLockedError as e:
+                await logger.warn(f"Skipping run: {e}")
+            except Exception as e:
+                status.last_error = str(e)
+                status.failures += 1
+                await logger.warn(f"Backup failed: {e}")
+            finally:
+                status.running = False
+                status.last_end = datetime.datetime.now()
+
+    async def _serve_status(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        try:
+            writer.write(json.dumps(
+                {name: s.to_dict() for name, s in self.status.items()},
+                indent=2).encode() + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def query_status(socket_path: str) -> dict:
+    "Returns the status served by a daemon listening on `socket_path`."
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        return json.loads(await reader.read())
+    finally:
+        writer.close()
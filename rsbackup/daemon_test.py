@@ -0,0 +1,85 @@
+import asyncio
+import datetime
+import os
+import tempfile
+
+import pytest
+
+from rsbackup import Backup, BackupResult
+from rsbackup.daemon import (CronSchedule, Daemon, IntervalSchedule,
+                             parse_schedule, query_status)
+
+
+def test_parse_schedule_interval():
+    assert parse_schedule('90m') == IntervalSchedule(datetime.timedelta(minutes=90))
+    assert parse_schedule('1d').next_after(datetime.datetime(2023, 1, 1)) ==\
+        datetime.datetime(2023, 1, 2)
+
+
+def test_parse_schedule_invalid():
+    for s in ('0h', '* * *', '60 * * * *', '* * * 13 *', '*/0 * * * *'):
+        with pytest.raises(ValueError):
+            parse_schedule(s)
+
+
+def test_cron_schedule():
+    t = datetime.datetime(2023, 1, 31, 23, 59, 30)
+    assert CronSchedule('30 2 * * *').next_after(t) ==\
+        datetime.datetime(2023, 2, 1, 2, 30)
+    assert CronSchedule('*/15 * * * *').next_after(t) ==\
+        datetime.datetime(2023, 2, 1, 0, 0)
+    assert CronSchedule('0 9-17/4 * * 1-5').next_after(t) ==\
+        datetime.datetime(2023, 2, 1, 9, 0)
+    # 2023-02-05 is a Sunday.
+    assert CronSchedule('0 0 * * 7').next_after(t) ==\
+        datetime.datetime(2023, 2, 5)
+    assert CronSchedule('0 0 29 2 *').next_after(t) ==\
+        datetime.datetime(2024, 2, 29)
+    # Day of month and day of week match either.
+    assert CronSchedule('0 0 15 * 0').next_after(t) ==\
+        datetime.datetime(2023, 2, 5)
+
+
+class CountingBackup(Backup):
+    def __init__(self, target, schedule, runs):
+        super().__init__(sources=[target], target=target, schedule=schedule)
+        self._runs = runs
+
+    async def run(self, logger=None, **kwargs):
+        self._runs.append(self.target)
+        return BackupResult(datetime.datetime.now())
+
+
+def test_daemon_runs_scheduled_backups_and_serves_status(logger):
+    with tempfile.TemporaryDirectory() as d:
+        config_file = os.path.join(d, 'rsbackup.toml')
+        socket_path = os.path.join(d, 'rsbackup.sock')
+        with open(config_file, 'w') as f:
+            f.write('')
+        runs = []
+
+        def load_config(name):
+            return {'a': CountingBackup(d, '1h', runs),
+                    'b': CountingBackup(d, None, runs)}
+
+        async def run():
+            stop = asyncio.Event()
+            daemon = Daemon(config_file, load_config, logger,
+                            lambda name: logger, socket_path=socket_path,
+                            reload_interval=0.01)
+            task = asyncio.create_task(daemon.run(stop))
+            while not runs:
+                await asyncio.sleep(0.01)
+            status = await query_status(socket_path)
+            stop.set()
+            await task
+            return status
+
+        status = asyncio.run(run())
+
+        assert runs == [d]
+        assert list(status) == ['a']
+        assert status['a']['schedule'] == '1h'
+        assert status['a']['runs'] == 1
+        assert status['a']['last_success'] is True
+        assert not os.path.exists(socket_path)
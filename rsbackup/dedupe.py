@@ -0,0 +1,319 @@
+"""Deduplication of identical files across backup targets.
+
+`--link-dest` only hard links files against earlier generations of the same
+configuration. Configurations writing to the same volume often store
+identical files (VM images, vendored dependencies, media) once per
+configuration. Deduplication replaces such copies with hard links to a
+single file.
+
+An index stored in the common parent directory of the targets lists the
+files of all complete generations, read from their manifests. The index is
+updated incrementally: only generations not yet indexed are read and
+generations removed since are dropped. Only files whose size collides with
+a file of another inode are candidates; candidates must also share mode,
+owner and modification time, so hard linking them does not change any
+metadata of the backup. Candidates are hashed on a worker pool and the
+digests are kept in the index, so every file is read at most once.
+"""
+
+import concurrent.futures
+import os
+import sqlite3
+import stat
+import typing
+
+from rsbackup.generations import list_generations
+from rsbackup.manifest import (connect, read_manifest, update_inodes,
+                               walk_generation)
+from rsbackup.usage import INDEX_FILE as USAGE_INDEX_FILE
+from rsbackup.verify import file_digest
+
+INDEX_FILE = '.dedupe'
+"Name of the index file stored in the common parent of the targets."
+
+_LINK_MAX = 65000
+_TMP_SUFFIX = '.rsbackup-dedupe'
+
+
+class DedupeResult:
+    """The result of a deduplication run.
+
+    `linked` is the number of paths replaced by a hard link and
+    `saved_bytes` the space freed by removing the last link to a file.
+    `errors` is a list of tuples containing a path and a description of the
+    problem.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.candidates = 0
+        self.hashed = 0
+        self.hashed_bytes = 0
+        self.linked = 0
+        self.saved_bytes = 0
+        self.errors = []
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+
+def index_path(targets: typing.Sequence[str]) -> str:
+    "Returns the path of the index shared by `targets`."
+    return os.path.join(os.path.commonpath([os.path.abspath(t) for t in targets]),
+                        INDEX_FILE)
+
+
+def _open_index(path: str) -> sqlite3.Connection:
+    db = connect(path)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS generations (
+            path TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            generation TEXT NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS files_size ON files (size);
+        CREATE INDEX IF NOT EXISTS files_generation ON files (generation);
+        CREATE TABLE IF NOT EXISTS digests (
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            digest BLOB NOT NULL,
+            PRIMARY KEY (inode, size, mtime)
+        ) WITHOUT ROWID;
+    ''')
+    return db
+
+
+def _update_index(db: sqlite3.Connection, root: str,
+                  targets: typing.Sequence[str]) -> int:
+    """Adds the generations of `targets` missing from the index and drops
+    removed ones. Paths are stored relative to `root`. Returns the number of
+    files indexed."""
+    current = {os.path.relpath(os.path.join(target, name), root)
+               for target in targets for name in list_generations(target)}
+    indexed = {row[0] for row in db.execute('SELECT path FROM generations')}
+
+    with db:
+        for generation in indexed - current:
+            db.execute('DELETE FROM files WHERE generation = CAST(? AS TEXT)',
+                       (os.fsencode(generation),))
+            db.execute('DELETE FROM generations WHERE path = CAST(? AS TEXT)',
+                       (os.fsencode(generation),))
+
+        for generation in sorted(current - indexed):
+            generation_dir = os.path.join(root, generation)
+            entries = read_manifest(generation_dir)
+            if entries is None:
+                entries = walk_generation(generation_dir)
+            db.executemany('INSERT OR REPLACE INTO files VALUES '
+                           '(CAST(? AS TEXT), CAST(? AS TEXT), ?, ?)', (
+                (os.fsencode(f"{generation}/{e.path}"), os.fsencode(generation),
+                 e.inode, e.size)
+                for e in entries if stat.S_ISREG(e.mode)))
+            db.execute('INSERT INTO generations VALUES (CAST(? AS TEXT))',
+                       (os.fsencode(generation),))
+
+    return db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+class _Inode:
+    "A file stored under one or more paths."
+
+    def __init__(self, inode: int, st: os.stat_result, paths: typing.List[str]):
+        self.inode = inode
+        self.st = st
+        self.paths = paths
+        self.digest = None
+
+    @property
+    def key(self) -> tuple:
+        "Files with equal keys can be linked without changing metadata."
+        return (self.st.st_mode, self.st.st_uid, self.st.st_gid,
+                self.st.st_mtime_ns)
+
+
+def _candidates(db: sqlite3.Connection, root: str, min_size: int,
+                result: DedupeResult) -> typing.List[typing.List[_Inode]]:
+    """Returns groups of inodes sharing size and metadata. Paths whose file
+    changed since it was indexed are skipped."""
+    groups = []
+    sizes = [row[0] for row in db.execute(
+        'SELECT size FROM files WHERE size >= ? GROUP BY size '
+        'HAVING COUNT(DISTINCT inode) > 1 ORDER BY size DESC', (min_size,))]
+
+    for size in sizes:
+        paths = {}
+        for path, inode in db.execute(
+                'SELECT path, inode FROM files WHERE size = ?', (size,)):
+            paths.setdefault(inode, []).append(path)
+
+        by_key = {}
+        for inode, inode_paths in paths.items():
+            try:
+                st = os.lstat(os.path.join(root, inode_paths[0]))
+            except OSError as e:
+                result.errors.append((inode_paths[0], str(e)))
+                continue
+            if st.st_ino != inode or st.st_size != size:
+                continue
+            i = _Inode(inode, st, inode_paths)
+            by_key.setdefault(i.key, []).append(i)
+
+        groups += [g for g in by_key.values() if len(g) > 1]
+
+    return groups
+
+
+def _hash(db: sqlite3.Connection, root: str,
+          groups: typing.List[typing.List[_Inode]],
+          workers: typing.Optional[int], result: DedupeResult,
+          on_progress: typing.Optional[typing.Callable[[DedupeResult], None]]):
+    "Sets the digest of all inodes in `groups`, hashing unknown files."
+    to_hash = []
+    for group in groups:
+        for i in group:
+            result.candidates += 1
+            row = db.execute(
+                'SELECT digest FROM digests WHERE inode = ? AND size = ? AND mtime = ?',
+                (i.inode, i.st.st_size, i.st.st_mtime_ns)).fetchone()
+            if row is not None:
+                i.digest = row[0]
+            else:
+                to_hash.append(i)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(file_digest, os.path.join(root, i.paths[0])): i
+                   for i in to_hash}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                i.digest = future.result()
+            except OSError as e:
+                result.errors.append((i.paths[0], str(e)))
+                continue
+            result.hashed += 1
+            result.hashed_bytes += i.st.st_size
+            with db:
+                db.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)',
+                           (i.inode, i.st.st_size, i.st.st_mtime_ns, i.digest))
+            if on_progress is not None:
+                on_progress(result)
+
+
+def _link(root: str, keeper: _Inode, path: str):
+    """Atomically replaces the file at `path` with a hard link to
+    `keeper`."""
+    full_path = os.path.join(root, path)
+    tmp_path = full_path + _TMP_SUFFIX
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+    os.link(os.path.join(root, keeper.paths[0]), tmp_path)
+    try:
+        os.replace(tmp_path, full_path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+def _link_group(db: sqlite3.Connection, root: str, group: typing.List[_Inode],
+                link_max: int, dry_run: bool, result: DedupeResult,
+                changes: typing.Dict[str, typing.Dict[str, int]]):
+    """Replaces all paths of the inodes in `group` with hard links to the
+    inode with the most links. If that inode reaches `link_max` links, the
+    next inode becomes the link target for the remaining ones."""
+    group = sorted(group, key=lambda i: i.st.st_nlink, reverse=True)
+    keeper, nlink = group[0], group[0].st.st_nlink
+
+    for other in group[1:]:
+        if nlink + len(other.paths) > link_max:
+            keeper, nlink = other, other.st.st_nlink
+            continue
+
+        linked = 0
+        for path in other.paths:
+            if not dry_run:
+                try:
+                    if os.lstat(os.path.join(root, path)).st_ino != other.inode:
+                        continue
+                    _link(root, keeper, path)
+                except OSError as e:
+                    result.errors.append((path, str(e)))
+                    continue
+                generation = db.execute(
+                    'SELECT generation FROM files WHERE path = CAST(? AS TEXT)',
+                    (os.fsencode(path),)).fetchone()[0]
+                changes.setdefault(generation, {})[path[len(generation) + 1:]] = keeper.inode
+                with db:
+                    db.execute('UPDATE files SET inode = ? WHERE path = CAST(? AS TEXT)',
+                               (keeper.inode, os.fsencode(path)))
+            linked += 1
+
+        result.linked += linked
+        nlink += linked
+        if linked == other.st.st_nlink:
+            result.saved_bytes += other.st.st_size
+
+
+def dedupe(targets: typing.Sequence[str],
+           workers: typing.Optional[int] = None,
+           dry_run: bool = False,
+           min_size: int = 1,
+           index: typing.Optional[str] = None,
+           on_progress: typing.Optional[typing.Callable[[DedupeResult], None]] = None) -> DedupeResult:
+    """Replaces identical files in the generations of `targets` with hard
+    links and returns a `DedupeResult`.
+
+    All targets must reside on the same file system. `index` is the path of
+    the index file; it defaults to `index_path(targets)`. Files smaller than
+    `min_size` bytes are ignored. Candidates are hashed using `workers`
+    threads. If `dry_run` is `True`, files are hashed but not replaced.
+
+    Manifests of changed generations are updated with the new inode numbers
+    and the usage indexes of changed targets are removed, so they are
+    rebuilt on the next use. `on_progress` is called with the intermediate
+    result after every hashed file.
+    """
+    devices = {os.stat(t).st_dev for t in targets}
+    if len(devices) > 1:
+        raise ValueError('Targets reside on different file systems')
+
+    index = index or index_path(targets)
+    root = os.path.dirname(os.path.abspath(index))
+    try:
+        link_max = os.pathconf(root, 'PC_LINK_MAX')
+    except (OSError, ValueError):
+        link_max = _LINK_MAX
+
+    result = DedupeResult()
+    db = _open_index(index)
+    try:
+        result.files = _update_index(db, root, targets)
+        groups = _candidates(db, root, min_size, result)
+        _hash(db, root, groups, workers, result, on_progress)
+
+        changes = {}
+        for group in groups:
+            by_digest = {}
+            for i in group:
+                if i.digest is not None:
+                    by_digest.setdefault(i.digest, []).append(i)
+            for duplicates in by_digest.values():
+                if len(duplicates) > 1:
+                    _link_group(db, root, duplicates, link_max, dry_run,
+                                result, changes)
+
+        for generation, inodes in changes.items():
+            update_inodes(os.path.join(root, generation), inodes)
+            usage_index = os.path.join(root, os.path.dirname(generation),
+                                       USAGE_INDEX_FILE)
+            if os.path.exists(usage_index):
+                os.remove(usage_index)
+    finally:
+        db.close()
+
+    return result
@@ -0,0 +1,100 @@
+import os
+
+from rsbackup.dedupe import INDEX_FILE, dedupe
+from rsbackup.manifest import read_manifest, write_manifest
+
+_MTIME = 10**18
+
+
+def _generation(fixture, target, name, files):
+    generation_dir = os.path.join(target, name)
+    for path, content in files.items():
+        fixture.write(os.path.join(generation_dir, path), content, mtime_ns=_MTIME)
+    write_manifest(generation_dir)
+    return generation_dir
+
+
+def _ino(*parts):
+    return os.stat(os.path.join(*parts)).st_ino
+
+
+def test_dedupe_links_identical_files_across_targets(fixture):
+    d = fixture.dir_name
+    a = os.path.join(d, 'a')
+    b = os.path.join(d, 'b')
+    a1 = _generation(fixture, a, '2023-01-01_10-00-00', {
+        'src/image': b'image' * 1000, 'src/other': b'other' * 1000})
+    # The second generation of a shares the image with the first one.
+    a2 = os.path.join(a, '2023-01-02_10-00-00')
+    os.makedirs(os.path.join(a2, 'src'))
+    os.link(os.path.join(a1, 'src/image'), os.path.join(a2, 'src/image'))
+    write_manifest(a2)
+    b1 = _generation(fixture, b, '2023-01-01_10-00-00', {
+        'data/image': b'image' * 1000, 'data/same_size': b'OTHER' * 1000})
+    fixture.write(os.path.join(b1, 'data/newer'), b'other' * 1000, mtime_ns=2 * _MTIME)
+    write_manifest(b1)
+
+    dry = dedupe([a, b], dry_run=True)
+    assert (dry.linked, dry.saved_bytes) == (1, 5000)
+    assert _ino(b1, 'data/image') != _ino(a1, 'src/image')
+
+    result = dedupe([a, b], workers=2)
+
+    assert result.success
+    assert os.path.exists(os.path.join(d, INDEX_FILE))
+    # Digests computed by the dry run are reused.
+    assert (result.linked, result.saved_bytes, result.hashed) == (1, 5000, 0)
+    assert _ino(b1, 'data/image') == _ino(a1, 'src/image') == _ino(a2, 'src/image')
+    assert _ino(b1, 'data/same_size') != _ino(a1, 'src/other')
+    assert _ino(b1, 'data/newer') != _ino(a1, 'src/other')
+    assert {e.path: e.inode for e in read_manifest(b1)}['data/image'] ==\
+        _ino(a1, 'src/image')
+
+    again = dedupe([a, b])
+    assert (again.linked, again.hashed) == (0, 0)
+
+
+def test_dedupe_replaces_all_links_of_a_file(fixture):
+    d = fixture.dir_name
+    a1 = _generation(fixture, d, 'a/2023-01-01_10-00-00', {'f': b'data' * 100})
+    b1 = _generation(fixture, d, 'b/2023-01-01_10-00-00', {'f': b'data' * 100})
+    b2 = os.path.join(d, 'b', '2023-01-02_10-00-00')
+    os.makedirs(b2)
+    os.link(os.path.join(b1, 'f'), os.path.join(b2, 'f'))
+    write_manifest(b2)
+    b3 = os.path.join(d, 'b', '2023-01-03_10-00-00')
+    os.makedirs(b3)
+    os.link(os.path.join(b1, 'f'), os.path.join(b3, 'f'))
+    write_manifest(b3)
+
+    result = dedupe([os.path.join(d, 'a'), os.path.join(d, 'b')], min_size=1)
+
+    # The file of b has more links, so the file of a is replaced.
+    assert (result.linked, result.saved_bytes) == (1, 400)
+    assert _ino(a1, 'f') == _ino(b1, 'f') == _ino(b3, 'f')
+    assert os.stat(os.path.join(b1, 'f')).st_nlink == 4
+
+
+def test_dedupe_ignores_small_files(fixture):
+    d = fixture.dir_name
+    _generation(fixture, d, 'a/2023-01-01_10-00-00', {'f': b'data'})
+    _generation(fixture, d, 'b/2023-01-01_10-00-00', {'f': b'data'})
+
+    result = dedupe([os.path.join(d, 'a'), os.path.join(d, 'b')], min_size=5)
+
+    assert (result.candidates, result.linked) == (0, 0)
+
+
+def test_dedupe_paths_not_valid_utf8(fixture):
+    d = fixture.dir_name
+    a = os.path.join(d, 'a')
+    b = os.path.join(d, 'b')
+    name = os.fsdecode(b'caf\xe9')
+    _generation(fixture, a, '2023-01-01_10-00-00', {name: b'coffee'})
+    _generation(fixture, b, '2023-01-01_10-00-00', {name: b'coffee'})
+
+    result = dedupe([a, b])
+
+    assert result.linked == 1
+    assert _ino(a, '2023-01-01_10-00-00', name) ==\
+        _ino(b, '2023-01-01_10-00-00', name)
@@ -0,0 +1,173 @@
+"""Fast comparison of two generations.
+
+Unchanged files are hard linked between generations, so a file with the same
+inode in both generations is unchanged and its content never needs to be
+read. Files with different inodes are compared by size, modification time
+and mode only. If both generations have a manifest, the sorted manifests are
+merged without touching the generation directories at all. Otherwise both
+trees are walked side by side, listing each pair of directories in parallel.
+Either way the time needed is proportional to the number of entries, not to
+the size of the data.
+"""
+
+import concurrent.futures
+import os
+import stat
+import typing
+
+from rsbackup.generations import METADATA_FILES
+from rsbackup.manifest import (ManifestEntry, read_manifest, sort_key,
+                               walk_generation)
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+
+class DiffEntry(typing.NamedTuple):
+    """A difference between two generations.
+
+    `change` is one of `ADDED`, `REMOVED` and `MODIFIED`. `old_size` is
+    `None` for added entries, `new_size` for removed ones. `kind` is one of
+    `file`, `dir`, `link` and `other`, describing the entry in the newer
+    generation unless it was removed.
+    """
+    change: str
+    path: str
+    kind: str
+    old_size: typing.Optional[int]
+    new_size: typing.Optional[int]
+
+    def to_dict(self) -> dict:
+        "Returns a JSON serializable representation of this entry."
+        return self._asdict()
+
+
+def _kind(mode: int) -> str:
+    if stat.S_ISREG(mode):
+        return 'file'
+    if stat.S_ISDIR(mode):
+        return 'dir'
+    if stat.S_ISLNK(mode):
+        return 'link'
+    return 'other'
+
+
+def _compare(path: str, old: ManifestEntry,
+             new: ManifestEntry) -> typing.Iterator[DiffEntry]:
+    if old.inode == new.inode:
+        return
+    if stat.S_IFMT(old.mode) != stat.S_IFMT(new.mode):
+        yield DiffEntry(REMOVED, path, _kind(old.mode), old.size, None)
+        yield DiffEntry(ADDED, path, _kind(new.mode), None, new.size)
+    elif not stat.S_ISDIR(new.mode) and\
+            (old.size, old.mtime, old.mode) != (new.size, new.mtime, new.mode):
+        yield DiffEntry(MODIFIED, path, _kind(new.mode), old.size, new.size)
+
+
+def _diff_manifests(old: typing.Iterator[ManifestEntry],
+                    new: typing.Iterator[ManifestEntry]) -> typing.Iterator[DiffEntry]:
+    "Merges two manifests sorted by path (see `sort_key`)."
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and sort_key(a) < sort_key(b)):
+            yield DiffEntry(REMOVED, a.path, _kind(a.mode), a.size, None)
+            a = next(old, None)
+        elif a is None or sort_key(b) < sort_key(a):
+            yield DiffEntry(ADDED, b.path, _kind(b.mode), None, b.size)
+            b = next(new, None)
+        else:
+            yield from _compare(a.path, a, b)
+            a = next(old, None)
+            b = next(new, None)
+
+
+def _list(dir_path: str, root: bool) -> typing.Dict[str, ManifestEntry]:
+    entries = {}
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if root and entry.name in METADATA_FILES:
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                entries[entry.name] = ManifestEntry(
+                    entry.path, st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _diff_trees(old_dir: str, new_dir: str) -> typing.Iterator[DiffEntry]:
+    "Walks both trees side by side."
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+
+        def subtree(change: str, dir_path: str, prefix: str):
+            for name, e in sorted(_list(dir_path, False).items()):
+                path = prefix + name
+                old_size, new_size = (e.size, None) if change == REMOVED else (None, e.size)
+                yield DiffEntry(change, path, _kind(e.mode), old_size, new_size)
+                if stat.S_ISDIR(e.mode):
+                    yield from subtree(change, e.path, path + '/')
+
+        def walk(old_path: str, new_path: str, prefix: str):
+            old_future = executor.submit(_list, old_path, not prefix)
+            new_entries = _list(new_path, not prefix)
+            old_entries = old_future.result()
+
+            for name in sorted(old_entries.keys() | new_entries.keys()):
+                path = prefix + name
+                a = old_entries.get(name)
+                b = new_entries.get(name)
+                if b is None:
+                    yield DiffEntry(REMOVED, path, _kind(a.mode), a.size, None)
+                    if stat.S_ISDIR(a.mode):
+                        yield from subtree(REMOVED, a.path, path + '/')
+                    continue
+                if a is None:
+                    yield DiffEntry(ADDED, path, _kind(b.mode), None, b.size)
+                    if stat.S_ISDIR(b.mode):
+                        yield from subtree(ADDED, b.path, path + '/')
+                    continue
+
+                if stat.S_ISDIR(a.mode) and stat.S_ISDIR(b.mode):
+                    yield from walk(a.path, b.path, path + '/')
+                elif stat.S_IFMT(a.mode) != stat.S_IFMT(b.mode):
+                    yield DiffEntry(REMOVED, path, _kind(a.mode), a.size, None)
+                    if stat.S_ISDIR(a.mode):
+                        yield from subtree(REMOVED, a.path, path + '/')
+                    yield DiffEntry(ADDED, path, _kind(b.mode), None, b.size)
+                    if stat.S_ISDIR(b.mode):
+                        yield from subtree(ADDED, b.path, path + '/')
+                else:
+                    yield from _compare(path, a, b)
+
+        yield from walk(old_dir, new_dir, '')
+
+
+def diff_generations(old_dir: str, new_dir: str,
+                     use_manifests: bool = True) -> typing.Iterator[DiffEntry]:
+    """Yields the differences between the generations stored in `old_dir`
+    and `new_dir`. Entries are yielded as they are found; paths are relative
+    to the generation root. Contents of added and removed directories are
+    reported as well.
+
+    If `use_manifests` is `True` and both generations have a manifest, the
+    manifests are compared instead of walking the directories. Archived
+    generations are always compared using their index; the other generation
+    is walked if it has no manifest.
+    """
+    archived = not os.path.isdir(old_dir) or not os.path.isdir(new_dir)
+    if use_manifests or archived:
+        old = read_manifest(old_dir)
+        new = read_manifest(new_dir)
+        if old is not None and new is not None:
+            return _diff_manifests(old, new)
+        if archived:
+            if old is None:
+                old = iter(sorted(walk_generation(old_dir), key=sort_key))
+            if new is None:
+                new = iter(sorted(walk_generation(new_dir), key=sort_key))
+            return _diff_manifests(old, new)
+
+    return _diff_trees(old_dir, new_dir)
@@ -0,0 +1,82 @@
+import os
+
+from rsbackup.diff import ADDED, MODIFIED, REMOVED, DiffEntry, diff_generations
+from rsbackup.manifest import write_manifest
+
+_MTIME = 10**18
+
+
+def _generations(fixture):
+    d = fixture.dir_name
+    old = os.path.join(d, '2023-01-01_10-00-00')
+    new = os.path.join(d, '2023-01-02_10-00-00')
+    fixture.write(os.path.join(old, 'src', 'same'), b'same', mtime_ns=_MTIME)
+    fixture.write(os.path.join(old, 'src', 'copied'), b'copied', mtime_ns=_MTIME)
+    fixture.write(os.path.join(old, 'src', 'changed'), b'old', mtime_ns=_MTIME)
+    fixture.write(os.path.join(old, 'src', 'gone', 'file'), b'gone', mtime_ns=_MTIME)
+    fixture.write(os.path.join(old, 'src', 'type'), b'file', mtime_ns=_MTIME)
+
+    os.makedirs(os.path.join(new, 'src'))
+    os.link(os.path.join(old, 'src', 'same'), os.path.join(new, 'src', 'same'))
+    # A copy with equal size and modification time counts as unchanged.
+    fixture.write(os.path.join(new, 'src', 'copied'), b'copied', mtime_ns=_MTIME)
+    fixture.write(os.path.join(new, 'src', 'changed'), b'new!', mtime_ns=2 * _MTIME)
+    fixture.write(os.path.join(new, 'src', 'type', 'file'), b'dir', mtime_ns=_MTIME)
+    fixture.write(os.path.join(new, 'src', 'added'), b'added', mtime_ns=_MTIME)
+    return old, new
+
+
+_EXPECTED = [
+    DiffEntry(ADDED, 'src/added', 'file', None, 5),
+    DiffEntry(MODIFIED, 'src/changed', 'file', 3, 4),
+    DiffEntry(REMOVED, 'src/gone', 'dir', 4096, None),
+    DiffEntry(REMOVED, 'src/gone/file', 'file', 4, None),
+    DiffEntry(REMOVED, 'src/type', 'file', 4, None),
+    DiffEntry(ADDED, 'src/type', 'dir', None, 4096),
+    DiffEntry(ADDED, 'src/type/file', 'file', None, 3),
+]
+
+
+def _normalize(entries):
+    # Directory sizes depend on the file system.
+    return [e._replace(old_size=4096 if e.kind == 'dir' and e.old_size is not None else e.old_size,
+                       new_size=4096 if e.kind == 'dir' and e.new_size is not None else e.new_size)
+            for e in entries]
+
+
+def test_diff_generations_walk(fixture):
+    d = fixture.dir_name
+    old, new = _generations(fixture)
+    assert _normalize(diff_generations(old, new)) == _EXPECTED
+
+
+def test_diff_generations_manifests(fixture):
+    d = fixture.dir_name
+    old, new = _generations(fixture)
+    write_manifest(old)
+    write_manifest(new)
+    # Manifests are used, so changes after writing them are not seen.
+    fixture.write(os.path.join(new, 'src', 'late'), b'late', mtime_ns=_MTIME)
+
+    assert _normalize(diff_generations(old, new)) == _EXPECTED
+    assert DiffEntry(ADDED, 'src/late', 'file', None, 4) in\
+        list(diff_generations(old, new, use_manifests=False))
+
+
+def test_diff_generations_paths_not_valid_utf8(fixture):
+    d = fixture.dir_name
+    old = os.path.join(d, 'old')
+    new = os.path.join(d, 'new')
+    invalid = os.fsdecode(b'caf\xe9')
+    # Sorts before the invalid name as text but after it as bytes.
+    yi = 'caf\ua000'
+    fixture.write(os.path.join(old, invalid), b'old', mtime_ns=_MTIME)
+    fixture.write(os.path.join(old, yi), b'old', mtime_ns=_MTIME)
+    fixture.write(os.path.join(new, invalid), b'newer', mtime_ns=_MTIME)
+    fixture.write(os.path.join(new, yi), b'old', mtime_ns=_MTIME)
+    write_manifest(old)
+    write_manifest(new)
+
+    assert list(diff_generations(old, new)) ==\
+        list(diff_generations(old, new, use_manifests=False)) ==\
+        [DiffEntry(MODIFIED, invalid, 'file', 3, 5)]
@@ -0,0 +1,294 @@
+"""Filter rules deciding which files are backed up.
+
+The excludes, includes and filter rules of a configuration are compiled into
+a single rsync filter file passed as `--filter=merge FILE`. Per-directory
+ignore files are supported using rsync's `dir-merge` rule: every line of an
+ignore file excludes matching files in its directory and all directories
+below. Excluded directories are never scanned by rsync.
+
+`filter_report` evaluates the rules in Python to show how much each rule
+excludes. It supports the pattern syntax of rsync (`*`, `**`, `?`, character
+classes, anchoring with a leading `/` and directory-only patterns with a
+trailing `/`) but no rule modifiers.
+"""
+
+import contextlib
+import os
+import re
+import stat
+import typing
+
+IGNORE_FILE = '.rsbackupignore'
+"Default name of the per-directory ignore files."
+
+
+def compile_rules(excludes: typing.Iterable[str] = (),
+                  includes: typing.Iterable[str] = (),
+                  filters: typing.Iterable[str] = (),
+                  ignore_file: typing.Optional[str] = None) -> typing.List[str]:
+    """Returns the list of rsync filter rules for the given options. rsync
+    applies the first matching rule, so `includes` take precedence over the
+    raw rsync `filters`, which take precedence over `excludes` and the rules
+    read from files named `ignore_file`."""
+    rules = [f"+ {p}" for p in includes]
+    rules += list(filters)
+    rules += [f"- {p}" for p in excludes]
+    if ignore_file:
+        rules.append(f":- {ignore_file}")
+    return rules
+
+
+def write_filter_file(path: str, rules: typing.Iterable[str]):
+    "Writes `rules` to the file `path` in rsync's merge file format."
+    with open(path, 'w') as f:
+        for rule in rules:
+            f.write(rule + '\n')
+
+
+@contextlib.contextmanager
+def temporary_filter_file(rules: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Writes `rules` to a temporary filter file, yields its path and removes
+    the file afterwards."""
+    import tempfile
+
+    fd, path = tempfile.mkstemp(prefix='rsbackup-', suffix='.filter')
+    os.close(fd)
+    try:
+        write_filter_file(path, rules)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def _translate(pattern: str) -> str:
+    result = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            result += '.*'
+            i += 2
+            continue
+        if c == '*':
+            result += '[^/]*'
+        elif c == '?':
+            result += '[^/]'
+        elif c == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            result += '[' + pattern[i + 1:end].replace('\\', '\\\\') + ']'
+            i = end
+        else:
+            result += re.escape(c)
+        i += 1
+    return result
+
+
+class Rule:
+    """A single include or exclude rule.
+
+    `text` is the rule as written, `base` the path relative to the root of
+    the transfer the rule's pattern is anchored at.
+    """
+
+    def __init__(self, include: bool, pattern: str, text: str, base: str = ''):
+        self.include = include
+        self.pattern = pattern
+        self.text = text
+        self.base = base
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        prefix = '^' if pattern.startswith('/') else '(^|.*/)'
+        self._regex = re.compile(prefix + _translate(pattern.lstrip('/')) + '$')
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        """Returns whether this rule matches the entry at `path` relative to
+        the root of the transfer."""
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not path.startswith(self.base + '/'):
+                return False
+            path = path[len(self.base) + 1:]
+        return self._regex.match(path) is not None
+
+    def __eq__(self, other):
+        return self.include == other.include and\
+            self.pattern == other.pattern and\
+            self.text == other.text and\
+            self.base == other.base
+
+    def __repr__(self):
+        return f"Rule({self.text!r}, base={self.base!r})"
+
+
+_RULE = re.compile(r'^(\+|-|include|exclude)\s(.*)$')
+_DIR_MERGE = re.compile(r'^(:-?|dir-merge(,-)?)\s(.*)$')
+
+
+def parse_rules(rules: typing.Iterable[str]) -> typing.Tuple[typing.List[Rule], typing.List[str]]:
+    """Parses rsync filter `rules` and returns the include and exclude rules
+    and the names of the files merged per directory. Other rules are
+    ignored."""
+    parsed = []
+    dir_merges = []
+    for text in rules:
+        if m := _RULE.match(text):
+            parsed.append(Rule(m[1] in ('+', 'include'), m[2], text))
+        elif m := _DIR_MERGE.match(text):
+            dir_merges.append(m[3])
+    return parsed, dir_merges
+
+
+def read_ignore_file(path: str, base: str) -> typing.List[Rule]:
+    """Reads the ignore file at `path` located in the directory `base` of
+    the transfer. Each line holds a pattern to exclude; empty lines and
+    lines starting with `#` are skipped."""
+    name = os.path.join(base, os.path.basename(path)) if base else os.path.basename(path)
+    rules = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                rules.append(Rule(False, line, f"- {line} ({name})", base))
+    return rules
+
+
+class RuleStats:
+    "The number of files and bytes excluded by a single rule."
+
+    def __init__(self, rule: str, files: int = 0, bytes: int = 0):
+        self.rule = rule
+        self.files = files
+        self.bytes = bytes
+
+    def __eq__(self, other):
+        return self.rule == other.rule and\
+            self.files == other.files and\
+            self.bytes == other.bytes
+
+    def __repr__(self):
+        return f"RuleStats({self.rule!r}, files={self.files}, bytes={self.bytes})"
+
+
+def _subtree_size(path: str) -> typing.Tuple[int, int]:
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            files += 1
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return files, size
+
+
+def transfer_path(source: str) -> typing.Tuple[str, str]:
+    """Returns the path of `source` without a `/./` marker and the path it
+    is transferred to relative to the target as computed by rsync: the base
+    name of `source`, nothing if `source` ends with a slash or the part
+    following the `/./` marker used with `--relative`."""
+    if '/./' in source:
+        root, _, rel = source.partition('/./')
+        return os.path.join(root, rel), rel.strip('/')
+    if source.endswith('/'):
+        return source, ''
+    return source, os.path.basename(source)
+
+
+def walk_sources(sources: typing.Iterable[str], rules: typing.Iterable[str],
+                 on_exclude: typing.Optional[typing.Callable[[Rule, str, os.stat_result], None]] = None,
+                 ) -> typing.Iterator[typing.Tuple[str, str, os.stat_result]]:
+    """Walks `sources` like rsync applying `rules` and yields the path,
+    the path relative to the target (see `transfer_path`) and the stat
+    result of every included entry. Directories are yielded before their
+    contents; excluded directories are not entered. `on_exclude` is called
+    with the matching rule, the path and the stat result of every excluded
+    entry. Ignore files of the directories implied by a `/./` marker apply
+    as well."""
+    parsed, dir_merges = parse_rules(rules)
+
+    def first_match(rules, path, is_dir):
+        for rule in rules:
+            if rule.matches(path, is_dir):
+                return rule
+        return None
+
+    def ignore_rules(dir: str, rel: str) -> typing.List[Rule]:
+        rules = []
+        for name in dir_merges:
+            ignore_file = os.path.join(dir, name)
+            if os.path.isfile(ignore_file):
+                rules += read_ignore_file(ignore_file, rel)
+        return rules
+
+    def walk(dir: str, rel: str, merged: typing.List[Rule]):
+        # Rules of deeper ignore files take precedence over inherited ones.
+        merged = ignore_rules(dir, rel) + merged
+        active = parsed + merged
+
+        try:
+            entries = sorted(os.scandir(dir), key=lambda e: e.name)
+        except OSError:
+            return
+
+        for entry in entries:
+            path = f"{rel}/{entry.name}" if rel else entry.name
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            rule = first_match(active, path, is_dir)
+            if rule is not None and not rule.include:
+                if on_exclude is not None:
+                    on_exclude(rule, entry.path, st)
+                continue
+            yield entry.path, path, st
+            if is_dir:
+                yield from walk(entry.path, path, merged)
+
+    for source in sources:
+        path, rel = transfer_path(source)
+        st = os.lstat(path)
+        is_dir = stat.S_ISDIR(st.st_mode)
+
+        merged = []
+        if '/./' in source:
+            implied = source.partition('/./')[0]
+            parts = rel.split('/')[:-1]
+            for i in range(len(parts)):
+                merged = ignore_rules(os.path.join(implied, *parts[:i + 1]),
+                                      '/'.join(parts[:i + 1])) + merged
+
+        if rel:
+            rule = first_match(parsed + merged, rel, is_dir)
+            if rule is not None and not rule.include:
+                if on_exclude is not None:
+                    on_exclude(rule, path, st)
+                continue
+
+        yield path, rel, st
+        if is_dir:
+            yield from walk(path, rel, merged)
+
+
+def filter_report(sources: typing.Iterable[str],
+                  rules: typing.Iterable[str]) -> typing.List[RuleStats]:
+    """Walks `sources` and returns the number of files and bytes excluded
+    by each of `rules`. An excluded directory counts all files below it.
+    Rules read from ignore files are reported after the configured rules in
+    the order they are found."""
+    rules = list(rules)
+    stats = {r.text: RuleStats(r.text) for r in parse_rules(rules)[0]}
+
+    def exclude(rule: Rule, path: str, st: os.stat_result):
+        files, size = _subtree_size(path) if stat.S_ISDIR(st.st_mode)\
+            else (1, st.st_size)
+        s = stats.setdefault(rule.text, RuleStats(rule.text))
+        s.files += files
+        s.bytes += size
+
+    for _ in walk_sources(sources, rules, on_exclude=exclude):
+        pass
+
+    return list(stats.values())
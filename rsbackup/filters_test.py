@@ -0,0 +1,78 @@
+import os
+
+from rsbackup.filters import (Rule, RuleStats, compile_rules, filter_report,
+                              parse_rules, temporary_filter_file)
+
+
+def test_compile_rules():
+    assert compile_rules(excludes=['.cache/'], includes=['/src/keep.tmp'],
+                         filters=['- *.tmp'], ignore_file='.rsbackupignore') == [
+        '+ /src/keep.tmp', '- *.tmp', '- .cache/', ':- .rsbackupignore']
+    assert compile_rules(excludes=['.cache/']) == ['- .cache/']
+
+
+def test_temporary_filter_file():
+    with temporary_filter_file(['- *.tmp', ':- .rsbackupignore']) as path:
+        with open(path) as f:
+            assert f.read() == '- *.tmp\n:- .rsbackupignore\n'
+    assert not os.path.exists(path)
+
+
+def test_parse_rules():
+    rules, dir_merges = parse_rules(['+ /src/***', 'exclude *.tmp',
+                                     ':- .rsbackupignore', 'merge /etc/rules'])
+    assert rules == [Rule(True, '/src/***', '+ /src/***'),
+                     Rule(False, '*.tmp', 'exclude *.tmp')]
+    assert dir_merges == ['.rsbackupignore']
+
+
+def test_rule_matches():
+    assert Rule(False, '*.tmp', '').matches('src/a.tmp', False)
+    assert not Rule(False, '*.tmp', '').matches('src/a.tmp/b', False)
+    assert Rule(False, 'cache/', '').matches('home/cache', True)
+    assert not Rule(False, 'cache/', '').matches('home/cache', False)
+    assert Rule(False, '/home/cache', '').matches('home/cache', True)
+    assert not Rule(False, '/cache', '').matches('home/cache', True)
+    assert Rule(False, 'src/*.o', '').matches('home/src/a.o', False)
+    assert not Rule(False, 'src/*.o', '').matches('home/src/lib/a.o', False)
+    assert Rule(False, 'src/**.o', '').matches('home/src/lib/a.o', False)
+    assert Rule(False, 'file[0-9]', '').matches('file1', False)
+    assert Rule(False, '/build', '', base='home/project').matches(
+        'home/project/build', True)
+    assert not Rule(False, '/build', '', base='home/project').matches(
+        'home/build', True)
+
+
+def test_filter_report(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'a.txt'), 'x' * 10)
+    fixture.write(os.path.join(src, 'a.tmp'), 'x' * 20)
+    fixture.write(os.path.join(src, 'keep.tmp'), 'x' * 30)
+    fixture.write(os.path.join(src, 'project', '.rsbackupignore'),
+                  content='# build outputs\n\nnode_modules/\n/dist\n')
+    fixture.write(os.path.join(src, 'project', 'node_modules', 'x', 'x.js'), 'x' * 40)
+    fixture.write(os.path.join(src, 'project', 'node_modules', 'y.js'), 'x' * 50)
+    fixture.write(os.path.join(src, 'project', 'dist', 'app.js'), 'x' * 60)
+    fixture.write(os.path.join(src, 'project', 'lib', 'dist', 'keep.js'), 'x' * 70)
+    fixture.write(os.path.join(src, '.cache', 'c'), 'x' * 80)
+
+    report = filter_report([src], compile_rules(
+        excludes=['.cache/'], includes=['keep.tmp'], filters=['- *.tmp'],
+        ignore_file='.rsbackupignore'))
+
+    assert report == [
+        RuleStats('+ keep.tmp'),
+        RuleStats('- *.tmp', 1, 20),
+        RuleStats('- .cache/', 1, 80),
+        RuleStats('- /dist (src/project/.rsbackupignore)', 1, 60),
+        RuleStats('- node_modules/ (src/project/.rsbackupignore)', 2, 90),
+    ]
+
+
+def test_filter_report_source_with_trailing_slash(fixture):
+    d = fixture.dir_name
+    fixture.write(os.path.join(d, 'build', 'out.o'), 'x' * 10)
+    fixture.write(os.path.join(d, 'src', 'build', 'keep.c'), 'x' * 10)
+
+    assert filter_report([d + '/'], ['- /build']) == [RuleStats('- /build', 1, 10)]
@@ -0,0 +1,169 @@
+"""Naming conventions for the generations stored inside a backup target.
+
+Each generation is a directory named after the local time the backup was
+started. Besides the backed up sources a generation contains some metadata
+files written by rsbackup. The target contains a symlink pointing to the
+latest complete generation. Generations still being written (or left behind
+by an interrupted run) contain a marker file and are not listed as
+generations. Old generations may be packed into a single archive file named
+after the generation (see `rsbackup.archive`). Runs, prunes and archives lock
+the target, so only one process modifies its generations at a time.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import typing
+
+LATEST = '_latest'
+"Name of the symlink pointing to the latest generation."
+
+LOG_FILE = '.log.gz'
+"Name of the file containing rsync's gzip compressed output."
+
+PLAIN_LOG_FILE = '.log'
+"Name of the file containing rsync's uncompressed output in older generations."
+
+MANIFEST_FILE = '.manifest'
+"Name of the file containing the list of files stored in a generation."
+
+SOURCES_FILE = '.sources'
+"Name of the file containing the summary of the sources."
+
+STATS_FILE = '.stats.json'
+"Name of the file containing the timings and transfer statistics of a run."
+
+INCOMPLETE_FILE = '.incomplete'
+"Name of the marker file of a generation that has not been completed."
+
+LAST_RUN_FILE = '.last-run.json'
+"Name of the file in the target describing the last run of a backup."
+
+ARCHIVE_SUFFIX = '.archive'
+"Suffix of the files containing archived generations."
+
+LOCK_FILE = '.lock'
+"Name of the file in the target locked while the generations are modified."
+
+METADATA_FILES = frozenset((LOG_FILE, PLAIN_LOG_FILE, MANIFEST_FILE,
+                            SOURCES_FILE, STATS_FILE, INCOMPLETE_FILE))
+"Names of all metadata files rsbackup writes to the root of a generation."
+
+_NAME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def generation_name(timestamp: datetime.datetime) -> str:
+    "Returns the name of the generation started at `timestamp`."
+    return timestamp.strftime(_NAME_FORMAT)
+
+
+def parse_generation_name(name: str) -> typing.Optional[datetime.datetime]:
+    """Returns the timestamp encoded in generation `name` or `None` if `name`
+    is not a generation name."""
+    try:
+        return datetime.datetime.strptime(name, _NAME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _generation_dirs(target: str) -> typing.List[str]:
+    try:
+        with os.scandir(target) as it:
+            return sorted(e.name for e in it
+                          if e.is_dir(follow_symlinks=False)
+                          and parse_generation_name(e.name) is not None)
+    except FileNotFoundError:
+        return []
+
+
+def is_incomplete(generation_dir: str) -> bool:
+    "Returns whether the generation at `generation_dir` is incomplete."
+    return os.path.exists(os.path.join(generation_dir, INCOMPLETE_FILE))
+
+
+def list_generations(target: str) -> typing.List[str]:
+    """Returns the names of all complete generations found in `target`
+    ordered from oldest to newest. Returns an empty list if `target` does
+    not exist."""
+    return [name for name in _generation_dirs(target)
+            if not is_incomplete(os.path.join(target, name))]
+
+
+def list_archives(target: str) -> typing.List[str]:
+    """Returns the names of all archived generations found in `target`
+    ordered from oldest to newest."""
+    try:
+        with os.scandir(target) as it:
+            return sorted(e.name[:-len(ARCHIVE_SUFFIX)] for e in it
+                          if e.name.endswith(ARCHIVE_SUFFIX)
+                          and e.is_file(follow_symlinks=False)
+                          and parse_generation_name(e.name[:-len(ARCHIVE_SUFFIX)]) is not None)
+    except FileNotFoundError:
+        return []
+
+
+def incomplete_generations(target: str) -> typing.List[str]:
+    """Returns the names of all incomplete generations found in `target`
+    ordered from oldest to newest."""
+    return [name for name in _generation_dirs(target)
+            if is_incomplete(os.path.join(target, name))]
+
+
+def mark_incomplete(generation_dir: str):
+    "Marks the generation at `generation_dir` as incomplete."
+    with open(os.path.join(generation_dir, INCOMPLETE_FILE), 'w') as f:
+        f.write(datetime.datetime.now().isoformat(timespec='seconds') + '\n')
+
+
+def mark_complete(generation_dir: str):
+    "Removes the incomplete marker from the generation at `generation_dir`."
+    try:
+        os.remove(os.path.join(generation_dir, INCOMPLETE_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def latest_generation(target: str) -> typing.Optional[str]:
+    """Returns the name of the generation `_latest` points to or `None` if
+    there is no `_latest` link in `target`."""
+    try:
+        return os.path.basename(os.readlink(os.path.join(target, LATEST)))
+    except (FileNotFoundError, OSError):
+        return None
+
+
+class TargetLockedError(RuntimeError):
+    "Raised if a target is locked by another run, prune or archive."
+
+
+@contextlib.contextmanager
+def lock_target(target: str) -> typing.Iterator[None]:
+    """Locks `target` for the duration of the context, creating it if it
+    does not exist. Raises a `TargetLockedError` if the target is locked
+    already, even by the same process. The lock is released when the
+    process exits."""
+    import fcntl
+
+    os.makedirs(target, exist_ok=True)
+    fd = os.open(os.path.join(target, LOCK_FILE),
+                 os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise TargetLockedError(
+                f"{target} is locked by another run, prune or archive") from None
+        yield
+    finally:
+        os.close(fd)
+
+
+def read_last_run(target: str) -> typing.Optional[dict]:
+    """Returns the description of the last run of the backup to `target`
+    (see `BackupResult.to_dict`) or `None` if there is none."""
+    try:
+        with open(os.path.join(target, LAST_RUN_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
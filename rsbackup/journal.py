@@ -0,0 +1,477 @@
+"""A journal of the paths changed below the sources of a backup.
+
+For sources with many files and little churn, most of a run is spent by
+rsync walking the source tree. `Watcher` uses inotify to record every path
+created, modified, moved or deleted below the sources in the journal, an
+SQLite database stored in the target. Backups with `journal` enabled pass
+the recorded paths to rsync using `--files-from` and `--delete-missing-args`
+instead of scanning all sources. The new generation is prepared by hard
+linking all files of the previous generation (see `link_generation`), so
+rsync only touches the changed paths.
+
+The journal is only used if it provably contains all changes since the
+previous run started: the watcher must have watched all directories before
+that, no events may have been lost since (e.g. due to an overflow of the
+kernel's event queue) and the watcher must have written the journal after
+the current run started. Otherwise, and every `full_scan_interval`, a full
+scan is run.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import errno
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import stat
+import struct
+import time
+import typing
+
+from rsbackup import Backup
+from rsbackup.filters import transfer_path, walk_sources
+from rsbackup.generations import METADATA_FILES
+from rsbackup.manifest import connect
+from rsbackup.restore import copy_metadata
+
+JOURNAL_FILE = '.journal.db'
+"Name of the journal file stored in the target directory."
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_DONT_FOLLOW = 0x2000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |\
+    _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF |\
+    _IN_DONT_FOLLOW
+_DIR_EVENTS = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO
+_EVENT = struct.Struct('iIII')
+
+
+def parse_interval(s: str) -> datetime.timedelta:
+    """Parses a `full_scan_interval` such as `1d`. Raises a `ValueError` if
+    `s` is not an interval."""
+    from rsbackup.daemon import IntervalSchedule, parse_schedule
+
+    schedule = parse_schedule(s)
+    if not isinstance(schedule, IntervalSchedule):
+        raise ValueError(f"Invalid interval: {s!r}")
+    return schedule.interval
+
+
+def _open(target: str) -> sqlite3.Connection:
+    db = connect(os.path.join(target, JOURNAL_FILE), timeout=30)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS paths (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    ''')
+    return db
+
+
+def config_key(backup: Backup) -> str:
+    """Returns a key identifying the sources and filter rules of `backup`.
+    The journal is only used if the watcher recorded it with the same key."""
+    data = json.dumps([list(backup.sources), backup.filter_rules()])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _state(db: sqlite3.Connection) -> typing.Dict[str, typing.Any]:
+    return dict(db.execute('SELECT key, value FROM state'))
+
+
+def _set_state(db: sqlite3.Connection, **values: typing.Any):
+    for key, value in values.items():
+        if value is None:
+            db.execute('DELETE FROM state WHERE key = ?', (key,))
+        else:
+            db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (key, value))
+
+
+def record(target: str, paths: typing.Iterable[str],
+           heartbeat: typing.Optional[float] = None,
+           overflow: typing.Optional[float] = None):
+    """Records the changed absolute `paths` in the journal of `target`.
+    `heartbeat` is the time up to which all changes have been recorded and
+    `overflow` the time changes were lost, if any."""
+    db = _open(target)
+    try:
+        with db:
+            db.executemany('INSERT OR REPLACE INTO paths (path) VALUES (CAST(? AS TEXT))',
+                           ((os.fsencode(p),) for p in paths))
+            if heartbeat is not None:
+                _set_state(db, heartbeat=heartbeat)
+            if overflow is not None:
+                _set_state(db, overflow=overflow)
+    finally:
+        db.close()
+
+
+def set_watching(target: str, since: typing.Optional[float],
+                 config: typing.Optional[str] = None):
+    """Records that all sources have been watched since `since` using the
+    configuration identified by `config` (see `config_key`) or, if `since`
+    is `None`, that they are not watched."""
+    db = _open(target)
+    try:
+        with db:
+            _set_state(db, watching=since, heartbeat=since,
+                       config=config if since is not None else None)
+    finally:
+        db.close()
+
+
+class Snapshot(typing.NamedTuple):
+    """The changes recorded in a journal when a run starts.
+
+    `paths` lists the changed paths or is `None` if the journal cannot be
+    used; `reason` then tells why. `last_id` identifies the last recorded
+    change and is used by `commit`.
+    """
+    last_id: int
+    paths: typing.Optional[typing.List[str]]
+    reason: typing.Optional[str] = None
+
+
+def take(target: str, base: typing.Optional[datetime.datetime],
+         start: datetime.datetime,
+         full_scan_interval: typing.Optional[datetime.timedelta] = None,
+         config: typing.Optional[str] = None,
+         wait: float = 5) -> typing.Optional[Snapshot]:
+    """Returns a `Snapshot` of the journal of `target` for a run started at
+    `start` based on the run started at `base`. Returns `None` if `target`
+    has no journal.
+
+    Waits up to `wait` seconds for a running watcher to record all changes
+    made before `start`. The snapshot contains no paths if a full scan is needed:
+    if there is no `base`, if changes since `base` may be missing, if the
+    watcher uses a configuration other than `config` or if the last full
+    scan started `full_scan_interval` or more before `start`.
+    """
+    if not os.path.exists(os.path.join(target, JOURNAL_FILE)):
+        return None
+
+    deadline = time.monotonic() + wait
+    db = _open(target)
+    try:
+        while True:
+            state = _state(db)
+            if base is None or state.get('watching') is None or\
+                    state.get('heartbeat', 0) >= start.timestamp() or\
+                    time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+
+        last_id = db.execute('SELECT MAX(id) FROM paths').fetchone()[0] or 0
+
+        def full(reason: str) -> Snapshot:
+            return Snapshot(last_id, None, reason)
+
+        if base is None:
+            return full('no previous generation')
+        if state.get('watching') is None:
+            return full('sources are not watched')
+        if config is not None and state.get('config') != config:
+            return full('watcher uses a different configuration')
+        if state.get('heartbeat', 0) < start.timestamp():
+            return full('watcher is not responding')
+        if state['watching'] > base.timestamp():
+            return full('watcher started after the previous run')
+        if state.get('overflow') is not None and state['overflow'] >= base.timestamp():
+            return full('changes have been lost')
+        last_full = state.get('last_full')
+        if last_full is None:
+            return full('no full scan recorded')
+        if full_scan_interval is not None and\
+                start.timestamp() - last_full >= full_scan_interval.total_seconds():
+            return full('full scan due')
+
+        paths = [row[0] for row in db.execute(
+            'SELECT path FROM paths WHERE id <= ? ORDER BY path', (last_id,))]
+        return Snapshot(last_id, paths)
+    finally:
+        db.close()
+
+
+def commit(target: str, snapshot: Snapshot, start: datetime.datetime):
+    """Removes the changes of `snapshot` from the journal of `target` after
+    a successful run started at `start`. If the run was a full scan, it is
+    recorded as such and lost changes from before `start` are forgotten."""
+    db = _open(target)
+    try:
+        with db:
+            db.execute('DELETE FROM paths WHERE id <= ?', (snapshot.last_id,))
+            if snapshot.paths is None:
+                _set_state(db, last_full=start.timestamp())
+                overflow = _state(db).get('overflow')
+                if overflow is not None and overflow < start.timestamp():
+                    _set_state(db, overflow=None)
+    finally:
+        db.close()
+
+
+def files_from(sources: typing.Iterable[str],
+               paths: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+    """Maps the changed absolute `paths` to rsync `--files-from` lists.
+    Returns a dict mapping the source directory of each list to the paths
+    relative to it; rsync recreates these paths inside the target as it
+    would when transferring `sources`."""
+    roots = []
+    for source in sources:
+        path, rel = transfer_path(source)
+        base = path[:len(path) - len(rel)] if rel else path
+        roots.append((path.rstrip('/'), os.path.join(base, '')))
+
+    lists = {}
+    for p in paths:
+        for root, base in roots:
+            if p == root or p.startswith(root + '/'):
+                lists.setdefault(base, []).append(p[len(base):] or '.')
+                break
+    return lists
+
+
+@contextlib.contextmanager
+def temporary_files_from(paths: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Writes `paths` separated by NUL characters to a temporary file to be
+    passed to rsync as `--files-from`, yields its path and removes the file
+    afterwards."""
+    import tempfile
+
+    fd, path = tempfile.mkstemp(prefix='rsbackup-', suffix='.files')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for p in paths:
+                f.write(os.fsencode(p) + b'\0')
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def link_generation(source: str, dest: str,
+                    skip: typing.Collection[str] = (),
+                    workers: typing.Optional[int] = None):
+    """Fills the existing directory `dest` with a copy of the generation in
+    `source` in which every entry other than a directory is a hard link to
+    the entry in `source`. Metadata files of `source` and the entries whose
+    paths relative to `source` are in `skip` are left out; rsync recreates
+    them without modifying the files shared with `source`. Files that
+    reached the maximum number of links are copied.
+
+    Directories are processed level by level using a pool of `workers`
+    threads; directory metadata is copied last, deepest first.
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    skip = frozenset(skip)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        levels = []
+        level = [(source, dest, '')]
+        while level:
+            levels.append(level)
+            level = [d for subdirs in executor.map(
+                         functools.partial(_link_dir, skip=skip), level)
+                     for d in subdirs]
+
+        for level in reversed(levels):
+            list(executor.map(lambda d: copy_metadata(d[1], os.lstat(d[0])), level))
+
+
+def _link_dir(dirs: typing.Tuple[str, str, str],
+              skip: typing.FrozenSet[str]) -> typing.List[typing.Tuple[str, str, str]]:
+    src, dst, rel = dirs
+    subdirs = []
+    with os.scandir(src) as it:
+        for entry in it:
+            if not rel and entry.name in METADATA_FILES:
+                continue
+            path = os.path.join(dst, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                os.mkdir(path)
+                subdirs.append((entry.path, path, os.path.join(rel, entry.name)))
+                continue
+            if os.path.join(rel, entry.name) in skip:
+                continue
+            try:
+                os.link(entry.path, path, follow_symlinks=False)
+            except OSError as e:
+                if e.errno != errno.EMLINK:
+                    raise
+                shutil.copy2(entry.path, path, follow_symlinks=False)
+    return subdirs
+
+
+class Inotify:
+    "A minimal binding of Linux' inotify API using ctypes."
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self, path: typing.Optional[str] = None):
+        e = self._ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    def add_watch(self, path: str, is_dir: bool = True) -> int:
+        "Watches `path` and returns the watch descriptor."
+        mask = _MASK | _IN_ONLYDIR if is_dir else _MASK
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def read(self) -> typing.List[typing.Tuple[int, int, str]]:
+        """Returns the pending events as tuples of watch descriptor, mask and
+        name. Returns an empty list if there are none."""
+        try:
+            data = os.read(self.fd, 2**16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """Records the changes below the sources of `backup` in the journal
+    stored in its target.
+
+    Directories excluded by the backup's filter rules when the watcher
+    starts are not watched. Changes are written every `flush_interval`
+    seconds. If the ignore file of any directory changes, the journal is
+    invalidated, as the set of files to back up may have changed. If a
+    directory cannot be watched because the limit of watches is reached,
+    the journal is not used until the watcher is restarted.
+    """
+
+    def __init__(self, backup: Backup, flush_interval: float = 1):
+        self.backup = backup
+        self.flush_interval = flush_interval
+        self._inotify = None
+        self._dirs = {}
+        self._pending = set()
+        self._overflow = None
+        self._incomplete = False
+
+    def _watch(self, path: str, is_dir: bool = True):
+        try:
+            self._dirs[self._inotify.add_watch(path, is_dir)] = path
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                raise
+            self._incomplete = True
+
+    def _watch_sources(self):
+        for source in self.backup.sources:
+            path, _ = transfer_path(source)
+            self._watch(path.rstrip('/') or '/', os.path.isdir(path))
+        for path, _, st in walk_sources(self.backup.sources, self.backup.filter_rules()):
+            if stat.S_ISDIR(st.st_mode):
+                self._watch(path)
+
+    def _watch_tree(self, path: str):
+        "Watches and records a directory created or moved into a source."
+        for dirpath, dirnames, filenames in os.walk(path):
+            self._watch(dirpath)
+            self._pending.update(os.path.join(dirpath, n)
+                                 for n in dirnames + filenames)
+
+    def _read_events(self):
+        while events := self._inotify.read():
+            for wd, mask, name in events:
+                if mask & _IN_Q_OVERFLOW:
+                    self._overflow = time.time()
+                    continue
+                if mask & _IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                dir_path = self._dirs.get(wd)
+                if dir_path is None:
+                    continue
+
+                path = os.path.join(dir_path, name) if name else dir_path
+                self._pending.add(path)
+                if name and mask & _DIR_EVENTS:
+                    # Creating and removing entries changes the directory.
+                    self._pending.add(dir_path)
+                if name and name == self.backup.ignore_file:
+                    self._overflow = time.time()
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._watch_tree(path)
+
+    def _flush(self):
+        now = time.time()
+        self._read_events()
+        record(self.backup.target, sorted(self._pending), heartbeat=now,
+               overflow=self._overflow)
+        self._pending = set()
+        self._overflow = None
+        if self._incomplete:
+            set_watching(self.backup.target, None)
+
+    async def run(self, stop: asyncio.Event):
+        """Watches the sources until `stop` is set. Raises an `OSError` if
+        inotify is not available."""
+        loop = asyncio.get_running_loop()
+        set_watching(self.backup.target, None)
+        self._inotify = Inotify()
+        try:
+            await loop.run_in_executor(None, self._watch_sources)
+            if not self._incomplete:
+                set_watching(self.backup.target, time.time(),
+                             config_key(self.backup))
+
+            loop.add_reader(self._inotify.fd, self._read_events)
+            try:
+                while not stop.is_set():
+                    try:
+                        await asyncio.wait_for(stop.wait(), self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._flush()
+            finally:
+                loop.remove_reader(self._inotify.fd)
+                self._flush()
+        finally:
+            set_watching(self.backup.target, None)
+            self._inotify.close()
@@ -0,0 +1,174 @@
+import asyncio
+import datetime
+import os
+import tempfile
+
+from rsbackup import Backup
+from rsbackup.generations import SOURCES_FILE
+from rsbackup.journal import (Snapshot, Watcher, commit, config_key,
+                              files_from, link_generation, record,
+                              set_watching, take, temporary_files_from)
+
+_BASE = datetime.datetime(2023, 1, 1, 10, 0, 0)
+_START = datetime.datetime(2023, 1, 1, 12, 0, 0)
+
+
+def test_take_and_commit():
+    with tempfile.TemporaryDirectory() as d:
+        assert take(d, _BASE, _START) is None
+
+        set_watching(d, _BASE.timestamp() - 60, 'config')
+        record(d, ['/src/spam'], heartbeat=_START.timestamp())
+        assert take(d, None, _START, wait=0).reason == 'no previous generation'
+        assert take(d, _BASE, _START, wait=0).reason == 'no full scan recorded'
+
+        snapshot = take(d, _BASE, _START, wait=0)
+        commit(d, snapshot, _BASE)
+        snapshot = take(d, _BASE, _START, config='config', wait=0)
+        assert snapshot.paths == []
+
+        record(d, ['/src/spam', '/src/eggs'], heartbeat=_START.timestamp())
+        snapshot = take(d, _BASE, _START, config='config', wait=0)
+        assert snapshot.paths == ['/src/eggs', '/src/spam']
+        assert take(d, _BASE, _START, config='other', wait=0).reason ==\
+            'watcher uses a different configuration'
+        assert take(d, _BASE, _START, datetime.timedelta(hours=1), wait=0).reason ==\
+            'full scan due'
+        assert take(d, _BASE, _START + datetime.timedelta(seconds=1), wait=0).reason ==\
+            'watcher is not responding'
+
+        # Changes recorded after the snapshot are kept.
+        record(d, ['/src/ham'])
+        commit(d, snapshot, _START)
+        assert take(d, _START, _START, wait=0).paths == ['/src/ham']
+
+        record(d, [], overflow=_START.timestamp() + 1)
+        assert take(d, _START, _START, wait=0).reason == 'changes have been lost'
+
+        set_watching(d, None)
+        assert take(d, _START, _START, wait=0).reason == 'sources are not watched'
+
+
+def test_files_from():
+    assert files_from(['/home/alex', '/srv/data/'], [
+        '/home/alex',
+        '/home/alex/spam',
+        '/home/alexander/eggs',
+        '/srv/data/ham',
+        '/srv/data',
+    ]) == {
+        '/home/': ['alex', 'alex/spam'],
+        '/srv/data/': ['ham', '.'],
+    }
+
+
+def test_link_generation(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    dest = os.path.join(d, 'dest')
+    fixture.write(os.path.join(src, 'data', 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'data', 'eggs'), b'eggs')
+    fixture.write(os.path.join(src, SOURCES_FILE), b'summary')
+    os.symlink('spam', os.path.join(src, 'data', 'link'))
+    os.utime(os.path.join(src, 'data'), (1000, 2000))
+    os.mkdir(dest)
+
+    link_generation(src, dest, skip={'data/eggs'})
+
+    assert sorted(os.listdir(dest)) == ['data']
+    assert sorted(os.listdir(os.path.join(dest, 'data'))) == ['link', 'spam']
+    assert os.path.samefile(os.path.join(src, 'data', 'spam'),
+                            os.path.join(dest, 'data', 'spam'))
+    assert os.readlink(os.path.join(dest, 'data', 'link')) == 'spam'
+    assert os.stat(os.path.join(dest, 'data')).st_mtime == 2000
+
+
+def test_watcher(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    target = os.path.join(d, 'bak')
+    fixture.write(os.path.join(src, 'old', 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'cache', 'eggs'), b'eggs')
+    os.mkdir(target)
+    backup = Backup([src], target, excludes=['cache'])
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        task = asyncio.create_task(Watcher(backup, flush_interval=0.05).run(stop))
+        while True:
+            await asyncio.sleep(0.05)
+            snapshot = take(target, _BASE, _BASE, wait=0)
+            if snapshot is not None and snapshot.reason != 'sources are not watched':
+                break
+        base = datetime.datetime.now()
+        commit(target, Snapshot(0, None), base)
+
+        fixture.write(os.path.join(src, 'old', 'spam'), b'more spam')
+        fixture.write(os.path.join(src, 'cache', 'eggs'), b'more eggs')
+        fixture.write(os.path.join(src, 'new', 'dir', 'ham'), b'ham')
+        await asyncio.sleep(0.1)
+        fixture.write(os.path.join(src, 'new', 'dir', 'bacon'), b'bacon')
+        start = datetime.datetime.now()
+        snapshot = await loop.run_in_executor(
+            None, lambda: take(target, base, start, config=config_key(backup)))
+        stop.set()
+        await task
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    assert snapshot.reason is None
+    assert set(snapshot.paths) == {
+        src,
+        os.path.join(src, 'old', 'spam'),
+        os.path.join(src, 'new'),
+        os.path.join(src, 'new', 'dir'),
+        os.path.join(src, 'new', 'dir', 'ham'),
+        os.path.join(src, 'new', 'dir', 'bacon'),
+    }
+    assert take(target, _BASE, _BASE, wait=0).reason == 'sources are not watched'
+
+
+def test_paths_not_valid_utf8():
+    with tempfile.TemporaryDirectory() as d:
+        path = '/src/' + os.fsdecode(b'caf\xe9')
+        set_watching(d, _BASE.timestamp() - 60)
+        record(d, [path], heartbeat=_START.timestamp())
+        commit(d, Snapshot(0, None), _BASE)
+
+        snapshot = take(d, _BASE, _START, wait=0)
+        assert snapshot.paths == [path]
+        lists = files_from(['/src'], snapshot.paths)
+        assert lists == {'/': ['src/' + os.fsdecode(b'caf\xe9')]}
+        with temporary_files_from(lists['/']) as files:
+            with open(files, 'rb') as f:
+                assert f.read() == b'src/caf\xe9\0'
+
+
+def test_watcher_paths_not_valid_utf8(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    target = os.path.join(d, 'bak')
+    os.makedirs(src)
+    os.mkdir(target)
+    backup = Backup([src], target)
+    path = os.path.join(src, os.fsdecode(b'caf\xe9'))
+
+    async def run():
+        stop = asyncio.Event()
+        task = asyncio.create_task(Watcher(backup, flush_interval=0.05).run(stop))
+        while take(target, _BASE, _BASE, wait=0) is None or\
+                take(target, _BASE, _BASE, wait=0).reason == 'sources are not watched':
+            await asyncio.sleep(0.05)
+        base = datetime.datetime.now()
+        commit(target, Snapshot(0, None), base)
+        fixture.write(path, b'coffee')
+        start = datetime.datetime.now()
+        snapshot = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: take(target, base, start))
+        stop.set()
+        await task
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    assert path in snapshot.paths
@@ -0,0 +1,113 @@
+"""Compressed rsync logs.
+
+The output of rsync is written to a gzip compressed log inside each
+generation. Writers only append the text to a bounded queue; a background
+task collects everything queued so far and compresses and writes it in a
+worker thread. Reading rsync's output therefore never waits for compression
+or disk I/O unless the queue is full, which only happens if the disk cannot
+keep up at all.
+"""
+
+import asyncio
+import gzip
+import os
+import typing
+
+from rsbackup.generations import LOG_FILE, PLAIN_LOG_FILE
+
+_QUEUE_SIZE = 1024
+_COMPRESS_LEVEL = 6
+_READ_SIZE = 2**16
+
+
+class LogWriter:
+    """An async writable compressing everything written to the file at
+    `path` using gzip. If `append` is `True`, a new gzip member is appended
+    to an existing file.
+
+    `LogWriter` is used as an async context manager. Concurrent calls to
+    `write` are safe; every call's text is written in one piece. If writing
+    the file fails (e.g. because the disk is full), the error is raised by
+    the next call to `write` and when exiting the context.
+    """
+
+    def __init__(self, path: str, append: bool = False,
+                 queue_size: int = _QUEUE_SIZE):
+        self.path = path
+        self.append = append
+        self._queue = asyncio.Queue(queue_size)
+        self._file = None
+        self._task = None
+
+    async def __aenter__(self) -> 'LogWriter':
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(
+            None, gzip.open, self.path, 'ab' if self.append else 'wb',
+            _COMPRESS_LEVEL)
+        self._task = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, error_type=None, value=None, traceback=None):
+        try:
+            await self._put(None)
+            await self._task
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, self._file.close)
+
+    async def write(self, s: str):
+        await self._put(s)
+
+    async def _put(self, item: typing.Optional[str]):
+        """Queues `item` unless the background task failed, in which case
+        its error is raised instead of waiting for the queue forever."""
+        if self._task.done():
+            self._task.result()
+            raise ValueError(f"{self.path}: log is closed")
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait((put, self._task), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            self._task.result()
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                data = ''.join(batch).encode('utf-8', errors='surrogateescape')
+                await loop.run_in_executor(None, self._file.write, data)
+
+
+def log_path(generation_dir: str) -> typing.Optional[str]:
+    """Returns the path of the log of the generation at `generation_dir`
+    or `None` if it has no log. Uncompressed logs written by earlier
+    versions are supported as well."""
+    for name in (LOG_FILE, PLAIN_LOG_FILE):
+        path = os.path.join(generation_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_log(generation_dir: str) -> typing.Iterator[bytes]:
+    """Yields the decompressed contents of the log of the generation at
+    `generation_dir` in chunks. Raises a `FileNotFoundError` if there is no
+    log."""
+    path = log_path(generation_dir)
+    if path is None:
+        raise FileNotFoundError(f"No log found in {generation_dir}")
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        while chunk := f.read(_READ_SIZE):
+            yield chunk
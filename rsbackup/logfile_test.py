@@ -0,0 +1,59 @@
+import asyncio
+import errno
+import gzip
+import os
+import tempfile
+
+import pytest
+
+from rsbackup.generations import LOG_FILE, PLAIN_LOG_FILE
+from rsbackup.logfile import LogWriter, read_log
+
+
+def test_log_writer():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, LOG_FILE)
+
+        async def write(append, lines):
+            async with LogWriter(path, append=append, queue_size=2) as log:
+                await asyncio.gather(*(log.write(line) for line in lines))
+
+        asyncio.run(write(False, [f"{i}\n" for i in range(100)]))
+        asyncio.run(write(True, ['caf\udcc3\udca9\n']))
+
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().split(b'\n')
+        assert sorted(lines[:100], key=int) == [str(i).encode() for i in range(100)]
+        assert lines[100:] == ['café'.encode(), b'']
+
+
+def test_log_writer_write_fails():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, LOG_FILE)
+
+        def fail(data):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        async def write():
+            log = LogWriter(path, queue_size=2)
+            await log.__aenter__()
+            log._file.write = fail
+            with pytest.raises(OSError, match='No space left'):
+                for i in range(100):
+                    await log.write(f"{i}\n")
+            with pytest.raises(OSError, match='No space left'):
+                await log.__aexit__()
+
+        asyncio.run(asyncio.wait_for(write(), 10))
+
+
+def test_read_log():
+    with tempfile.TemporaryDirectory() as d:
+        with gzip.open(os.path.join(d, LOG_FILE), 'wb') as f:
+            f.write(b'spam\n')
+        assert b''.join(read_log(d)) == b'spam\n'
+
+        os.remove(os.path.join(d, LOG_FILE))
+        with open(os.path.join(d, PLAIN_LOG_FILE), 'wb') as f:
+            f.write(b'eggs\n')
+        assert b''.join(read_log(d)) == b'eggs\n'
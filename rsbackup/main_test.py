@@ -1,5 +1,13 @@
-from rsbackup.__main__ import _load_config
+import datetime
+import json
+import os
+import tempfile
+
+import pytest
+
+from rsbackup.__main__ import _config_status, _load_config, main
 from rsbackup import Backup
+from rsbackup.generations import LAST_RUN_FILE, LATEST, mark_incomplete
 
 
 def test_load_config():
@@ -33,3 +41,51 @@ excludes = [
         sources=['/home'],
         target='/mnt/backups/homes',
         excludes=['dummy', 'foo', '.cache']) == c['another_test']
+
+
+def test_config_status():
+    with tempfile.TemporaryDirectory() as d:
+        gen = os.path.join(d, '2023-01-01_10-00-00')
+        os.makedirs(gen)
+        os.makedirs(os.path.join(d, '2023-01-02_10-00-00'))
+        mark_incomplete(os.path.join(d, '2023-01-02_10-00-00'))
+        os.symlink(gen, os.path.join(d, LATEST))
+        with open(os.path.join(d, LAST_RUN_FILE), 'w') as f:
+            json.dump({'success': False, 'error': 'rsync failed'}, f)
+
+        status = _config_status(Backup(['/src'], d),
+                                datetime.datetime(2023, 1, 1, 11, 0, 0))
+
+        assert status == {
+            'target': d,
+            'latest': '2023-01-01_10-00-00',
+            'latest_link': gen,
+            'latest_timestamp': '2023-01-01T10:00:00',
+            'age_seconds': 3600.0,
+            'generations': 1,
+            'incomplete': ['2023-01-02_10-00-00'],
+            'archived': 0,
+            'last_run': {'success': False, 'error': 'rsync failed'},
+        }
+
+
+def test_config_status_without_generations():
+    with tempfile.TemporaryDirectory() as d:
+        status = _config_status(Backup(['/src'], d), datetime.datetime.now())
+
+        assert status['latest'] is None
+        assert status['age_seconds'] is None
+        assert status['generations'] == 0
+        assert status['last_run'] is None
+
+
+@pytest.mark.parametrize('args, message', [
+    (['create', '--jobs', '0', 'test'], "must be at least 1: '0'"),
+    (['plan', '-j', '-1', 'test'], "must be at least 1: '-1'"),
+    (['daemon', '-j', 'x'], "invalid int value: 'x'"),
+])
+def test_main_rejects_jobs_below_one(args, message, capsys):
+    with pytest.raises(SystemExit) as e:
+        main(args)
+    assert e.value.code == 2
+    assert message in capsys.readouterr().err
@@ -0,0 +1,190 @@
+"""Manifests list all files stored in a generation.
+
+A manifest is an SQLite database stored in the root of each generation. It
+contains one record per file with the file's path relative to the
+generation, its size, modification time (in nanoseconds), inode number and
+mode. Records are stored ordered by path.
+
+Manifests allow answering questions about the history of files without
+walking the generation directories. Paths are stored byte by byte (see
+`connect`), so file names that are not valid UTF-8 are supported. The index of an archived generation
+(see `rsbackup.archive`) is read like a manifest.
+"""
+
+import os
+import sqlite3
+import typing
+
+from rsbackup.generations import (ARCHIVE_SUFFIX, MANIFEST_FILE,
+                                  METADATA_FILES, list_archives,
+                                  list_generations)
+
+
+_TMP_FILE = MANIFEST_FILE + '.tmp'
+
+
+class ManifestEntry(typing.NamedTuple):
+    "A single file recorded in a manifest."
+    path: str
+    size: int
+    mtime: int
+    inode: int
+    mode: int
+
+
+def connect(path: str, readonly: bool = False,
+            timeout: float = 5.0) -> sqlite3.Connection:
+    """Opens the SQLite database at `path` storing file paths.
+
+    Paths must be bound as bytes using `os.fsencode` and converted using
+    `CAST(? AS TEXT)` in SQL, so file names that are not valid UTF-8 are
+    stored byte by byte instead of failing to encode. TEXT values are decoded
+    using `os.fsdecode`. Comparing and sorting paths is done byte-wise.
+    """
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=timeout)
+    else:
+        db = sqlite3.connect(path, timeout=timeout)
+    db.text_factory = os.fsdecode
+    return db
+
+
+def sort_key(entry: ManifestEntry) -> bytes:
+    "Returns the key sorting `entry` in the order of a manifest."
+    return os.fsencode(entry.path)
+
+
+def walk_generation(generation_dir: str) -> typing.Iterator[ManifestEntry]:
+    """Yields a `ManifestEntry` for every file and directory below
+    `generation_dir`. Metadata files written by rsbackup are skipped. Paths
+    use `/` as separator and are relative to `generation_dir`.
+    """
+    stack = [('', generation_dir)]
+    while stack:
+        prefix, dir_path = stack.pop()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if not prefix and (entry.name in METADATA_FILES or
+                                   entry.name == _TMP_FILE):
+                    continue
+
+                st = entry.stat(follow_symlinks=False)
+                path = prefix + entry.name
+                yield ManifestEntry(path, st.st_size, st.st_mtime_ns,
+                                    st.st_ino, st.st_mode)
+
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((path + '/', entry.path))
+
+
+def write_manifest(generation_dir: str,
+                   entries: typing.Optional[typing.Iterable[ManifestEntry]] = None):
+    """Writes the manifest for the generation stored in `generation_dir`.
+
+    If `entries` is `None`, the generation directory is walked to collect
+    the entries. The manifest is written to a temporary file first and moved
+    into place when complete.
+    """
+    if entries is None:
+        entries = walk_generation(generation_dir)
+
+    path = os.path.join(generation_dir, MANIFEST_FILE)
+    tmp_path = os.path.join(generation_dir, _TMP_FILE)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = connect(tmp_path)
+    try:
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        db.execute('''CREATE TABLE files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            mode INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+        db.executemany('INSERT INTO files VALUES (CAST(? AS TEXT), ?, ?, ?, ?)',
+                       ((os.fsencode(e.path),) + tuple(e[1:]) for e in entries))
+        db.commit()
+    finally:
+        db.close()
+
+    os.replace(tmp_path, path)
+
+
+def _open(generation_dir: str) -> typing.Optional[sqlite3.Connection]:
+    path = os.path.join(generation_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        path = generation_dir.rstrip('/') + ARCHIVE_SUFFIX
+        if os.path.isdir(generation_dir) or not os.path.exists(path):
+            return None
+    return connect(path, readonly=True)
+
+
+def read_manifest(generation_dir: str) -> typing.Optional[typing.Iterator[ManifestEntry]]:
+    """Returns an iterator over all entries of the manifest stored in
+    `generation_dir` ordered by path or `None` if the generation has no
+    manifest. If `generation_dir` has been archived, the entries of the
+    archive are returned."""
+    db = _open(generation_dir)
+    if db is None:
+        return None
+
+    def entries():
+        try:
+            for row in db.execute('SELECT * FROM files ORDER BY path'):
+                yield ManifestEntry(*row)
+        finally:
+            db.close()
+
+    return entries()
+
+
+def update_inodes(generation_dir: str, inodes: typing.Mapping[str, int]):
+    """Updates the inode numbers recorded in the manifest of the generation
+    in `generation_dir`. `inodes` maps paths relative to the generation to
+    their new inode numbers. Generations without a manifest are ignored."""
+    path = os.path.join(generation_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return
+
+    db = connect(path)
+    try:
+        with db:
+            db.executemany('UPDATE files SET inode = ? WHERE path = CAST(? AS TEXT)',
+                           ((inode, os.fsencode(p)) for p, inode in inodes.items()))
+    finally:
+        db.close()
+
+
+def _query(target: str, sql: str, params: tuple) -> typing.Iterator[typing.Tuple[str, ManifestEntry]]:
+    for generation in sorted(list_generations(target) + list_archives(target)):
+        db = _open(os.path.join(target, generation))
+        if db is None:
+            continue
+        try:
+            for row in db.execute(sql, params):
+                yield generation, ManifestEntry(*row)
+        finally:
+            db.close()
+
+
+def history(target: str, path: str) -> typing.Iterator[typing.Tuple[str, ManifestEntry]]:
+    """Yields a tuple of generation name and entry for each generation in
+    `target` that contains `path`, ordered from oldest to newest. `path` is
+    relative to the generation root. Generations without a manifest are
+    skipped; archived generations are included.
+    """
+    return _query(target, 'SELECT * FROM files WHERE path = CAST(? AS TEXT)',
+                  (os.fsencode(path),))
+
+
+def find(target: str, pattern: str) -> typing.Iterator[typing.Tuple[str, ManifestEntry]]:
+    """Yields a tuple of generation name and entry for each file in any
+    generation in `target` whose path matches the glob `pattern`. Patterns
+    use SQLite's `GLOB` semantics, i.e. `*` also matches `/`.
+    """
+    return _query(target,
+                  'SELECT * FROM files WHERE path GLOB CAST(? AS TEXT) ORDER BY path',
+                  (os.fsencode(pattern),))
@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+from rsbackup import manifest
+from rsbackup.generations import LOG_FILE
+
+
+def test_write_and_read_manifest(fixture):
+    d = fixture.dir_name
+    fixture.write(os.path.join(d, 'src', 'spam'), 'spam')
+    fixture.write(os.path.join(d, 'src', 'eggs', 'ham'), 'ham and eggs')
+    fixture.write(os.path.join(d, LOG_FILE), 'log')
+
+    manifest.write_manifest(d)
+
+    entries = list(manifest.read_manifest(d))
+    assert [e.path for e in entries] == [
+        'src', 'src/eggs', 'src/eggs/ham', 'src/spam']
+    assert entries[2].size == 12
+    assert entries[2].inode == os.stat(
+        os.path.join(d, 'src', 'eggs', 'ham')).st_ino
+
+
+def test_history_and_find(fixture):
+    d = fixture.dir_name
+    first = os.path.join(d, '2023-01-01_10-00-00')
+    second = os.path.join(d, '2023-01-02_10-00-00')
+    fixture.write(os.path.join(first, 'src', 'spam'), 'spam')
+    fixture.write(os.path.join(second, 'src', 'spam'), 'more spam')
+    fixture.write(os.path.join(second, 'src', 'eggs'), 'eggs')
+    manifest.write_manifest(first)
+    manifest.write_manifest(second)
+
+    history = list(manifest.history(d, 'src/spam'))
+    assert [(g, e.size) for g, e in history] == [
+        ('2023-01-01_10-00-00', 4), ('2023-01-02_10-00-00', 9)]
+
+    found = list(manifest.find(d, 'src/e*'))
+    assert [(g, e.path) for g, e in found] == [
+        ('2023-01-02_10-00-00', 'src/eggs')]
+
+
+def test_read_manifest_missing():
+    with tempfile.TemporaryDirectory() as d:
+        assert manifest.read_manifest(d) is None
+
+
+def test_paths_not_valid_utf8(fixture):
+    d = fixture.dir_name
+    generation = os.path.join(d, '2023-01-01_10-00-00')
+    name = os.fsdecode(b'caf\xe9')
+    fixture.write(os.path.join(generation, 'src', name), 'coffee')
+    fixture.write(os.path.join(generation, 'src', 'tea'), 'tea')
+
+    manifest.write_manifest(generation)
+
+    assert [e.path for e in manifest.read_manifest(generation)] == [
+        'src', 'src/' + name, 'src/tea']
+    assert [e.size for _, e in manifest.history(d, 'src/' + name)] == [6]
+    assert [e.path for _, e in manifest.find(d, 'src/caf*')] == ['src/' + name]
+    manifest.update_inodes(generation, {'src/' + name: 42})
+    assert [e.inode for _, e in manifest.history(d, 'src/' + name)] == [42]
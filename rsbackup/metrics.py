@@ -0,0 +1,99 @@
+"""Export of backup results in the Prometheus text format.
+
+The file written is meant to be picked up by the textfile collector of the
+Prometheus node exporter. It is replaced atomically so the collector never
+reads a partially written file.
+"""
+
+import os
+import typing
+
+_PREFIX = 'rsbackup'
+
+_STATS = {
+    'number_of_files': ('files', 'Number of files in the sources.'),
+    'number_of_regular_files_transferred': ('files_transferred', 'Number of regular files transferred.'),
+    'total_file_size': ('file_size_bytes', 'Total size of all files in the sources.'),
+    'total_transferred_file_size': ('transferred_file_size_bytes', 'Total size of all files transferred.'),
+    'total_bytes_sent': ('sent_bytes', 'Number of bytes sent by rsync.'),
+    'total_bytes_received': ('received_bytes', 'Number of bytes received by rsync.'),
+    'file_list_generation_time': ('file_list_generation_seconds', 'Time rsync took to build the file list.'),
+    'speedup': ('speedup', 'Ratio of total file size to bytes sent and received.'),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(target: str) -> str:
+    return f'{{target="{_escape(target)}"}}'
+
+
+def format_metrics(target: str, result,
+                   last_success: typing.Optional[float] = None) -> str:
+    """Formats the `BackupResult` `result` of a backup to `target`. If the
+    run failed, `last_success` is exported as the start of the last
+    successful run."""
+    labels = _labels(target)
+    lines = []
+
+    def metric(name: str, help: str, value, extra_labels: str = ''):
+        full = f"{_PREFIX}_{name}"
+        if not lines or not lines[-1].startswith(full + '{'):
+            lines.append(f"# HELP {full} {help}")
+            lines.append(f"# TYPE {full} gauge")
+        label_str = labels if not extra_labels else labels[:-1] + ',' + extra_labels + '}'
+        lines.append(f"{full}{label_str} {value}")
+
+    metric('last_run_timestamp_seconds', 'Start of the last run.', result.start.timestamp())
+    metric('last_run_success', 'Whether the last run succeeded.', int(result.success))
+    if result.success:
+        last_success = result.start.timestamp()
+    if last_success is not None:
+        metric('last_success_timestamp_seconds', 'Start of the last successful run.',
+               last_success)
+    metric('last_run_unchanged', 'Whether the last run was skipped as the sources were unchanged.',
+           int(result.unchanged))
+    metric('last_run_duration_seconds', 'Duration of the last run.', result.duration.total_seconds())
+
+    for phase, seconds in result.phases.items():
+        metric('last_run_phase_seconds', 'Duration of the phases of the last run.',
+               seconds, f'phase="{_escape(phase)}"')
+
+    for key, (name, help) in _STATS.items():
+        if key in result.stats:
+            metric(f"last_run_{name}", help, result.stats[key])
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path: str, target: str, result):
+    """Atomically writes the metrics for `result` of a backup to `target` to
+    the file at `path`. If the run failed, the start of the last successful
+    run is kept from the previous file or taken from the catalog."""
+    last_success = None
+    if not result.success:
+        last_success = _previous_success(path, target)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(format_metrics(target, result, last_success))
+    os.replace(tmp, path)
+
+
+def _previous_success(path: str, target: str) -> typing.Optional[float]:
+    prefix = f"{_PREFIX}_last_success_timestamp_seconds{_labels(target)} "
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(prefix):
+                    return float(line[len(prefix):])
+    except (FileNotFoundError, ValueError):
+        pass
+
+    from rsbackup import catalog
+
+    successful = [e for e in catalog.list_catalog(target, rebuild_missing=False)
+                  if e.success]
+    return successful[-1].start.timestamp() if successful else None
@@ -0,0 +1,81 @@
+import datetime
+import os
+import tempfile
+
+from rsbackup import BackupResult, catalog
+from rsbackup.metrics import format_metrics, write_metrics
+
+
+def _result():
+    result = BackupResult(datetime.datetime(2023, 1, 2, 3, 4, 5))
+    result.end = result.start + datetime.timedelta(seconds=90)
+    result.phases = {'mkdir': 0.5, 'rsync': 80.25}
+    result.stats = {'number_of_files': 1234, 'total_bytes_sent': 2048,
+                    'speedup': 12.5}
+    return result
+
+
+def test_format_metrics():
+    out = format_metrics('/bak/"home"', _result())
+    labels = '{target="/bak/\\"home\\""}'
+
+    assert f"rsbackup_last_run_success{labels} 1\n" in out
+    assert f"rsbackup_last_run_duration_seconds{labels} 90.0\n" in out
+    assert f"rsbackup_last_run_files{labels} 1234\n" in out
+    assert f"rsbackup_last_run_sent_bytes{labels} 2048\n" in out
+    assert f"rsbackup_last_run_speedup{labels} 12.5\n" in out
+    assert '{target="/bak/\\"home\\"",phase="rsync"} 80.25\n' in out
+    assert out.count('# TYPE rsbackup_last_run_phase_seconds gauge') == 1
+
+
+def test_format_metrics_failure():
+    result = _result()
+    result.error = 'rsync failed'
+
+    out = format_metrics('/bak', result)
+
+    assert 'rsbackup_last_run_success{target="/bak"} 0\n' in out
+    assert 'rsbackup_last_success_timestamp_seconds' not in out
+
+    out = format_metrics('/bak', result, last_success=1000.0)
+    assert 'rsbackup_last_success_timestamp_seconds{target="/bak"} 1000.0\n' in out
+
+
+def test_write_metrics():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'rsbackup.prom')
+
+        write_metrics(path, '/bak', _result())
+
+        assert os.listdir(d) == ['rsbackup.prom']
+        with open(path) as f:
+            assert f.read() == format_metrics('/bak', _result())
+
+
+def test_write_metrics_keeps_last_success(fixture):
+    path = os.path.join(fixture.dir_name, 'rsbackup.prom')
+    target = os.path.join(fixture.dir_name, 'bak')
+    os.mkdir(target)
+    success = _result()
+    failure = _result()
+    failure.start += datetime.timedelta(days=1)
+    failure.error = 'rsync failed'
+    line = f'rsbackup_last_success_timestamp_seconds{{target="{target}"}} ' +\
+        f'{success.start.timestamp()}\n'
+
+    write_metrics(path, target, success)
+    write_metrics(path, target, failure)
+    write_metrics(path, target, failure)
+
+    with open(path) as f:
+        out = f.read()
+    assert f'rsbackup_last_run_success{{target="{target}"}} 0\n' in out
+    assert line in out
+
+    # Without a previous file the last success is read from the catalog.
+    os.remove(path)
+    success.generation = os.path.join(target, '2023-01-02_03-04-05')
+    catalog.record(target, catalog.entry_from_result(success.to_dict()))
+    write_metrics(path, target, failure)
+    with open(path) as f:
+        assert line in f.read()
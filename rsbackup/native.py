@@ -0,0 +1,444 @@
+"""A copy engine implemented in Python.
+
+`NativeSync` is a drop-in replacement for `RSync` for local backups: it
+walks the sources using `os.scandir`, hard links files whose size,
+modification time, mode and owner match one of the previous generations and
+copies all other files on a thread pool using `copy_file_range`. It honors
+the same filter rules and reports the same events and statistics as rsync,
+so logging, progress reporting and throttling work unchanged. It does not
+need an rsync binary and avoids the cost of rsync's protocol, but it only
+supports local sources and targets.
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import os
+import shutil
+import stat
+import threading
+import time
+import typing
+
+from rsbackup import (FileDeleted, FileLinked, FileTransferred, ItemChanged,
+                      Message, Progress, RSyncEvent, _should_log)
+from rsbackup.filters import transfer_path, walk_sources
+from rsbackup.generations import METADATA_FILES
+from rsbackup.restore import copy_metadata, remove_file, restore_file
+
+_PROGRESS_INTERVAL = 0.5
+_BATCH_SIZE = 256
+_PARTIAL_TRANSFER = 23
+_INTERRUPTED = 20
+
+
+def _unchanged(st: os.stat_result, other: os.stat_result) -> bool:
+    "Returns whether a file described by `other` can be reused for `st`."
+    return stat.S_ISREG(other.st_mode) and\
+        other.st_size == st.st_size and\
+        other.st_mtime_ns == st.st_mtime_ns and\
+        other.st_mode == st.st_mode and\
+        other.st_uid == st.st_uid and\
+        other.st_gid == st.st_gid
+
+
+def format_event(event: RSyncEvent) -> str:
+    "Formats `event` as rsync would print it with `--out-format=%i %l %n%L`."
+    if isinstance(event, FileDeleted):
+        return f"*deleting   {event.path}"
+    if isinstance(event, FileLinked):
+        suffix = f" => {event.link_target}" if event.link_target else ''
+        return f"{event.itemized} {event.size} {event.path}{suffix}"
+    if isinstance(event, FileTransferred):
+        return f"{event.itemized} {event.size} {event.path}"
+    if isinstance(event, ItemChanged):
+        return f"{event.itemized} 0 {event.path}"
+    if isinstance(event, Message):
+        return event.text
+    return ''
+
+
+class NativeProcess:
+    """A running `NativeSync`.
+
+    Provides the same interface as `RSyncProcess`: iterating asynchronously
+    yields the events of the transfer and `stats` contains the statistics
+    using the keys rsync reports with `--stats`. The transfer runs in a
+    separate thread.
+    """
+
+    def __init__(self, sync: 'NativeSync', log=None, log_level: str = 'full',
+                 dry_run: bool = False):
+        self._sync = sync
+        self._log = log
+        self._log_level = log_level
+        self._dry_run = dry_run
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = False
+        self._returncode = None
+        self._done = asyncio.Event()
+        self.paused = False
+        self.stats = {}
+        self._thread = threading.Thread(target=self._transfer, daemon=True)
+        self._thread.start()
+
+    def __aiter__(self) -> typing.AsyncIterator[RSyncEvent]:
+        return self._events()
+
+    async def _events(self):
+        while True:
+            batch = await self._queue.get()
+            if batch is None:
+                self._done.set()
+                return
+
+            if self._log is not None:
+                out = ''.join(format_event(e) + '\n' for e in batch
+                              if _should_log(e, self._log_level))
+                if out:
+                    await self._log.write(out)
+
+            for event in batch:
+                yield event
+
+    @property
+    def pid(self) -> int:
+        "The process id of the transfer, which runs in a thread of this process."
+        return os.getpid()
+
+    def terminate(self):
+        "Stops the transfer after the files currently being copied."
+        self._cancelled = True
+        self._running.set()
+
+    def pause(self):
+        "Pauses the transfer until `resume` is called."
+        self._running.clear()
+        self.paused = True
+
+    def resume(self):
+        "Continues the transfer if it has been paused."
+        self._running.set()
+        self.paused = False
+
+    async def wait(self) -> int:
+        """Waits for the transfer to finish and returns an exit code
+        compatible with rsync's."""
+        if not self._done.is_set():
+            async for _ in self:
+                pass
+        return self._returncode
+
+    def _emit(self, batch: typing.Optional[typing.List[RSyncEvent]]):
+        try:
+            self._loop.call_soon_threadsafe(
+                self._queue.put_nowait, list(batch) if batch is not None else None)
+        except RuntimeError:
+            # The event loop has been closed after cancelling the transfer.
+            pass
+        if batch:
+            batch.clear()
+
+    def _transfer(self):
+        try:
+            self._returncode = _Transfer(self._sync, self, self._dry_run).run()
+        except Exception as e:
+            self._emit([Message(f"rsbackup: {e}")])
+            self._returncode = 1
+        finally:
+            self._emit(None)
+
+
+class _Transfer:
+    "Implements a single run of a `NativeSync`."
+
+    def __init__(self, sync: 'NativeSync', process: NativeProcess, dry_run: bool):
+        self.sync = sync
+        self.process = process
+        self.dry_run = dry_run
+        self.batch = []
+        self.errors = 0
+        self.stats = {
+            'number_of_files': 0,
+            'number_of_created_files': 0,
+            'number_of_deleted_files': 0,
+            'number_of_regular_files_transferred': 0,
+            'total_file_size': 0,
+            'total_transferred_file_size': 0,
+        }
+        self.transferred = 0
+        self.last_progress = 0.0
+
+    def event(self, event: RSyncEvent):
+        self.batch.append(event)
+        if len(self.batch) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.process._emit(self.batch)
+
+    def error(self, path: str, e: OSError):
+        self.errors += 1
+        self.event(Message(f"rsbackup: {path}: {e.strerror or e}"))
+
+    def checkpoint(self) -> bool:
+        """Blocks while the transfer is paused and returns `False` if it has
+        been cancelled."""
+        self.process._running.wait()
+        return not self.process._cancelled
+
+    def progress(self, total: int, start: float, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_progress < _PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        rate = self.transferred / (now - start) if now > start else 0.0
+        remaining = total - self.transferred
+        eta = int(remaining / rate) if rate else 0
+        percent = int(self.transferred * 100 / total) if total else 100
+        self.event(Progress(self.transferred, percent, rate,
+                            datetime.timedelta(seconds=eta)))
+        self.flush()
+
+    def run(self) -> int:
+        start = time.monotonic()
+        entries = list(walk_sources(self.sync.sources, self.sync.filter_rules))
+        self.stats['file_list_generation_time'] = round(time.monotonic() - start, 3)
+        self.stats['number_of_files'] = len(entries)
+
+        target = self.sync.target
+        link_dests = self.sync.link_dests
+        dirs = []
+        files = []
+
+        for path, rel, st in entries:
+            if not self.checkpoint():
+                return self.finish(_INTERRUPTED)
+            dest = os.path.join(target, rel) if rel else target
+            try:
+                if stat.S_ISDIR(st.st_mode):
+                    self.make_dir(path, rel, dest, st)
+                    dirs.append((dest, st))
+                elif stat.S_ISREG(st.st_mode):
+                    self.stats['total_file_size'] += st.st_size
+                    if not self.link_or_keep(rel, dest, st, link_dests):
+                        files.append((path, rel, dest, st))
+                elif stat.S_ISLNK(st.st_mode):
+                    self.make_special(path, rel, dest, st, 'cL')
+                else:
+                    self.make_special(path, rel, dest, st, 'cD' if stat.S_ISCHR(st.st_mode)
+                                      or stat.S_ISBLK(st.st_mode) else 'cS')
+            except OSError as e:
+                self.error(rel, e)
+
+        total = sum(st.st_size for _, _, _, st in files)
+        if not self.copy_files(files, total, start):
+            return self.finish(_INTERRUPTED)
+        self.progress(total, start, force=True)
+
+        if not self.dry_run:
+            # Directory metadata is applied last, deepest first, as creating
+            # entries changes the modification time.
+            for dest, st in reversed(dirs):
+                try:
+                    copy_metadata(dest, st)
+                except OSError as e:
+                    self.error(dest, e)
+
+        return self.finish(_PARTIAL_TRANSFER if self.errors else 0)
+
+    def finish(self, code: int) -> int:
+        self.stats['total_bytes_sent'] = self.transferred
+        self.stats['total_bytes_received'] = 0
+        for key, value in self.stats.items():
+            label = key.replace('_', ' ').capitalize()
+            self.event(Message(f"{label}: {value:,}"))
+        self.process.stats = self.stats
+        self.flush()
+        return code
+
+    def make_dir(self, path: str, rel: str, dest: str, st: os.stat_result):
+        existed = os.path.isdir(dest) and not os.path.islink(dest)
+        if not existed:
+            self.stats['number_of_created_files'] += 1
+            self.event(ItemChanged(f"{rel}/" if rel else './', 'cd+++++++++'))
+            if not self.dry_run:
+                if os.path.lexists(dest):
+                    remove_file(dest)
+                os.makedirs(dest)
+        elif rel:
+            self.delete_extraneous(set(os.listdir(path)), rel, dest)
+        else:
+            self.delete_extraneous(self.root_names(), rel, dest)
+
+    def root_names(self) -> typing.Set[str]:
+        """Returns the names in the root of the target that are transferred
+        from any of the sources or are metadata files of the generation."""
+        names = set(METADATA_FILES)
+        for source in self.sync.sources:
+            path, rel = transfer_path(source)
+            if rel:
+                names.add(rel.split('/')[0])
+            else:
+                names.update(os.listdir(path))
+        return names
+
+    def delete_extraneous(self, names: typing.Set[str], rel: str, dest: str):
+        "Removes entries of `dest` not contained in `names` like --delete."
+        for name in sorted(os.listdir(dest)):
+            if name in names:
+                continue
+            extraneous = os.path.join(dest, name)
+            self.stats['number_of_deleted_files'] += 1
+            self.event(FileDeleted(f"{rel}/{name}" if rel else name))
+            if not self.dry_run:
+                if os.path.isdir(extraneous) and not os.path.islink(extraneous):
+                    shutil.rmtree(extraneous)
+                else:
+                    os.unlink(extraneous)
+
+    def link_or_keep(self, rel: str, dest: str, st: os.stat_result,
+                     link_dests: typing.Sequence[str]) -> bool:
+        """Keeps `dest` if it is unchanged or hard links it to an unchanged
+        copy in one of `link_dests`. Returns `False` if the file needs to be
+        copied."""
+        try:
+            if _unchanged(st, os.lstat(dest)):
+                return True
+        except FileNotFoundError:
+            pass
+
+        for link_dest in link_dests:
+            candidate = os.path.join(link_dest, rel)
+            try:
+                if not _unchanged(st, os.lstat(candidate)):
+                    continue
+            except OSError:
+                continue
+            if not self.dry_run:
+                remove_file(dest)
+                os.link(candidate, dest)
+            self.event(FileLinked(rel, st.st_size, 'hf         '))
+            return True
+
+        return False
+
+    def make_special(self, path: str, rel: str, dest: str, st: os.stat_result,
+                     itemized: str):
+        self.stats['number_of_created_files'] += 1
+        self.event(ItemChanged(rel, f"{itemized}+++++++++"))
+        if not self.dry_run:
+            remove_file(dest)
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(path), dest)
+            elif stat.S_ISFIFO(st.st_mode):
+                os.mkfifo(dest, stat.S_IMODE(st.st_mode))
+            else:
+                os.mknod(dest, st.st_mode, st.st_rdev)
+            copy_metadata(dest, st)
+
+    def copy_files(self, files, total: int, start: float) -> bool:
+        "Copies `files` on a thread pool. Returns `False` if cancelled."
+        if self.dry_run:
+            for _, rel, dest, st in files:
+                self.record_copy(rel, dest, st)
+            return True
+
+        workers = self.sync.workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            it = iter(files)
+            while True:
+                for path, rel, dest, st in it:
+                    if not self.checkpoint():
+                        concurrent.futures.wait(pending)
+                        return False
+                    existed = os.path.lexists(dest)
+                    future = executor.submit(restore_file, path, dest, st)
+                    pending[future] = (rel, dest, st, existed)
+                    if len(pending) >= workers * 4:
+                        break
+                if not pending:
+                    return True
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rel, dest, st, existed = pending.pop(future)
+                    try:
+                        future.result()
+                        self.record_copy(rel, dest, st, existed)
+                    except OSError as e:
+                        self.error(rel, e)
+                self.progress(total, start)
+
+    def record_copy(self, rel: str, dest: str, st: os.stat_result,
+                    existed: typing.Optional[bool] = None):
+        if existed is None:
+            existed = os.path.lexists(dest)
+        if not existed:
+            self.stats['number_of_created_files'] += 1
+        self.stats['number_of_regular_files_transferred'] += 1
+        self.stats['total_transferred_file_size'] += st.st_size
+        self.transferred += st.st_size
+        self.event(FileTransferred(rel, st.st_size,
+                                   '>f.st......' if existed else '>f+++++++++'))
+
+
+class NativeSync:
+    """Copies `sources` into the directory `target` like `RSync` in archive
+    mode with `--delete`, but without running rsync.
+
+    Files that are unchanged compared to the same file in one of the
+    directories `link_dest` (a path or a sequence of paths) are hard linked;
+    a file is unchanged if its size, modification time, mode and owner
+    match. Files already present in `target` and unchanged are kept, so an
+    interrupted transfer can be resumed.
+
+    `filter_rules` is a list of rsync filter rules (see
+    `rsbackup.filters.compile_rules`) applied to the sources. Only include,
+    exclude and dir-merge rules are supported.
+
+    Source paths may contain a `/./` component as with rsync's
+    `--relative`. `relative` is accepted for compatibility with `RSync`
+    only.
+
+    Files are copied using `workers` threads.
+    """
+
+    def __init__(self, sources: typing.Sequence[str], target: str,
+                 link_dest: typing.Union[None, str, typing.Sequence[str]] = None,
+                 filter_rules: typing.Optional[typing.Iterable[str]] = None,
+                 relative: bool = False,
+                 workers: typing.Optional[int] = None):
+        self.sources = sources
+        self.target = target
+        if link_dest is None:
+            self.link_dests = []
+        elif isinstance(link_dest, str):
+            self.link_dests = [link_dest]
+        else:
+            self.link_dests = list(link_dest)
+        self.filter_rules = list(filter_rules or [])
+        self.relative = relative
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+
+    @property
+    def command(self) -> typing.List[str]:
+        "Describes the transfer in the form of an rsync command line."
+        args = ['native', '--archive', '--delete']
+        for link_dest in self.link_dests:
+            args += ['--link-dest', link_dest]
+        args += [f"--filter={rule}" for rule in self.filter_rules]
+        return args + list(self.sources) + [self.target]
+
+    async def start(self, log=None, dry_run: bool = False,
+                    log_level: str = 'full') -> NativeProcess:
+        """Starts the transfer in a separate thread and returns a
+        `NativeProcess` which can be iterated asynchronously to receive the
+        events of the transfer. See `RSync.start` for the arguments."""
+        return NativeProcess(self, log=log, log_level=log_level, dry_run=dry_run)
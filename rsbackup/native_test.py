@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+
+from rsbackup import Backup, FileDeleted, FileLinked, FileTransferred
+from rsbackup.generations import (INCOMPLETE_FILE, LATEST, LOG_FILE,
+                                  list_generations, mark_incomplete)
+from rsbackup.native import NativeSync
+
+
+def _sync(sync: NativeSync):
+    async def run():
+        process = await sync.start()
+        events = [e async for e in process]
+        return await process.wait(), events, process.stats
+
+    return asyncio.run(run())
+
+
+def test_native_sync_copies_tree(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'sub', 'eggs'), b'eggs' * 100000)
+    fixture.write(os.path.join(src, 'sub', 'skip.tmp'), b'tmp')
+    os.symlink('spam', os.path.join(src, 'link'))
+    os.chmod(os.path.join(src, 'sub', 'eggs'), 0o600)
+    os.utime(os.path.join(src, 'sub'), ns=(10**18, 10**18))
+
+    target = os.path.join(d, 'gen')
+    os.makedirs(target)
+    code, events, stats = _sync(NativeSync([src], target, filter_rules=['- *.tmp']))
+
+    assert code == 0
+    out = os.path.join(target, 'src')
+    assert fixture.read(os.path.join(out, 'spam')) == b'spam'
+    assert fixture.read(os.path.join(out, 'sub', 'eggs')) == b'eggs' * 100000
+    assert not os.path.exists(os.path.join(out, 'sub', 'skip.tmp'))
+    assert os.readlink(os.path.join(out, 'link')) == 'spam'
+    assert os.stat(os.path.join(out, 'sub', 'eggs')).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.join(out, 'sub')).st_mtime_ns == 10**18
+
+    assert sorted(e.path for e in events if isinstance(e, FileTransferred)) ==\
+        ['src/spam', 'src/sub/eggs']
+    assert stats['number_of_regular_files_transferred'] == 2
+    assert stats['total_transferred_file_size'] == 400004
+    assert stats['number_of_files'] == 5
+
+
+def test_native_sync_links_unchanged_and_deletes_extraneous_files(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'eggs'), b'eggs')
+
+    prev = os.path.join(d, 'prev')
+    assert _sync(NativeSync([src + '/'], prev))[0] == 0
+
+    fixture.write(os.path.join(src, 'eggs'), b'more eggs')
+    target = os.path.join(d, 'gen')
+    fixture.write(os.path.join(target, 'sub', 'old'), b'old')
+    os.makedirs(os.path.join(src, 'sub'))
+
+    code, events, stats = _sync(NativeSync([src + '/'], target, link_dest=prev))
+
+    assert code == 0
+    assert os.stat(os.path.join(target, 'spam')).st_ino ==\
+        os.stat(os.path.join(prev, 'spam')).st_ino
+    assert fixture.read(os.path.join(target, 'eggs')) == b'more eggs'
+    assert not os.path.exists(os.path.join(target, 'sub', 'old'))
+    assert [e.path for e in events if isinstance(e, FileLinked)] == ['spam']
+    assert [e.path for e in events if isinstance(e, FileDeleted)] == ['sub/old']
+    assert stats['number_of_deleted_files'] == 1
+
+
+def test_native_sync_deletes_extraneous_files_in_root(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    other = os.path.join(d, 'other')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(other, 'eggs'), b'eggs')
+    target = os.path.join(d, 'gen')
+    fixture.write(os.path.join(target, 'gone'), b'gone')
+    fixture.write(os.path.join(target, 'other', 'ham'), b'ham')
+    fixture.write(os.path.join(target, LOG_FILE), b'log')
+    mark_incomplete(target)
+
+    code, events, stats = _sync(NativeSync([src + '/', other], target))
+
+    assert code == 0
+    assert sorted(os.listdir(target)) == sorted(['spam', 'other', LOG_FILE, INCOMPLETE_FILE])
+    assert os.listdir(os.path.join(target, 'other')) == ['eggs']
+    assert [e.path for e in events if isinstance(e, FileDeleted)] == ['gone', 'other/ham']
+    assert stats['number_of_deleted_files'] == 2
+
+
+def test_native_sync_dry_run(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    target = os.path.join(d, 'gen')
+    os.makedirs(target)
+
+    code, events, stats = _sync_dry_run(NativeSync([src], target))
+
+    assert code == 0
+    assert os.listdir(target) == []
+    assert [e.path for e in events if isinstance(e, FileTransferred)] == ['src/spam']
+
+
+def _sync_dry_run(sync: NativeSync):
+    async def run():
+        process = await sync.start(dry_run=True)
+        events = [e async for e in process]
+        return await process.wait(), events, process.stats
+
+    return asyncio.run(run())
+
+
+def test_backup_with_native_engine(fixture, logger):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    bak = os.path.join(d, 'bak')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'node_modules', 'x.js'), b'x')
+    fixture.write(os.path.join(src, '.rsbackupignore'), b'node_modules/\n')
+    os.makedirs(bak)
+
+    backup = Backup([src], bak, engine='native')
+    first = asyncio.run(backup.run(logger=logger))
+    backup.parallel = 2
+    fixture.write(os.path.join(src, 'eggs'), b'eggs')
+    # Generation names have a resolution of one second.
+    time.sleep(1)
+    second = asyncio.run(backup.run(logger=logger))
+
+    assert first.success and second.success
+    assert first.generation != second.generation
+    assert list_generations(bak) == sorted(
+        os.path.basename(r.generation) for r in (first, second))
+    latest = os.path.join(bak, LATEST, 'src')
+    assert fixture.read(os.path.join(latest, 'eggs')) == b'eggs'
+    assert not os.path.exists(os.path.join(latest, 'node_modules'))
+    assert os.stat(os.path.join(latest, 'spam')).st_ino ==\
+        os.stat(os.path.join(first.generation, 'src', 'spam')).st_ino
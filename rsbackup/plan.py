@@ -0,0 +1,144 @@
+"""Estimates for the next run of a backup.
+
+A plan is computed from the statistics of a dry run (the number of files
+and bytes rsync would transfer) and the history of earlier runs recorded in
+the catalog. The duration of a run is modelled as a fixed overhead (building
+the file list, writing the manifest) plus the bytes to transfer divided by
+the throughput; both are fitted to the most recent successful runs. The new
+space a run consumes is the size of the files to transfer, as all other
+files are hard linked.
+"""
+
+import datetime
+import os
+import typing
+
+from rsbackup.catalog import CatalogEntry
+
+HISTORY_RUNS = 10
+"Number of most recent successful runs used to estimate the throughput."
+
+
+class Throughput(typing.NamedTuple):
+    """The performance of earlier runs: `overhead` seconds per run and
+    `rate` bytes transferred per second. `rate` is `None` if no earlier run
+    transferred any data."""
+    overhead: float
+    rate: typing.Optional[float]
+
+    def duration(self, bytes: int) -> datetime.timedelta:
+        "Returns the estimated duration of a run transferring `bytes`."
+        seconds = self.overhead
+        if self.rate:
+            seconds += bytes / self.rate
+        return datetime.timedelta(seconds=round(seconds))
+
+
+def fit_throughput(entries: typing.Iterable[CatalogEntry],
+                   runs: int = HISTORY_RUNS) -> typing.Optional[Throughput]:
+    """Returns the `Throughput` of the last `runs` successful runs in
+    `entries` or `None` if there are none.
+
+    The overhead and rate are fitted using least squares if the runs
+    transferred different amounts of data. If that yields no plausible
+    model, the overhead is assumed to be zero and the rate is the total
+    number of bytes divided by the total duration.
+    """
+    samples = [(e.bytes_transferred, e.duration.total_seconds())
+               for e in entries
+               if e.success and e.duration is not None and e.bytes_transferred is not None]
+    samples = samples[-runs:]
+    if not samples:
+        return None
+
+    n = len(samples)
+    mean_bytes = sum(b for b, _ in samples) / n
+    mean_seconds = sum(s for _, s in samples) / n
+    variance = sum((b - mean_bytes) ** 2 for b, _ in samples)
+    if variance:
+        slope = sum((b - mean_bytes) * (s - mean_seconds) for b, s in samples) / variance
+        overhead = mean_seconds - slope * mean_bytes
+        if slope > 0 and overhead >= 0:
+            return Throughput(overhead, 1 / slope)
+
+    total_bytes = sum(b for b, _ in samples)
+    total_seconds = sum(s for _, s in samples)
+    if not total_bytes:
+        return Throughput(mean_seconds, None)
+    return Throughput(0.0, total_bytes / total_seconds if total_seconds else None)
+
+
+class Estimate:
+    """The estimated outcome of the next run of a backup.
+
+    `files` is the number of files in the sources, `transfer_files` and
+    `transfer_bytes` the number and size of the files to copy. `new_bytes`
+    is the space the new generation will consume. `duration` is `None` if
+    there is no history to estimate it from.
+    """
+
+    def __init__(self, target: str, stats: typing.Dict[str, float],
+                 throughput: typing.Optional[Throughput]):
+        self.target = target
+        self.stats = stats
+        self.files = int(stats.get('number_of_files', 0))
+        self.transfer_files = int(stats.get('number_of_regular_files_transferred', 0))
+        self.transfer_bytes = int(stats.get('total_transferred_file_size', 0))
+        self.total_bytes = int(stats.get('total_file_size', 0))
+        self.new_bytes = self.transfer_bytes
+        self.throughput = throughput
+        self.duration = throughput.duration(self.transfer_bytes)\
+            if throughput is not None else None
+
+    def to_dict(self) -> dict:
+        "Returns a JSON serializable representation of this estimate."
+        return {
+            'target': self.target,
+            'files': self.files,
+            'transfer_files': self.transfer_files,
+            'transfer_bytes': self.transfer_bytes,
+            'total_bytes': self.total_bytes,
+            'new_bytes': self.new_bytes,
+            'duration_seconds': self.duration.total_seconds()
+            if self.duration is not None else None,
+            'rate': self.throughput.rate if self.throughput is not None else None,
+        }
+
+
+def _existing(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def free_space(path: str) -> typing.Tuple[int, int]:
+    """Returns the device and the number of bytes available to unprivileged
+    users on the file system containing `path`. If `path` does not exist,
+    its nearest existing parent is used."""
+    path = _existing(path)
+    st = os.statvfs(path)
+    return os.stat(path).st_dev, st.f_bavail * st.f_frsize
+
+
+class SpaceCheck(typing.NamedTuple):
+    """The space needed by all backups writing to a file system compared to
+    the space available. `targets` lists the targets on the file system."""
+    targets: typing.List[str]
+    needed: int
+    free: int
+
+    @property
+    def sufficient(self) -> bool:
+        return self.needed <= self.free
+
+
+def check_space(estimates: typing.Iterable[Estimate]) -> typing.List[SpaceCheck]:
+    """Sums the new space of all `estimates` per file system and compares it
+    with the space available."""
+    devices = {}
+    for e in estimates:
+        device, free = free_space(e.target)
+        targets, needed, _ = devices.get(device, ([], 0, free))
+        devices[device] = (targets + [e.target], needed + e.new_bytes, free)
+    return [SpaceCheck(*v) for v in devices.values()]
@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+import os
+import tempfile
+
+from rsbackup import Backup
+from rsbackup.catalog import CatalogEntry
+from rsbackup.plan import Estimate, Throughput, check_space, fit_throughput
+
+
+def _entry(seconds, bytes, success=True):
+    start = datetime.datetime(2023, 1, 1, 10, 0, 0)
+    return CatalogEntry(start.strftime('%Y-%m-%d_%H-%M-%S'), start,
+                        start + datetime.timedelta(seconds=seconds), success,
+                        None, 10, bytes, [])
+
+
+def test_fit_throughput():
+    # 10 seconds overhead plus 1 MiB/s.
+    entries = [_entry(10 + b / 2**20, b) for b in (0, 2**20, 10 * 2**20)]
+    entries.append(_entry(1000, 2**20, success=False))
+
+    throughput = fit_throughput(entries)
+
+    assert round(throughput.overhead, 3) == 10
+    assert round(throughput.rate) == 2**20
+    assert throughput.duration(60 * 2**20) == datetime.timedelta(seconds=70)
+
+
+def test_fit_throughput_falls_back_to_average_rate():
+    assert fit_throughput([]) is None
+    assert fit_throughput([_entry(4, 400)]) == Throughput(0.0, 100.0)
+    assert fit_throughput([_entry(4, 0), _entry(6, 0)]) == Throughput(5.0, None)
+    # A larger transfer taking less time yields no plausible model.
+    assert fit_throughput([_entry(20, 100), _entry(10, 300)]) == Throughput(0.0, 400 / 30)
+
+
+def test_check_space():
+    with tempfile.TemporaryDirectory() as d:
+        stats = {'number_of_files': 3, 'number_of_regular_files_transferred': 1,
+                 'total_transferred_file_size': 100, 'total_file_size': 300}
+        estimates = [Estimate(os.path.join(d, 'a'), stats, None),
+                     Estimate(os.path.join(d, 'b', 'c'), stats, None)]
+
+        [check] = check_space(estimates)
+
+        assert check.targets == [os.path.join(d, 'a'), os.path.join(d, 'b', 'c')]
+        assert check.needed == 200
+        assert check.free > 0
+        assert check.sufficient
+
+
+def test_backup_plan(logger):
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, 'src')
+        bak = os.path.join(d, 'bak')
+        os.makedirs(src)
+        with open(os.path.join(src, 'spam'), 'wb') as f:
+            f.write(b'spam' * 100)
+
+        estimate = asyncio.run(Backup([src], bak, engine='native').plan(logger))
+
+        assert not os.path.exists(bak)
+        assert estimate.transfer_files == 1
+        assert estimate.transfer_bytes == 400
+        assert estimate.new_bytes == 400
+        assert estimate.duration is None
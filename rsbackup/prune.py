@@ -0,0 +1,134 @@
+"""Removes old generations according to a retention policy.
+
+The retention policy keeps the newest generation of each of the last
+`keep_daily` days, `keep_weekly` ISO weeks and `keep_monthly` months that
+contain a generation. Generations are removed by a pool of worker threads
+which unlink the files of many directories concurrently; this scales much
+better than a single `rm -rf` for heavily hardlinked trees.
+"""
+
+import concurrent.futures
+import os
+import stat
+import typing
+
+from rsbackup.generations import (ARCHIVE_SUFFIX, incomplete_generations,
+                                  latest_generation, list_archives,
+                                  list_generations, parse_generation_name)
+
+_PRUNE_SUFFIX = '.prune'
+
+
+def select_generations(names: typing.Iterable[str], keep_daily: int = 0,
+                       keep_weekly: int = 0,
+                       keep_monthly: int = 0) -> typing.Set[str]:
+    """Returns the subset of generation `names` to keep according to the
+    given retention policy. The newest generation is always kept.
+    """
+    names = sorted(names, reverse=True)
+    keep = set(names[:1])
+
+    policies = (
+        (keep_daily, lambda t: t.date()),
+        (keep_weekly, lambda t: t.isocalendar()[:2]),
+        (keep_monthly, lambda t: (t.year, t.month)),
+    )
+
+    for count, bucket_of in policies:
+        buckets = set()
+        for name in names:
+            if len(buckets) >= count:
+                break
+            bucket = bucket_of(parse_generation_name(name))
+            if bucket not in buckets:
+                buckets.add(bucket)
+                keep.add(name)
+
+    return keep
+
+
+def generations_to_prune(target: str, keep_daily: int = 0,
+                         keep_weekly: int = 0,
+                         keep_monthly: int = 0) -> typing.List[str]:
+    """Returns the names of the generations in `target` that are not kept by
+    the retention policy. The generation `_latest` points to is never
+    returned. Incomplete generations are returned except for the newest one,
+    which is resumed by the next backup. Archived generations are subject to
+    the retention policy as well.
+    """
+    names = list_generations(target) + list_archives(target)
+    keep = select_generations(names, keep_daily, keep_weekly, keep_monthly)
+    keep.add(latest_generation(target))
+    stale = incomplete_generations(target)[:-1]
+    return sorted([name for name in names if name not in keep] + stale)
+
+
+def remove_generations(target: str, names: typing.Iterable[str],
+                       workers: typing.Optional[int] = None):
+    """Removes the generations `names` from `target`.
+
+    Every generation is first renamed so that it is no longer recognized as
+    a generation, which keeps an interrupted removal from leaving a partial
+    generation behind. Partially removed generations of earlier runs are
+    removed as well. Archived generations are removed by deleting their
+    archive file.
+    """
+    paths = []
+    for name in names:
+        path = os.path.join(target, name)
+        if not os.path.isdir(path) and os.path.isfile(path + ARCHIVE_SUFFIX):
+            os.remove(path + ARCHIVE_SUFFIX)
+            continue
+        os.rename(path, path + _PRUNE_SUFFIX)
+        paths.append(path + _PRUNE_SUFFIX)
+
+    with os.scandir(target) as it:
+        paths += [e.path for e in it if e.name.endswith(_PRUNE_SUFFIX)
+                  and e.is_dir(follow_symlinks=False)
+                  and e.path not in paths]
+
+    remove_trees(paths, workers)
+
+
+def remove_trees(paths: typing.Sequence[str],
+                 workers: typing.Optional[int] = None):
+    """Removes the directory trees rooted at `paths` using a pool of
+    `workers` threads.
+
+    The trees are processed level by level: all directories of a level are
+    cleared of their files concurrently, then their subdirectories form the
+    next level. Finally the directories are removed from the deepest level
+    upwards.
+    """
+    if not paths:
+        return
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        levels = []
+        level = list(paths)
+        while level:
+            levels.append(level)
+            level = [d for subdirs in executor.map(_clear_dir, level)
+                     for d in subdirs]
+
+        for level in reversed(levels):
+            list(executor.map(os.rmdir, level))
+
+
+def _clear_dir(path: str) -> typing.List[str]:
+    """Unlinks all non-directory entries of `path` and returns the paths of
+    its subdirectories. Missing owner permissions on `path` are added, as
+    generations may contain read-only directories."""
+    mode = os.lstat(path).st_mode
+    if stat.S_IMODE(mode) & stat.S_IRWXU != stat.S_IRWXU:
+        os.chmod(path, stat.S_IMODE(mode) | stat.S_IRWXU)
+
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            else:
+                os.unlink(entry.path)
+    return subdirs
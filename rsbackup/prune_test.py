@@ -0,0 +1,69 @@
+import os
+import stat
+import tempfile
+
+from rsbackup.generations import LATEST, list_generations, mark_incomplete
+from rsbackup.prune import (generations_to_prune, remove_generations,
+                            select_generations)
+
+
+def test_select_generations():
+    names = [
+        '2023-01-30_10-00-00',
+        '2023-02-01_10-00-00',
+        '2023-02-13_10-00-00',
+        '2023-02-14_09-00-00',
+        '2023-02-14_10-00-00',
+        '2023-02-15_10-00-00',
+    ]
+
+    assert select_generations(names) == {'2023-02-15_10-00-00'}
+    assert select_generations(names, keep_daily=2) == {
+        '2023-02-15_10-00-00', '2023-02-14_10-00-00'}
+    assert select_generations(names, keep_weekly=2) == {
+        '2023-02-15_10-00-00', '2023-02-01_10-00-00'}
+    assert select_generations(names, keep_monthly=3) == {
+        '2023-02-15_10-00-00', '2023-01-30_10-00-00'}
+
+
+def test_generations_to_prune_keeps_latest():
+    with tempfile.TemporaryDirectory() as d:
+        for name in ('2023-01-01_10-00-00', '2023-01-02_10-00-00',
+                     '2023-01-03_10-00-00'):
+            os.makedirs(os.path.join(d, name))
+        os.symlink(os.path.join(d, '2023-01-01_10-00-00'),
+                   os.path.join(d, LATEST))
+
+        assert generations_to_prune(d, keep_daily=1) == ['2023-01-02_10-00-00']
+
+
+def test_generations_to_prune_keeps_newest_incomplete():
+    with tempfile.TemporaryDirectory() as d:
+        for name in ('2023-01-01_10-00-00', '2023-01-02_10-00-00',
+                     '2023-01-03_10-00-00', '2023-01-04_10-00-00'):
+            os.makedirs(os.path.join(d, name))
+        mark_incomplete(os.path.join(d, '2023-01-02_10-00-00'))
+        mark_incomplete(os.path.join(d, '2023-01-04_10-00-00'))
+
+        assert list_generations(d) == ['2023-01-01_10-00-00', '2023-01-03_10-00-00']
+        assert generations_to_prune(d, keep_daily=1) == [
+            '2023-01-01_10-00-00', '2023-01-02_10-00-00']
+
+
+def test_remove_generations():
+    with tempfile.TemporaryDirectory() as d:
+        gen = os.path.join(d, '2023-01-01_10-00-00')
+        keep = os.path.join(d, '2023-01-02_10-00-00')
+        os.makedirs(os.path.join(gen, 'src', 'a', 'b'))
+        os.makedirs(keep)
+        with open(os.path.join(keep, 'spam'), 'w') as f:
+            f.write('spam')
+        os.link(os.path.join(keep, 'spam'), os.path.join(gen, 'src', 'a', 'spam'))
+        os.chmod(os.path.join(gen, 'src', 'a'), stat.S_IRUSR | stat.S_IXUSR)
+        os.makedirs(os.path.join(d, '2022-12-31_10-00-00.prune', 'leftover'))
+
+        remove_generations(d, ['2023-01-01_10-00-00'], workers=4)
+
+        assert os.listdir(d) == ['2023-01-02_10-00-00']
+        assert list_generations(d) == ['2023-01-02_10-00-00']
+        assert os.stat(os.path.join(keep, 'spam')).st_nlink == 1
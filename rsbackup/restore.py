@@ -0,0 +1,259 @@
+"""Restores files and directories from a generation.
+
+The tree to restore is walked once to create the directories and to collect
+the files to copy. Files are then copied by a pool of worker threads using
+`os.copy_file_range` (falling back to `os.sendfile` and plain reads and
+writes), so the data is moved by the kernel without passing through user
+space. Sparse files are copied segment by segment using `SEEK_DATA` and
+`SEEK_HOLE` and stay sparse. Files hardlinked to each other within the
+restored tree are copied once and hardlinked at the destination; hardlinks
+to files of other generations are not preserved as they are an artifact of
+how generations are stored.
+"""
+
+import concurrent.futures
+import errno
+import os
+import stat
+import typing
+
+_CHUNK_SIZE = 2**30
+_BUFFER_SIZE = 2**20
+_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.ENOTSUP)
+
+
+class RestoreResult:
+    """The result of restoring a tree.
+
+    `total_bytes` is the size of all files to copy and is known before the
+    first file is copied. `errors` is a list of tuples containing a path and
+    a description of the problem found.
+    """
+
+    def __init__(self):
+        self.dirs = 0
+        self.files = 0
+        self.links = 0
+        self.hardlinks = 0
+        self.bytes = 0
+        self.total_bytes = 0
+        self.errors = []
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+
+def restore_tree(source: str, dest: str,
+                 workers: typing.Optional[int] = None,
+                 on_progress: typing.Optional[typing.Callable[[RestoreResult], None]] = None) -> RestoreResult:
+    """Restores the file or directory `source` to `dest`.
+
+    If `dest` is an existing directory, `source` is restored into it using
+    its base name. Otherwise `source` is restored as `dest`. Existing files
+    are overwritten. Modes, ownership (if permitted) and modification times
+    are preserved.
+
+    Files are copied using `workers` threads. `on_progress` is called from
+    the calling thread with the intermediate result after every finished
+    file.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source.rstrip('/')))
+
+    result = RestoreResult()
+    files = []
+    links = []
+    dirs = []
+    seen = {}
+
+    def restore_entry(src: str, dst: str, st: os.stat_result):
+        if stat.S_ISDIR(st.st_mode):
+            os.makedirs(dst, exist_ok=True)
+            dirs.append((dst, st))
+            result.dirs += 1
+        elif stat.S_ISREG(st.st_mode):
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in seen:
+                    links.append((seen[key], dst))
+                    return
+                seen[key] = dst
+            files.append((src, dst, st))
+            result.total_bytes += st.st_size
+        elif stat.S_ISLNK(st.st_mode):
+            remove_file(dst)
+            os.symlink(os.readlink(src), dst)
+            copy_metadata(dst, st)
+            result.links += 1
+        elif stat.S_ISFIFO(st.st_mode):
+            remove_file(dst)
+            os.mkfifo(dst, stat.S_IMODE(st.st_mode))
+            copy_metadata(dst, st)
+        else:
+            remove_file(dst)
+            os.mknod(dst, st.st_mode, st.st_rdev)
+            copy_metadata(dst, st)
+
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    # Directories are restored before their contents, so they are appended
+    # to `dirs` before any directory below them.
+    stack = [(source, dest, os.lstat(source))]
+    while stack:
+        src, dst, st = stack.pop()
+        try:
+            restore_entry(src, dst, st)
+        except OSError as e:
+            result.errors.append((src, str(e)))
+            continue
+
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                with os.scandir(src) as it:
+                    entries = [(e.path, e.stat(follow_symlinks=False), e.name)
+                               for e in it]
+            except OSError as e:
+                result.errors.append((src, str(e)))
+                continue
+            for path, entry_st, name in entries:
+                stack.append((path, os.path.join(dst, name), entry_st))
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        it = iter(files)
+        while True:
+            for src, dst, st in it:
+                pending[executor.submit(restore_file, src, dst, st)] = (src, st)
+                if len(pending) >= workers * 4:
+                    break
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                src, st = pending.pop(future)
+                try:
+                    future.result()
+                    result.files += 1
+                    result.bytes += st.st_size
+                except OSError as e:
+                    result.errors.append((src, str(e)))
+            if on_progress is not None:
+                on_progress(result)
+
+    for target, dst in links:
+        try:
+            remove_file(dst)
+            os.link(target, dst)
+            result.hardlinks += 1
+        except OSError as e:
+            result.errors.append((dst, str(e)))
+
+    # Directory metadata is applied last, deepest first, as creating entries
+    # changes the modification time and read-only directories could not be
+    # filled.
+    for dst, st in reversed(dirs):
+        try:
+            copy_metadata(dst, st)
+        except OSError as e:
+            result.errors.append((dst, str(e)))
+
+    return result
+
+
+def remove_file(path: str):
+    "Removes the file at `path` if it exists."
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def restore_file(src: str, dst: str, st: os.stat_result):
+    """Copies the regular file `src` described by `st` to `dst`, replacing
+    `dst`, and applies the metadata of `st`. Sparse files stay sparse."""
+    remove_file(dst)
+    with open(src, 'rb', buffering=0) as fsrc, \
+            open(dst, 'wb', buffering=0) as fdst:
+        if st.st_blocks * 512 < st.st_size:
+            _copy_sparse(fsrc.fileno(), fdst.fileno(), st.st_size)
+        else:
+            copy_file(fsrc.fileno(), fdst.fileno(), 0, st.st_size)
+    copy_metadata(dst, st)
+
+
+def _copy_sparse(fd_in: int, fd_out: int, size: int):
+    """Copies only the data segments of the file `fd_in` and leaves holes
+    in `fd_out`."""
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd_in, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break
+                raise
+            end = os.lseek(fd_in, start, os.SEEK_HOLE)
+            copy_file(fd_in, fd_out, start, end - start)
+            offset = end
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRORS:
+            raise
+        # The file system does not support SEEK_DATA; copy everything.
+        copy_file(fd_in, fd_out, offset, size - offset)
+    os.ftruncate(fd_out, size)
+
+
+def copy_file(fd_in: int, fd_out: int, offset: int, count: int):
+    """Copies `count` bytes starting at `offset` from `fd_in` to the same
+    offset of `fd_out` using the fastest mechanism supported."""
+    copied = 0
+    try:
+        while copied < count:
+            n = os.copy_file_range(fd_in, fd_out, min(count - copied, _CHUNK_SIZE),
+                                   offset + copied, offset + copied)
+            if n == 0:
+                return
+            copied += n
+        return
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in _FALLBACK_ERRORS:
+            raise
+
+    os.lseek(fd_out, offset + copied, os.SEEK_SET)
+    try:
+        while copied < count:
+            n = os.sendfile(fd_out, fd_in, offset + copied,
+                            min(count - copied, _CHUNK_SIZE))
+            if n == 0:
+                return
+            copied += n
+        return
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in _FALLBACK_ERRORS:
+            raise
+
+    os.lseek(fd_in, offset + copied, os.SEEK_SET)
+    os.lseek(fd_out, offset + copied, os.SEEK_SET)
+    while copied < count:
+        data = os.read(fd_in, min(count - copied, _BUFFER_SIZE))
+        if not data:
+            return
+        os.write(fd_out, data)
+        copied += len(data)
+
+
+def copy_metadata(path: str, st: os.stat_result):
+    """Applies the owner (if permitted), mode and times described by `st` to
+    `path` without following symlinks."""
+    try:
+        os.chown(path, st.st_uid, st.st_gid, follow_symlinks=False)
+    except PermissionError:
+        pass
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
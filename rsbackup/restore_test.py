@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+
+from rsbackup.restore import copy_file, restore_tree
+
+
+def test_restore_tree(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'gen', 'src')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'sub', 'eggs'), b'eggs' * 100000)
+    os.link(os.path.join(src, 'spam'), os.path.join(src, 'sub', 'ham'))
+    os.symlink('spam', os.path.join(src, 'link'))
+    os.chmod(os.path.join(src, 'sub', 'eggs'), 0o600)
+    os.utime(os.path.join(src, 'sub'), ns=(10**18, 10**18))
+    # A hardlink from outside the restored tree must not be preserved.
+    os.link(os.path.join(src, 'sub', 'eggs'), os.path.join(d, 'gen', 'eggs'))
+
+    dest = os.path.join(d, 'dest')
+    os.makedirs(dest)
+    result = restore_tree(src, dest, workers=2)
+
+    assert result.success
+    assert (result.dirs, result.files, result.links, result.hardlinks) == (2, 2, 1, 1)
+    assert result.bytes == result.total_bytes == 400004
+
+    out = os.path.join(dest, 'src')
+    assert fixture.read(os.path.join(out, 'spam')) == b'spam'
+    assert fixture.read(os.path.join(out, 'sub', 'eggs')) == b'eggs' * 100000
+    assert os.readlink(os.path.join(out, 'link')) == 'spam'
+    assert os.stat(os.path.join(out, 'spam')).st_ino ==\
+        os.stat(os.path.join(out, 'sub', 'ham')).st_ino
+    assert os.stat(os.path.join(out, 'sub', 'eggs')).st_nlink == 1
+    assert os.stat(os.path.join(out, 'sub', 'eggs')).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.join(out, 'sub')).st_mtime_ns == 10**18
+
+
+def test_restore_tree_deep_tree(fixture):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    fixture.write(os.path.join(src, *(['d'] * 200), 'leaf'), b'leaf')
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        result = restore_tree(src, os.path.join(d, 'out'))
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert result.success
+    assert (result.files, result.dirs) == (1, 201)
+    assert fixture.read(os.path.join(d, 'out', *(['d'] * 200), 'leaf')) == b'leaf'
+
+
+def test_restore_tree_single_file(fixture):
+    d = fixture.dir_name
+    fixture.write(os.path.join(d, 'spam'), b'spam')
+
+    result = restore_tree(os.path.join(d, 'spam'), os.path.join(d, 'out', 'eggs'))
+
+    assert result.files == 1
+    assert fixture.read(os.path.join(d, 'out', 'eggs')) == b'spam'
+
+
+def test_restore_tree_keeps_sparse_files_sparse():
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, 'sparse')
+        with open(src, 'wb') as f:
+            f.write(b'head')
+            f.seek(64 * 2**20)
+            f.write(b'tail')
+
+        restore_tree(src, os.path.join(d, 'out'))
+
+        st = os.stat(os.path.join(d, 'out'))
+        assert st.st_size == 64 * 2**20 + 4
+        assert st.st_blocks * 512 <= os.stat(src).st_blocks * 512 + 2**20
+        with open(os.path.join(d, 'out'), 'rb') as f:
+            assert f.read(4) == b'head'
+            f.seek(64 * 2**20)
+            assert f.read() == b'tail'
+
+
+def test_copy_file_range(fixture):
+    d = fixture.dir_name
+    fixture.write(os.path.join(d, 'in'), b'0123456789')
+    with open(os.path.join(d, 'in'), 'rb') as fin, \
+            open(os.path.join(d, 'out'), 'wb') as fout:
+        copy_file(fin.fileno(), fout.fileno(), 2, 5)
+
+    assert fixture.read(os.path.join(d, 'out')) == b'\0\0' + b'23456'
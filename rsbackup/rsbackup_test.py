@@ -1,14 +1,25 @@
 
+import asyncio
+import datetime
 import io
 import os
 import shutil
 import tempfile
 import sys
 
-from rsbackup import RSync
+import pytest
 
-from rsbackup import __version__
+from rsbackup import (Backup, RSync, RSyncProcess, FileDeleted, FileLinked,
+                      FileTransferred, ItemChanged, Message, Progress)
+from rsbackup import _combine_stats, _parse_line, _should_log
+
+from rsbackup import TargetLockedError, __version__, catalog
 from rsbackup.__main__ import main
+from rsbackup.generations import (LATEST, LOG_FILE, STATS_FILE,
+                                  incomplete_generations, latest_generation,
+                                  list_generations, lock_target,
+                                  mark_incomplete, read_last_run)
+from rsbackup.logfile import LogWriter, read_log
 
 
 def test_acceptance_list():
@@ -65,6 +76,18 @@ def test_acceptance_create_multiple_sources():
             '_latest', 'foobar')
 
 
+def test_acceptance_create_parallel():
+    with AcceptanceTestFixture() as fixture:
+        for name in ('spam', 'eggs', 'ham'):
+            os.makedirs(os.path.join(fixture.dir_name, 'src', name))
+            fixture.create_src_file(os.path.join(name, 'data'), name)
+
+        print(fixture.run('create', '--parallel', '2', 'test'))
+        for name in ('spam', 'eggs', 'ham'):
+            assert name == fixture.read_backup_file(
+                '_latest', 'src', name, 'data')
+
+
 class AcceptanceTestFixture:
     def __init__(self):
         self._dir = tempfile.TemporaryDirectory(prefix='rsbackup_test_')
@@ -142,12 +165,272 @@ class FDCollector:
 def test_cmd():
     r = RSync(('/home/alex',), '.', link_dest='../2022-01-01',
               excludes=['.cache', '.local'], binary='rsync')
-    assert r.command == ['rsync', '--archive', '--verbose', '--delete', '/home/alex',
-                         '--link-dest', '../2022-01-01', '--exclude=.cache',
+    assert r.command == ['rsync', '--archive', '--verbose', '--delete',
+                         '--out-format=%i %l %n%L', '--info=progress2', '--stats',
+                         '/home/alex', '--link-dest', '../2022-01-01', '--exclude=.cache',
                          '--exclude=.local', '.']
 
 
 def test_cmd_no_link_dest_no_excludes():
     r = RSync(('/home/alex',), '.', binary='rsync')
     assert r.command == ['rsync', '--archive',
-                         '--verbose', '--delete', '/home/alex', '.']
+                         '--verbose', '--delete', '--out-format=%i %l %n%L',
+                         '--info=progress2', '--stats', '/home/alex', '.']
+
+
+def test_cmd_relative():
+    r = RSync(('/home/./alex/src',), '.', relative=True, itemize=False,
+              progress=False, stats=False, binary='rsync')
+    assert r.command == ['rsync', '--archive', '--verbose', '--delete',
+                         '--relative', '/home/./alex/src', '.']
+
+
+def test_cmd_partial():
+    r = RSync(('/home/alex',), '.', partial=True, itemize=False,
+              progress=False, stats=False, binary='rsync')
+    assert r.command == ['rsync', '--archive', '--verbose', '--delete',
+                         '--partial', '/home/alex', '.']
+
+
+def test_cmd_files_from():
+    r = RSync(('/home/',), '.', delete=False, files_from='/tmp/files',
+              delete_missing_args=True, itemize=False, progress=False,
+              stats=False, binary='rsync')
+    assert r.command == ['rsync', '--archive', '--verbose',
+                         '--files-from=/tmp/files', '--from0',
+                         '--delete-missing-args',
+                         '/home/', '.']
+
+
+def test_parse_line():
+    assert _parse_line('>f+++++++++ 1234 src/spam') ==\
+        FileTransferred('src/spam', 1234, '>f+++++++++')
+    assert _parse_line('hf+++++++++ 12 src/eggs => src/spam') ==\
+        FileLinked('src/eggs', 12, 'hf+++++++++', 'src/spam')
+    assert _parse_line('cL+++++++++ 0 src/link -> spam') ==\
+        ItemChanged('src/link', 'cL+++++++++')
+    assert _parse_line('*deleting   0 src/old') == FileDeleted('src/old')
+    assert _parse_line('     1,234,567  45%   12.50MB/s    0:01:05 (xfr#12, to-chk=10/200)') ==\
+        Progress(1234567, 45, 12.5 * 2**20, datetime.timedelta(minutes=1, seconds=5))
+    assert _parse_line('sending incremental file list') ==\
+        Message('sending incremental file list')
+
+
+def test_should_log():
+    transferred = FileTransferred('spam', 1, '>f+++++++++')
+    linked = FileLinked('spam', 1, 'hf+++++++++')
+    dir_time = ItemChanged('src/', '.d..t......')
+    message = Message('rsync error: some files could not be transferred')
+    progress = Progress(1, 1, 1.0, datetime.timedelta())
+
+    events = [transferred, linked, dir_time, message, progress]
+    assert [e for e in events if _should_log(e, 'full')] ==\
+        [transferred, linked, dir_time, message]
+    assert [e for e in events if _should_log(e, 'changes')] ==\
+        [transferred, message]
+    assert [e for e in events if _should_log(e, 'summary')] == [message]
+
+
+def test_rsync_process_events():
+    class Log:
+        def __init__(self):
+            self.out = ''
+
+        async def write(self, s):
+            self.out += s
+
+    async def run():
+        log = Log()
+        p = await asyncio.create_subprocess_exec(
+            sys.executable, '-c',
+            "import sys; sys.stdout.buffer.write("
+            "b'>f+++++++++ 3 caf\\\\#303\\\\#251\\n  10 100%  1.00kB/s  0:00:00\\r'"
+            " + b'x' * 2**17 + b'\\n')",
+            stdout=asyncio.subprocess.PIPE)
+        process = RSyncProcess(p, log)
+        events = [e async for e in process]
+        return events, await process.wait(), log.out
+
+    events, exit_code, log = asyncio.run(run())
+
+    assert exit_code == 0
+    assert events == [
+        FileTransferred('caf\u00e9', 3, '>f+++++++++'),
+        Progress(10, 100, 1024.0, datetime.timedelta()),
+        Message('x' * 2**17),
+    ]
+    assert log == '>f+++++++++ 3 caf\u00e9\n' + 'x' * 2**17 + '\n'
+
+
+def test_rsync_process_stats():
+    output = '\n'.join([
+        'Number of files: 1,234 (reg: 1,000, dir: 234)',
+        'Number of regular files transferred: 12',
+        'Total file size: 98,765,432 bytes',
+        'Total transferred file size: 1,024 bytes',
+        'File list generation time: 0.123 seconds',
+        'Total bytes sent: 2,048',
+        'sent 2,048 bytes  received 64 bytes  4,224.00 bytes/sec',
+        'total size is 98,765,432  speedup is 46,763.94',
+    ])
+
+    async def run():
+        p = await asyncio.create_subprocess_exec(
+            sys.executable, '-c', f"print({output!r})",
+            stdout=asyncio.subprocess.PIPE)
+        process = RSyncProcess(p)
+        await process.wait()
+        return process.stats
+
+    assert asyncio.run(run()) == {
+        'number_of_files': 1234,
+        'number_of_regular_files_transferred': 12,
+        'total_file_size': 98765432,
+        'total_transferred_file_size': 1024,
+        'file_list_generation_time': 0.123,
+        'total_bytes_sent': 2048,
+        'speedup': 46763.94,
+    }
+
+
+def test_combine_stats():
+    assert _combine_stats([{'number_of_files': 3, 'file_list_generation_time': 1.5,
+                            'total_file_size': 100, 'total_bytes_sent': 10,
+                            'speedup': 10.0},
+                           {'number_of_files': 2, 'file_list_generation_time': 0.5,
+                            'total_file_size': 100, 'total_bytes_sent': 30,
+                            'speedup': 3.3}]) == {
+        'number_of_files': 5, 'file_list_generation_time': 1.5,
+        'total_file_size': 200, 'total_bytes_sent': 40, 'speedup': 5.0}
+
+
+def test_cmd_multiple_link_dests():
+    r = RSync(('/home/alex',), '.', link_dest=['/bak/2', '/bak/1'],
+              itemize=False, progress=False, stats=False, binary='rsync')
+    assert r.command == ['rsync', '--archive', '--verbose', '--delete', '/home/alex',
+                         '--link-dest', '/bak/2', '--link-dest', '/bak/1', '.']
+
+
+def test_cmd_too_many_link_dests():
+    with pytest.raises(ValueError):
+        RSync(('/home/alex',), '.', link_dest=[str(i) for i in range(21)],
+              binary='rsync')
+
+
+def test_link_dests():
+    with tempfile.TemporaryDirectory() as d:
+        names = ['2023-01-01_10-00-00', '2023-01-02_10-00-00',
+                 '2023-01-03_10-00-00', '2023-01-04_10-00-00']
+        for name in names:
+            os.makedirs(os.path.join(d, name))
+
+        backup = Backup(['/src'], d, link_generations=3)
+        assert backup._link_dests(os.path.join(d, names[2])) == [
+            os.path.join(d, names[2]), os.path.join(d, names[3]),
+            os.path.join(d, names[1])]
+        assert Backup(['/src'], d)._link_dests(os.path.join(d, names[2])) == [
+            os.path.join(d, names[2])]
+
+
+def test_cmd_limits():
+    r = RSync(('/home/alex',), '.', itemize=False, progress=False, stats=False,
+              bwlimit='10M', nice=10, ionice_class=2, ionice_level=7,
+              binary='rsync')
+    assert r.command == ['nice', '-n', '10', 'ionice', '-c', '2', '-n', '7',
+                         'rsync', '--archive', '--verbose', '--delete',
+                         '--bwlimit=10M', '/home/alex', '.']
+
+
+def test_cmd_filter_file():
+    r = RSync(('/home/alex',), '.', filter_file='/tmp/rules', itemize=False,
+              progress=False, stats=False, binary='rsync')
+    assert r.command == ['rsync', '--archive', '--verbose', '--delete',
+                         '/home/alex', '--filter=merge /tmp/rules', '.']
+
+
+def test_backup_resumes_incomplete_generation(fixture, logger):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    bak = os.path.join(d, 'bak')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    fixture.write(os.path.join(src, 'eggs'), b'eggs')
+
+    name = '2023-01-01_10-00-00'
+    incomplete = os.path.join(bak, name)
+    fixture.write(os.path.join(incomplete, 'src', 'spam'), b'spam')
+    mark_incomplete(incomplete)
+
+    async def write_log():
+        async with LogWriter(os.path.join(incomplete, LOG_FILE)) as log:
+            await log.write('interrupted run\n')
+
+    asyncio.run(write_log())
+    start = datetime.datetime(2023, 1, 1, 10, 0, 0)
+    catalog.record(bak, catalog.CatalogEntry(
+        name, start, start, False, 'interrupted', None, None, []))
+
+    result = asyncio.run(Backup([src], bak, engine='native').run(logger=logger))
+
+    assert result.success
+    assert result.resumed == name
+    assert not os.path.exists(incomplete)
+    assert incomplete_generations(bak) == []
+    assert list_generations(bak) == [os.path.basename(result.generation)]
+    assert latest_generation(bak) == os.path.basename(result.generation)
+    assert fixture.read(os.path.join(bak, LATEST, 'src', 'eggs')) == b'eggs'
+    assert b''.join(read_log(result.generation)).startswith(b'interrupted run\n')
+    assert [(e.name, e.success) for e in catalog.list_catalog(bak)] == [
+        (os.path.basename(result.generation), True)]
+
+
+def test_backup_fails_if_target_is_locked(fixture, logger):
+    d = fixture.dir_name
+    src = os.path.join(d, 'src')
+    bak = os.path.join(d, 'bak')
+    fixture.write(os.path.join(src, 'spam'), b'spam')
+    backup = Backup([src], bak, engine='native', keep_daily=1,
+                    archive_after=1)
+
+    with lock_target(bak):
+        with pytest.raises(TargetLockedError):
+            asyncio.run(backup.run(logger=logger))
+        with pytest.raises(TargetLockedError):
+            asyncio.run(backup.prune(logger=logger))
+        with pytest.raises(TargetLockedError):
+            asyncio.run(backup.archive(logger=logger))
+        assert read_last_run(bak) is None
+        assert asyncio.run(backup.run(logger=logger, dry_mode=True)).success
+
+    assert asyncio.run(backup.run(logger=logger)).success
+
+
+class BlockingBackup(Backup):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = asyncio.Event()
+
+    async def _run(self, result, logger, *args, **kwargs):
+        result.generation = os.path.join(self.target, '2023-01-01_10-00-00')
+        os.makedirs(result.generation)
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def test_backup_records_cancelled_run(fixture, logger):
+    bak = os.path.join(fixture.dir_name, 'bak')
+    backup = BlockingBackup([os.path.join(fixture.dir_name, 'src')], bak)
+
+    async def run():
+        task = asyncio.create_task(backup.run(logger=logger))
+        await backup.started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    last_run = read_last_run(bak)
+    assert (last_run['success'], last_run['error']) == (False, 'cancelled')
+    assert [(e.name, e.success) for e in catalog.list_catalog(bak)] == [
+        ('2023-01-01_10-00-00', False)]
+    assert not os.path.exists(os.path.join(bak, '2023-01-01_10-00-00', STATS_FILE))
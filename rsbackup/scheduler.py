@@ -0,0 +1,149 @@
+"""Runs several backup configurations concurrently.
+
+Backups which read from or write to the same device are serialized because
+running them in parallel would only make the disk heads seek between them.
+Backups that share no device run in parallel up to a global cap.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import os
+import typing
+
+from rsbackup import Backup, LoggingProtocol
+
+
+class BackupOutcome:
+    """The outcome of running a single named backup configuration.
+
+    `error` is `None` if the backup succeeded and contains the raised
+    exception otherwise.
+    """
+
+    def __init__(self, name: str, start: datetime.datetime,
+                 end: datetime.datetime,
+                 error: typing.Optional[BaseException] = None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.error = error
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        return self.end - self.start
+
+
+def device_of(path: str) -> typing.Hashable:
+    """Returns a key identifying the device `path` resides on.
+
+    If `path` does not exist, the nearest existing parent directory is used.
+    On Linux, partitions are mapped to the block device they belong to, so
+    that two file systems on the same disk are reported as the same device.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    dev = os.stat(path).st_dev
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(sys_path):
+        return dev
+
+    sys_path = os.path.realpath(sys_path)
+    if os.path.exists(os.path.join(sys_path, 'partition')):
+        sys_path = os.path.dirname(sys_path)
+
+    return os.path.basename(sys_path)
+
+
+def devices_of(backup: Backup) -> typing.FrozenSet[typing.Hashable]:
+    "Returns the set of devices `backup` reads from or writes to."
+    return frozenset(device_of(p) for p in list(backup.sources) + [backup.target])
+
+
+class DeviceScheduler:
+    """Grants slots to run backups in.
+
+    A slot for a set of devices is granted as soon as none of the devices is
+    in use by another slot and less than `jobs` slots are in use. If `jobs`
+    is `None` only device contention limits parallelism.
+    """
+
+    def __init__(self, jobs: typing.Optional[int] = None):
+        if jobs is not None and jobs < 1:
+            raise ValueError(f"jobs must be at least 1, not {jobs}")
+        self.jobs = jobs
+        self._condition = asyncio.Condition()
+        self._busy = set()
+        self._running = 0
+
+    def _can_start(self, devices) -> bool:
+        return (self.jobs is None or self._running < self.jobs) and\
+            self._busy.isdisjoint(devices)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, devices: typing.FrozenSet[typing.Hashable]):
+        "Waits for and holds a slot for `devices`."
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._can_start(devices))
+            self._busy.update(devices)
+            self._running += 1
+
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._busy.difference_update(devices)
+                self._running -= 1
+                self._condition.notify_all()
+
+
+async def run_backups(
+        backups: typing.Mapping[str, Backup],
+        logger_factory: typing.Callable[[str], LoggingProtocol],
+        jobs: typing.Optional[int] = None,
+        **kwargs) -> typing.List[BackupOutcome]:
+    """Runs all `backups` and returns a list of outcomes in the same order.
+
+    `backups` maps configuration names to `Backup` instances.
+
+    `logger_factory` is called with a configuration name and must return the
+    `LoggingProtocol` to pass to that backup's `run` method.
+
+    `jobs` limits the number of backups running at the same time. If `None`
+    only device contention limits parallelism.
+
+    All other keyword args are passed to `Backup.run`.
+
+    A backup is started as soon as none of its devices is in use by a running
+    backup and less than `jobs` backups are running. A failing backup does
+    not affect the others.
+    """
+    scheduler = DeviceScheduler(jobs)
+
+    async def run(name: str, backup: Backup) -> BackupOutcome:
+        try:
+            devices = devices_of(backup)
+        except OSError as e:
+            now = datetime.datetime.now()
+            return BackupOutcome(name, now, now, e)
+
+        async with scheduler.slot(devices):
+            start = datetime.datetime.now()
+            error = None
+            try:
+                await backup.run(logger=logger_factory(name), **kwargs)
+            except Exception as e:
+                error = e
+
+        return BackupOutcome(name, start, datetime.datetime.now(), error)
+
+    return await asyncio.gather(*(run(name, backup) for name, backup in backups.items()))
@@ -0,0 +1,77 @@
+import asyncio
+import tempfile
+
+import pytest
+
+from rsbackup import Backup
+from rsbackup import scheduler
+from rsbackup.scheduler import DeviceScheduler, run_backups
+
+
+class RecordingBackup(Backup):
+    def __init__(self, target, tracker, fail=False):
+        super().__init__(sources=[target], target=target)
+        self._tracker = tracker
+        self._fail = fail
+
+    async def run(self, logger=None, **kwargs):
+        self._tracker.enter()
+        await asyncio.sleep(0.01)
+        self._tracker.exit()
+        if self._fail:
+            raise ValueError('failed')
+
+
+class ConcurrencyTracker:
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+
+    def enter(self):
+        self.current += 1
+        self.max = max(self.max, self.current)
+
+    def exit(self):
+        self.current -= 1
+
+
+def test_run_backups_serializes_backups_on_same_device():
+    tracker = ConcurrencyTracker()
+    with tempfile.TemporaryDirectory() as d:
+        outcomes = asyncio.run(run_backups(
+            {'a': RecordingBackup(d, tracker), 'b': RecordingBackup(d, tracker)},
+            logger_factory=lambda name: None))
+
+    assert tracker.max == 1
+    assert [o.name for o in outcomes] == ['a', 'b']
+    assert all(o.success for o in outcomes)
+
+
+def test_run_backups_runs_backups_on_different_devices_in_parallel(monkeypatch):
+    monkeypatch.setattr(scheduler, 'devices_of',
+                        lambda backup: frozenset((backup.target,)))
+    tracker = ConcurrencyTracker()
+    outcomes = asyncio.run(run_backups(
+        {name: RecordingBackup(name, tracker) for name in 'abcd'},
+        logger_factory=lambda name: None, jobs=3))
+
+    assert tracker.max == 3
+    assert len(outcomes) == 4
+
+
+def test_run_backups_reports_failures():
+    tracker = ConcurrencyTracker()
+    with tempfile.TemporaryDirectory() as d:
+        outcomes = asyncio.run(run_backups(
+            {'a': RecordingBackup(d, tracker, fail=True),
+             'b': RecordingBackup(d, tracker)},
+            logger_factory=lambda name: None))
+
+    assert not outcomes[0].success
+    assert str(outcomes[0].error) == 'failed'
+    assert outcomes[1].success
+
+
+def test_device_scheduler_requires_a_job():
+    with pytest.raises(ValueError):
+        DeviceScheduler(0)
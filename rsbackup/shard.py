@@ -0,0 +1,78 @@
+"""Splits the sources of a backup into shards that can be transferred by
+parallel rsync processes.
+
+Shards contain source paths in the form understood by rsync's `--relative`
+option, i.e. `/parent/./name/child`. This makes every shard produce the same
+directory layout inside the target a single rsync run over all sources would
+produce.
+"""
+
+import concurrent.futures
+import heapq
+import os
+import typing
+
+
+def shard_sources(sources: typing.Sequence[str],
+                  count: int) -> typing.List[typing.List[str]]:
+    """Splits `sources` into at most `count` non-empty shards.
+
+    Each source directory is split into its top-level entries. The entries are
+    weighted by the apparent size of their contents and assigned to shards
+    so that all shards transfer roughly the same amount of data. Sources that
+    are not directories are kept as a whole.
+    """
+    entries = []
+    for source in sources:
+        parent, name = os.path.split(source)
+        if os.path.isdir(source) and not os.path.islink(source):
+            with os.scandir(source) as it:
+                children = [os.path.join(parent, '.', name, c.name) for c in it]
+            entries += children or [os.path.join(parent, '.', name)]
+        else:
+            entries.append(os.path.join(parent, '.', name))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        weights = list(executor.map(tree_size, entries))
+
+    shards = [(0, i, []) for i in range(min(count, len(entries)))]
+    for weight, entry in sorted(zip(weights, entries), reverse=True):
+        total, i, shard = heapq.heappop(shards)
+        shard.append(entry)
+        heapq.heappush(shards, (total + weight, i, shard))
+
+    return [shard for _, _, shard in sorted(shards, key=lambda s: s[1]) if shard]
+
+
+def tree_size(path: str) -> int:
+    """Returns the apparent size of all files below `path` in bytes. Symbolic
+    links are not followed and errors are silently ignored. Every entry
+    counts with at least one byte so that trees of empty files still get a
+    weight.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return max(st.st_size, 1)
+
+    total = 1
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            total += 1
+                        else:
+                            total += max(entry.stat(follow_symlinks=False).st_size, 1)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    return total
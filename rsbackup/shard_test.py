@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+from rsbackup.shard import shard_sources
+
+
+def test_shard_sources_balances_by_size():
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, 'src')
+        for name, size in (('a', 800), ('b', 500), ('c', 300), ('d', 200)):
+            os.makedirs(os.path.join(src, name))
+            with open(os.path.join(src, name, 'data'), 'wb') as f:
+                f.write(b'x' * size)
+
+        shards = shard_sources([src], 2)
+
+        assert sorted(map(sorted, shards)) == [
+            [os.path.join(d, '.', 'src', 'a'), os.path.join(d, '.', 'src', 'd')],
+            [os.path.join(d, '.', 'src', 'b'), os.path.join(d, '.', 'src', 'c')],
+        ]
+
+
+def test_shard_sources_keeps_files_and_empty_dirs():
+    with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, 'empty'))
+        with open(os.path.join(d, 'file'), 'w') as f:
+            f.write('spam')
+
+        shards = shard_sources(
+            [os.path.join(d, 'empty'), os.path.join(d, 'file')], 4)
+
+        assert sorted(e for s in shards for e in s) == [
+            os.path.join(d, '.', 'empty'), os.path.join(d, '.', 'file')]
+        assert len(shards) == 2
@@ -0,0 +1,276 @@
+"""Adaptive throttling of running backups.
+
+While rsync runs, a `Throttle` periodically samples the system load from
+`/proc/loadavg` and the utilization of the disks involved in the backup from
+`/proc/diskstats`. When either crosses its threshold, all rsync processes
+are stopped using `SIGSTOP` and continued using `SIGCONT` once the machine
+has calmed down, so a backup only uses resources nobody else needs.
+
+The backup's own share is subtracted from both values, so rsync does not
+pause itself: its processes and threads are sampled from `/proc/<pid>` like
+the kernel samples the load, and the bytes they read and wrote, taken from
+`/proc/<pid>/io`, are attributed to the disks in proportion to the bytes
+transferred by each disk.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+import typing
+
+from rsbackup import LoggingProtocol, RSyncProcess
+
+_LOADAVG = '/proc/loadavg'
+_DISKSTATS = '/proc/diskstats'
+_PROC = '/proc'
+_SECTORS_READ_FIELD = 5
+_SECTORS_WRITTEN_FIELD = 9
+_IO_TICKS_FIELD = 12
+_SECTOR_SIZE = 512
+_LOAD_PERIOD = 60.0
+"Time constant of the one minute load average in seconds."
+
+
+def read_load(path: str = _LOADAVG) -> float:
+    "Returns the system load averaged over the last minute."
+    with open(path) as f:
+        return float(f.read().split()[0])
+
+
+class DiskSample(typing.NamedTuple):
+    "Cumulative statistics of a block device."
+    io_ticks: int
+    "Milliseconds the device has spent doing I/O."
+    read_bytes: int
+    written_bytes: int
+
+
+def read_disk_stats(path: str = _DISKSTATS) -> typing.Dict[str, DiskSample]:
+    "Returns a dict mapping block device names to their statistics."
+    stats = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > _IO_TICKS_FIELD:
+                stats[fields[2]] = DiskSample(
+                    int(fields[_IO_TICKS_FIELD]),
+                    int(fields[_SECTORS_READ_FIELD]) * _SECTOR_SIZE,
+                    int(fields[_SECTORS_WRITTEN_FIELD]) * _SECTOR_SIZE)
+    return stats
+
+
+class ProcessSample(typing.NamedTuple):
+    """A sample of a group of processes including their descendants.
+
+    `active` is the number of their threads running or waiting for I/O,
+    which is what the kernel counts for the load average. `io` maps the
+    process ids to the cumulative number of bytes read from and written to
+    storage by the process."""
+    active: int
+    io: typing.Dict[int, typing.Tuple[int, int]]
+
+
+def sample_processes(pids: typing.Iterable[int], proc: str = _PROC) -> ProcessSample:
+    """Samples the processes `pids` and all their descendants from `proc`.
+    Processes that exited or cannot be read are skipped. The calling thread
+    is not counted as active."""
+    children = {}
+    for name in os.listdir(proc):
+        if name.isdigit():
+            try:
+                with open(os.path.join(proc, name, 'stat')) as f:
+                    ppid = int(f.read().rpartition(')')[2].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(name))
+
+    current = threading.get_native_id()
+    active = 0
+    io = {}
+    stack = list(set(pids))
+    while stack:
+        pid = stack.pop()
+        if pid in io:
+            continue
+        stack += children.get(pid, [])
+        try:
+            io[pid] = _read_io(os.path.join(proc, str(pid), 'io'))
+            tasks = os.listdir(os.path.join(proc, str(pid), 'task'))
+        except OSError:
+            io.pop(pid, None)
+            continue
+        for task in tasks:
+            if int(task) == current:
+                continue
+            try:
+                with open(os.path.join(proc, str(pid), 'task', task, 'stat')) as f:
+                    state = f.read().rpartition(')')[2].split()[0]
+            except (OSError, IndexError):
+                continue
+            if state in ('R', 'D'):
+                active += 1
+    return ProcessSample(active, io)
+
+
+def _read_io(path: str) -> typing.Tuple[int, int]:
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            values[key] = int(value)
+    return values['read_bytes'], values['write_bytes']
+
+
+def io_delta(before: ProcessSample, after: ProcessSample) -> typing.Tuple[int, int]:
+    """Returns the bytes read and written by the processes between the two
+    samples. Processes missing from `before` are counted from their start;
+    processes that exited in between are not counted."""
+    read = written = 0
+    for pid, (r, w) in after.io.items():
+        r0, w0 = before.io.get(pid, (0, 0))
+        read += max(0, r - r0)
+        written += max(0, w - w0)
+    return read, written
+
+
+def disk_utilization(before: typing.Mapping[str, DiskSample],
+                     after: typing.Mapping[str, DiskSample],
+                     elapsed: float,
+                     devices: typing.Iterable[str],
+                     own: typing.Tuple[int, int] = (0, 0)) -> float:
+    """Returns the highest utilization in percent of any of `devices`
+    between the two samples `before` and `after` taken `elapsed` seconds
+    apart. Devices missing from either sample are ignored.
+
+    `own` holds the bytes read and written by the backup in between. They
+    are attributed to `devices` in proportion to the bytes each device read
+    and wrote, and the share of the utilization they caused is not
+    counted."""
+    if elapsed <= 0:
+        return 0.0
+
+    deltas = {}
+    for device in devices:
+        if device in before and device in after:
+            b, a = before[device], after[device]
+            deltas[device] = (a.io_ticks - b.io_ticks, a.read_bytes - b.read_bytes,
+                              a.written_bytes - b.written_bytes)
+    total_read = sum(read for _, read, _ in deltas.values())
+    total_written = sum(written for _, _, written in deltas.values())
+
+    utilization = 0.0
+    for ticks, read, written in deltas.values():
+        busy = ticks / 1000
+        if read + written > 0:
+            mine = (own[0] * read / total_read if read else 0) +\
+                (own[1] * written / total_written if written else 0)
+            busy *= 1 - min(1.0, mine / (read + written))
+        utilization = max(utilization, min(100.0, busy / elapsed * 100))
+    return utilization
+
+
+class Throttle:
+    """Pauses running rsync processes while the system is busy.
+
+    The processes are paused as soon as the load caused by others exceeds
+    `max_load` or the utilization of any of `devices` by others exceeds
+    `max_disk_util` percent. They are
+    resumed once both values dropped below `resume_ratio` times their
+    threshold. A threshold of `None` disables the corresponding check.
+
+    The system is sampled every `interval` seconds.
+    """
+
+    def __init__(self, max_load: typing.Optional[float] = None,
+                 max_disk_util: typing.Optional[float] = None,
+                 devices: typing.Iterable[str] = (),
+                 interval: float = 5.0,
+                 resume_ratio: float = 0.8):
+        self.max_load = max_load
+        self.max_disk_util = max_disk_util
+        self.devices = frozenset(devices)
+        self.interval = interval
+        self.resume_ratio = resume_ratio
+        self.paused = False
+        self.paused_seconds = 0.0
+
+    def update(self, load: float, disk_util: float) -> typing.Optional[bool]:
+        """Updates the state from a sample of the system load and disk
+        utilization. Returns `True` if the processes should be paused,
+        `False` if they should be resumed and `None` if nothing changes."""
+        if self.paused:
+            ratio = self.resume_ratio
+            if not self._exceeds(load, disk_util, ratio):
+                self.paused = False
+                return False
+        elif self._exceeds(load, disk_util, 1.0):
+            self.paused = True
+            return True
+        return None
+
+    def _exceeds(self, load: float, disk_util: float, ratio: float) -> bool:
+        if self.max_load is not None and load >= self.max_load * ratio:
+            return True
+        if self.max_disk_util is not None and disk_util >= self.max_disk_util * ratio:
+            return True
+        return False
+
+    async def watch(self, processes: typing.Sequence[RSyncProcess],
+                    logger: LoggingProtocol):
+        """Samples the system until cancelled and pauses or resumes all
+        `processes`. Processes may be added to `processes` while watching.
+        All processes are resumed when cancelled.
+
+        The load and disk utilization caused by `processes` themselves is
+        subtracted before comparing with the thresholds."""
+        disks = read_disk_stats() if self.max_disk_util is not None else {}
+        own = sample_processes(p.pid for p in processes)
+        own_load = 0.0
+        sampled = time.monotonic()
+        paused_at = None
+
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+
+                now = time.monotonic()
+                current_own = sample_processes(p.pid for p in processes)
+                # Smooth the own load like the kernel's one minute average.
+                decay = math.exp(-(now - sampled) / _LOAD_PERIOD)
+                own_load = own_load * decay + current_own.active * (1 - decay)
+                load = max(0.0, read_load() - own_load)\
+                    if self.max_load is not None else 0.0
+                disk_util = 0.0
+                if self.max_disk_util is not None:
+                    current = read_disk_stats()
+                    disk_util = disk_utilization(disks, current, now - sampled,
+                                                 self.devices,
+                                                 io_delta(own, current_own))
+                    disks = current
+                own = current_own
+                sampled = now
+
+                change = self.update(load, disk_util)
+                if change is True:
+                    paused_at = now
+                    await logger.warn(
+                        f"System busy (load {load:.2f}, disk {disk_util:.0f}%); pausing rsync")
+                elif change is False:
+                    self.paused_seconds += now - paused_at
+                    paused_at = None
+                    await logger.info('System idle again; resuming rsync')
+                    for process in processes:
+                        process.resume()
+
+                if self.paused:
+                    # Processes started while paused are paused as well.
+                    for process in processes:
+                        process.pause()
+        finally:
+            self.paused = False
+            if paused_at is not None:
+                self.paused_seconds += time.monotonic() - paused_at
+            for process in processes:
+                process.resume()
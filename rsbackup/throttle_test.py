@@ -0,0 +1,126 @@
+import asyncio
+import os
+import tempfile
+
+from rsbackup.throttle import (DiskSample, ProcessSample, Throttle,
+                               disk_utilization, io_delta, read_disk_stats,
+                               read_load, sample_processes)
+
+
+def test_read_load():
+    with tempfile.NamedTemporaryFile('w') as f:
+        f.write('1.52 0.98 0.50 2/345 12345\n')
+        f.flush()
+        assert read_load(f.name) == 1.52
+
+
+def test_read_disk_stats():
+    with tempfile.NamedTemporaryFile('w') as f:
+        f.write('   8       0 sda 100 0 800 50 200 0 1600 70 0 1234 120 0 0 0 0\n'
+                '   8       1 sda1 90 0 700 40 190 0 1500 60 0 1000 100 0 0 0 0\n')
+        f.flush()
+        assert read_disk_stats(f.name) == {
+            'sda': DiskSample(1234, 800 * 512, 1600 * 512),
+            'sda1': DiskSample(1000, 700 * 512, 1500 * 512),
+        }
+
+
+def _process(proc, pid, ppid, states, read_bytes=0, write_bytes=0):
+    os.makedirs(os.path.join(proc, str(pid)))
+    with open(os.path.join(proc, str(pid), 'stat'), 'w') as f:
+        f.write(f'{pid} (rsync (x)) S {ppid} 1 1 0\n')
+    with open(os.path.join(proc, str(pid), 'io'), 'w') as f:
+        f.write(f'rchar: 1\nread_bytes: {read_bytes}\nwrite_bytes: {write_bytes}\n')
+    for i, state in enumerate(states):
+        task = os.path.join(proc, str(pid), 'task', str(pid * 10 + i))
+        os.makedirs(task)
+        with open(os.path.join(task, 'stat'), 'w') as f:
+            f.write(f'{pid} (rsync (x)) {state} {ppid} 1 1 0\n')
+
+
+def test_sample_processes():
+    with tempfile.TemporaryDirectory() as proc:
+        _process(proc, 100, 1, ['R'], 1000, 10)
+        _process(proc, 101, 100, ['D', 'S'], 2000, 20)
+        _process(proc, 102, 101, ['T'])
+        _process(proc, 200, 1, ['R', 'R'], 5000, 50)
+
+        sample = sample_processes([100], proc)
+
+        assert sample == ProcessSample(2, {100: (1000, 10), 101: (2000, 20),
+                                           102: (0, 0)})
+        assert sample_processes([], proc) == ProcessSample(0, {})
+
+
+def test_io_delta():
+    before = ProcessSample(1, {100: (1000, 10), 101: (2000, 20)})
+    after = ProcessSample(1, {100: (1500, 30), 102: (100, 1)})
+
+    assert io_delta(before, after) == (600, 21)
+
+
+def test_disk_utilization():
+    before = {'sda': DiskSample(1000, 0, 0), 'sdb': DiskSample(0, 0, 0)}
+    after = {'sda': DiskSample(3500, 0, 0), 'sdb': DiskSample(9000, 0, 0),
+             'sdc': DiskSample(100, 0, 0)}
+
+    assert disk_utilization(before, after, 5, ['sda']) == 50
+    assert disk_utilization(before, after, 5, ['sda', 'sdb']) == 100
+    assert disk_utilization(before, after, 5, ['sdc']) == 0
+    assert disk_utilization(before, after, 0, ['sda']) == 0
+
+
+def test_disk_utilization_without_own_io():
+    before = {'sda': DiskSample(0, 0, 0), 'sdb': DiskSample(0, 0, 0)}
+    after = {'sda': DiskSample(4000, 4000, 0), 'sdb': DiskSample(4000, 0, 4000)}
+
+    # The backup read 3000 bytes from sda and wrote 4000 bytes to sdb.
+    assert disk_utilization(before, after, 5, ['sda', 'sdb'], (3000, 4000)) == 20
+    assert disk_utilization(before, after, 5, ['sdb'], (3000, 4000)) == 0
+    assert disk_utilization(before, after, 5, ['sda', 'sdb']) == 80
+
+
+def test_throttle_update():
+    throttle = Throttle(max_load=4, max_disk_util=90)
+
+    assert throttle.update(1, 10) is None
+    assert throttle.update(4.5, 10) is True
+    assert throttle.paused
+    assert throttle.update(3.5, 10) is None
+    assert throttle.update(3, 95) is None
+    assert throttle.update(3, 50) is False
+    assert not throttle.paused
+    assert throttle.update(1, 90) is True
+
+
+class FakeProcess:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.signals = []
+
+    def pause(self):
+        self.signals.append('pause')
+
+    def resume(self):
+        self.signals.append('resume')
+
+
+def test_throttle_watch_pauses_and_resumes_on_cancel(logger):
+    process = FakeProcess()
+    throttle = Throttle(max_load=0, interval=0.01)
+
+    async def run():
+        task = asyncio.create_task(throttle.watch([process], logger))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+
+    assert process.signals[0] == 'pause'
+    assert process.signals[-1] == 'resume'
+    assert not throttle.paused
+    assert throttle.paused_seconds > 0
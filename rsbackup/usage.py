@@ -0,0 +1,125 @@
+"""Hardlink aware space accounting for the generations of a backup.
+
+Unchanged files are hardlinked between generations, so the size of a
+generation says nothing about the space it occupies. This module maintains
+an index stored in the target that maps every inode of a regular file to
+its size, the first and last generation containing it and the number of
+generations containing it. From this index the bytes each generation added
+and the bytes only it references (i.e. the space removing it would free)
+are computed.
+
+The index is updated incrementally: only generations not yet contained in
+the index are read, preferably from their manifest. If a generation has been
+removed since the index was updated, the index is rebuilt.
+"""
+
+import os
+import sqlite3
+import stat
+import typing
+
+from rsbackup.generations import list_generations
+from rsbackup.manifest import ManifestEntry, read_manifest, walk_generation
+
+INDEX_FILE = '.usage'
+"Name of the index file stored in the target directory."
+
+
+class GenerationUsage(typing.NamedTuple):
+    """Space accounting for a single generation.
+
+    `total` is the size of all distinct files referenced by the generation,
+    `added` the size of files first seen in this generation, `exclusive`
+    the size of files referenced by no other generation and `shared` the
+    size of files also referenced by other generations.
+    """
+    name: str
+    files: int
+    total: int
+    added: int
+    exclusive: int
+
+    @property
+    def shared(self) -> int:
+        return self.total - self.exclusive
+
+
+def _entries(generation_dir: str) -> typing.Iterable[ManifestEntry]:
+    entries = read_manifest(generation_dir)
+    return entries if entries is not None else walk_generation(generation_dir)
+
+
+def _open_index(target: str) -> sqlite3.Connection:
+    db = sqlite3.connect(os.path.join(target, INDEX_FILE))
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS generations (
+            name TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            total INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS inodes (
+            inode INTEGER PRIMARY KEY,
+            size INTEGER NOT NULL,
+            first TEXT NOT NULL,
+            last TEXT NOT NULL,
+            count INTEGER NOT NULL
+        );
+    ''')
+    return db
+
+
+def update_index(target: str,
+                 on_generation: typing.Optional[typing.Callable[[str], None]] = None):
+    """Updates the usage index stored in `target`.
+
+    `on_generation` is called with the name of every generation that is
+    read.
+    """
+    names = list_generations(target)
+    db = _open_index(target)
+    try:
+        indexed = [row[0] for row in db.execute(
+            'SELECT name FROM generations ORDER BY name')]
+
+        new = [name for name in names if name not in indexed]
+        if set(indexed) - set(names) or (indexed and new and new[0] < indexed[-1]):
+            with db:
+                db.execute('DELETE FROM generations')
+                db.execute('DELETE FROM inodes')
+            new = names
+
+        for name in new:
+            if on_generation is not None:
+                on_generation(name)
+
+            inodes = {e.inode: e.size for e in _entries(os.path.join(target, name))
+                      if stat.S_ISREG(e.mode)}
+
+            with db:
+                db.executemany('''
+                    INSERT INTO inodes VALUES (?, ?, ?, ?, 1)
+                    ON CONFLICT (inode) DO UPDATE SET
+                        last = excluded.last, count = count + 1
+                ''', ((inode, size, name, name) for inode, size in inodes.items()))
+                db.execute('INSERT INTO generations VALUES (?, ?, ?)',
+                           (name, len(inodes), sum(inodes.values())))
+    finally:
+        db.close()
+
+
+def generation_usage(target: str) -> typing.List[GenerationUsage]:
+    """Returns the usage of all generations in `target` ordered from oldest
+    to newest. `update_index` must have been called before."""
+    db = _open_index(target)
+    try:
+        added = dict(db.execute(
+            'SELECT first, SUM(size) FROM inodes GROUP BY first'))
+        exclusive = dict(db.execute(
+            'SELECT first, SUM(size) FROM inodes WHERE count = 1 GROUP BY first'))
+
+        return [GenerationUsage(name, files, total, added.get(name, 0),
+                                exclusive.get(name, 0))
+                for name, files, total in db.execute(
+                    'SELECT name, files, total FROM generations ORDER BY name')]
+    finally:
+        db.close()
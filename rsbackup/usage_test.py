@@ -0,0 +1,44 @@
+import os
+
+from rsbackup import usage
+from rsbackup.manifest import write_manifest
+from rsbackup.prune import remove_generations
+
+
+def _link(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.link(src, dst)
+
+
+def test_generation_usage(fixture):
+    d = fixture.dir_name
+    first = os.path.join(d, '2023-01-01_10-00-00')
+    second = os.path.join(d, '2023-01-02_10-00-00')
+    fixture.write(os.path.join(first, 'src', 'unchanged'), b'x' * 100)
+    fixture.write(os.path.join(first, 'src', 'changed'), b'x' * 10)
+    _link(os.path.join(first, 'src', 'unchanged'),
+          os.path.join(second, 'src', 'unchanged'))
+    fixture.write(os.path.join(second, 'src', 'changed'), b'x' * 20)
+    write_manifest(first)
+
+    usage.update_index(d)
+
+    assert usage.generation_usage(d) == [
+        usage.GenerationUsage('2023-01-01_10-00-00', 2, 110, 110, 10),
+        usage.GenerationUsage('2023-01-02_10-00-00', 2, 120, 20, 20),
+    ]
+
+    third = os.path.join(d, '2023-01-03_10-00-00')
+    _link(os.path.join(second, 'src', 'changed'),
+          os.path.join(third, 'src', 'changed'))
+    read = []
+    usage.update_index(d, on_generation=read.append)
+
+    assert read == ['2023-01-03_10-00-00']
+    assert usage.generation_usage(d)[1].exclusive == 0
+
+    remove_generations(d, ['2023-01-01_10-00-00'])
+    usage.update_index(d)
+
+    assert usage.generation_usage(d)[0] ==\
+        usage.GenerationUsage('2023-01-02_10-00-00', 2, 120, 120, 100)
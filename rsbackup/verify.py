@@ -0,0 +1,168 @@
+"""Verifies the integrity of generations.
+
+Verification reads every file of a generation and checks it against the
+generation's manifest. Digests of the file contents are recorded in a store
+inside the target keyed by device, inode, size and modification time. As
+unchanged files are hardlinked between generations, a file already verified
+as part of an earlier generation has a stored digest and is not read again,
+so verifying a new generation only reads the data that actually changed. A
+full verification re-reads all files and compares them with the stored
+digests to detect silent corruption.
+"""
+
+import concurrent.futures
+import hashlib
+import itertools
+import os
+import sqlite3
+import stat
+import typing
+
+from rsbackup.manifest import ManifestEntry, read_manifest, walk_generation
+
+STORE_FILE = '.checksums'
+"Name of the digest store inside the target directory."
+
+_BUFFER_SIZE = 2**20
+_BATCH_SIZE = 256
+
+
+class VerifyResult:
+    """The result of verifying a generation.
+
+    `errors` is a list of tuples containing a path and a description of the
+    problem found.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.hashed = 0
+        self.hashed_bytes = 0
+        self.reused = 0
+        self.errors = []
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+
+def file_digest(path: str) -> bytes:
+    """Returns the SHA-256 digest of the file at `path`. The file is read in
+    large chunks into a reused buffer; hashlib releases the GIL while
+    hashing, so multiple files can be hashed in parallel by threads."""
+    h = hashlib.sha256()
+    buffer = bytearray(_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            h.update(view[:n])
+    return h.digest()
+
+
+def _open_store(target: str) -> sqlite3.Connection:
+    db = sqlite3.connect(os.path.join(target, STORE_FILE))
+    db.execute('''CREATE TABLE IF NOT EXISTS digests (
+        dev INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        digest BLOB NOT NULL,
+        PRIMARY KEY (dev, inode, size, mtime)
+    ) WITHOUT ROWID''')
+    return db
+
+
+def _check(generation_dir: str, entry: ManifestEntry) -> typing.Tuple[typing.Optional[os.stat_result], typing.Optional[str]]:
+    "Compares entry with the file on disk and returns its stat and an error."
+    try:
+        st = os.lstat(os.path.join(generation_dir, entry.path))
+    except FileNotFoundError:
+        return None, 'missing'
+    except OSError as e:
+        return None, str(e)
+
+    if st.st_size != entry.size:
+        return st, f"size changed from {entry.size} to {st.st_size}"
+    if st.st_mtime_ns != entry.mtime:
+        return st, 'modification time changed'
+    return st, None
+
+
+def verify_generation(target: str, generation: str,
+                      workers: typing.Optional[int] = None,
+                      full: bool = False,
+                      on_progress: typing.Optional[typing.Callable[[VerifyResult], None]] = None) -> VerifyResult:
+    """Verifies the generation named `generation` in `target`.
+
+    All regular files listed in the generation's manifest are checked to
+    still exist with the recorded size and modification time. Files without
+    a stored digest are hashed using `workers` threads and their digests are
+    recorded; files hardlinked within the generation are hashed once. If
+    `full` is `True`, all files are hashed and compared with their stored
+    digests. Generations without a manifest are walked and only
+    hashed.
+
+    `on_progress` is called with the intermediate result after each batch of
+    files.
+    """
+    generation_dir = os.path.join(target, generation)
+    entries = read_manifest(generation_dir)
+    check_manifest = entries is not None
+    if entries is None:
+        entries = walk_generation(generation_dir)
+
+    result = VerifyResult()
+    db = _open_store(target)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            files = (e for e in entries if stat.S_ISREG(e.mode))
+            while batch := list(itertools.islice(files, _BATCH_SIZE)):
+                to_hash = []
+                keys = set()
+                for entry in batch:
+                    result.files += 1
+                    st, error = _check(generation_dir, entry)
+                    if error is not None and (check_manifest or st is None):
+                        result.errors.append((entry.path, error))
+                        continue
+
+                    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+                    if key in keys:
+                        # Another link to a file already hashed in this batch.
+                        result.reused += 1
+                        continue
+                    row = db.execute(
+                        'SELECT digest FROM digests WHERE dev = ? AND inode = ? '
+                        'AND size = ? AND mtime = ?', key).fetchone()
+                    if row is not None and not full:
+                        result.reused += 1
+                        continue
+
+                    keys.add(key)
+                    to_hash.append((entry, key, row[0] if row else None))
+
+                futures = [executor.submit(file_digest, os.path.join(generation_dir, e.path))
+                           for e, _, _ in to_hash]
+
+                with db:
+                    for (entry, key, stored), future in zip(to_hash, futures):
+                        try:
+                            digest = future.result()
+                        except OSError as e:
+                            result.errors.append((entry.path, str(e)))
+                            continue
+
+                        result.hashed += 1
+                        result.hashed_bytes += key[2]
+                        if stored is None:
+                            db.execute('INSERT INTO digests VALUES (?, ?, ?, ?, ?)',
+                                       key + (digest,))
+                        elif stored != digest:
+                            result.errors.append((entry.path, 'checksum mismatch'))
+
+                if on_progress is not None:
+                    on_progress(result)
+    finally:
+        db.close()
+
+    return result
@@ -0,0 +1,66 @@
+import hashlib
+import os
+
+from rsbackup.manifest import write_manifest
+from rsbackup.verify import file_digest, verify_generation
+
+
+def test_file_digest(fixture):
+    d = fixture.dir_name
+    content = os.urandom(3 * 2**20 + 17)
+    fixture.write(os.path.join(d, 'data'), content)
+    assert file_digest(os.path.join(d, 'data')) == hashlib.sha256(content).digest()
+
+
+def test_verify_generation_reuses_digests_of_hardlinked_files(fixture):
+    d = fixture.dir_name
+    first = os.path.join(d, '2023-01-01_10-00-00')
+    second = os.path.join(d, '2023-01-02_10-00-00')
+    fixture.write(os.path.join(first, 'src', 'spam'), b'spam')
+    os.makedirs(os.path.join(second, 'src'))
+    os.link(os.path.join(first, 'src', 'spam'), os.path.join(second, 'src', 'spam'))
+    fixture.write(os.path.join(second, 'src', 'eggs'), b'eggs')
+    write_manifest(first)
+    write_manifest(second)
+
+    result = verify_generation(d, '2023-01-01_10-00-00')
+    assert (result.files, result.hashed, result.reused) == (1, 1, 0)
+
+    result = verify_generation(d, '2023-01-02_10-00-00', workers=2)
+    assert (result.files, result.hashed, result.reused) == (2, 1, 1)
+    assert result.success
+
+
+def test_verify_generation_hashes_hardlinked_files_once(fixture):
+    d = fixture.dir_name
+    gen = os.path.join(d, '2023-01-01_10-00-00')
+    fixture.write(os.path.join(gen, 'spam'), b'spam')
+    os.link(os.path.join(gen, 'spam'), os.path.join(gen, 'eggs'))
+    write_manifest(gen)
+
+    result = verify_generation(d, '2023-01-01_10-00-00')
+    assert (result.files, result.hashed, result.reused) == (2, 1, 1)
+    assert result.success
+
+    result = verify_generation(d, '2023-01-01_10-00-00', full=True)
+    assert (result.files, result.hashed, result.reused) == (2, 1, 1)
+    assert result.success
+
+
+def test_verify_generation_detects_changes(fixture):
+    d = fixture.dir_name
+    gen = os.path.join(d, '2023-01-01_10-00-00')
+    fixture.write(os.path.join(gen, 'spam'), b'spam')
+    fixture.write(os.path.join(gen, 'eggs'), b'eggs')
+    write_manifest(gen)
+    verify_generation(d, '2023-01-01_10-00-00')
+
+    st = os.stat(os.path.join(gen, 'spam'))
+    with open(os.path.join(gen, 'spam'), 'r+b') as f:
+        f.write(b'SPAM')
+    os.utime(os.path.join(gen, 'spam'), ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.remove(os.path.join(gen, 'eggs'))
+
+    result = verify_generation(d, '2023-01-01_10-00-00', full=True)
+    assert sorted(result.errors) == [
+        ('eggs', 'missing'), ('spam', 'checksum mismatch')]